@@ -0,0 +1,119 @@
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from stations import get_station, get_station_store
+
+AGGREGATE_PARAMS = ['TDS', 'pH', 'Depth']
+GRANULARITIES = ['season', 'month', 'day', 'hour']
+PERCENTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+TIME_FREQ = {'month': 'MS', 'day': 'D', 'hour': 'h'}
+
+
+def group_keys(df, granularity):
+    # Time buckets use the sensor's wall-clock time
+    if granularity == 'season':
+        return df['Season']
+    local = df['Datetime'].dt.tz_localize(None)
+    if granularity == 'month':
+        return local.dt.to_period('M').dt.start_time
+    return local.dt.floor(TIME_FREQ[granularity])
+
+
+def summarize(df, granularity, params=AGGREGATE_PARAMS):
+    # One grouped pass per statistic; columns are (param, stat)
+    keys = group_keys(df, granularity)
+    grouped = df[params].groupby(keys, observed=True)
+    parts = {
+        'count': grouped.count(),
+        'sum': grouped.sum(),
+        'sumsq': (df[params] ** 2).groupby(keys, observed=True).sum(),
+        'min': grouped.min(),
+        'max': grouped.max(),
+    }
+    quantiles = grouped.quantile(PERCENTILES).unstack()
+    for q in PERCENTILES:
+        parts[f'p{int(q * 100)}'] = quantiles.xs(q, axis=1, level=1)
+
+    table = pd.concat(parts, axis=1).swaplevel(axis=1).sort_index(axis=1)
+    table.index.name = granularity
+    return table
+
+
+class SensorAggregates:
+    # Materialised per-season/month/day/hour statistics of the sensor log.
+    # New readings only recompute the groups they fall into.
+
+    def __init__(self, store):
+        self.store = store
+        self.params = store.parameters
+        self._tables = {}
+        self._records = {}
+        self._lock = threading.Lock()
+        self._rebuild(store.get())
+        store.subscribe(self._on_change)
+
+    def _rebuild(self, df):
+        with self._lock:
+            self._tables = {g: summarize(df, g, self.params) for g in GRANULARITIES}
+            self._records = {}
+
+    def _on_change(self, df, new_rows, reloaded):
+        if reloaded:
+            self._rebuild(df)
+            return
+
+        with self._lock:
+            tables = dict(self._tables)
+            for granularity in GRANULARITIES:
+                touched = pd.unique(group_keys(new_rows, granularity))
+                rows = self._rows_for(df, granularity, touched)
+                fresh = summarize(rows, granularity, self.params)
+                fresh = fresh[fresh.index.isin(touched)]
+                table = tables[granularity]
+                table = pd.concat([table[~table.index.isin(touched)], fresh])
+                tables[granularity] = table.sort_index()
+            self._tables = tables
+            self._records = {}
+
+    def _rows_for(self, df, granularity, keys):
+        if granularity == 'season':
+            return df[df['Season'].isin(keys)]
+        # Time buckets are contiguous, so the affected rows are a tail slice
+        start = pd.Timestamp(min(keys)).tz_localize(df['Datetime'].dt.tz)
+        return df.iloc[df['Datetime'].searchsorted(start):]
+
+    def table(self, granularity):
+        self.store.refresh()
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity '{granularity}', expected one of {GRANULARITIES}")
+        return self._tables[granularity]
+
+    def stats(self, granularity, key, param):
+        # count/sum/sumsq/min/max/percentiles plus the derived mean and std,
+        # memoised until the next change to the sensor log
+        self.store.refresh()
+        records = self._records
+        table = self.table(granularity)
+        cached = records.get((granularity, key, param))
+        if cached is not None:
+            return cached
+
+        result = table.loc[key, param].to_dict()
+        count = result['count']
+        result['mean'] = result['sum'] / count if count else np.nan
+        variance = result['sumsq'] / count - result['mean'] ** 2 if count else np.nan
+        result['std'] = float(np.sqrt(max(variance, 0))) if count else np.nan
+        records[(granularity, key, param)] = result
+        return result
+
+
+def get_aggregates(station=None):
+    return _station_aggregates(get_station(station)['id'])
+
+
+@lru_cache(maxsize=None)
+def _station_aggregates(station_id):
+    return SensorAggregates(get_station_store(station_id))
@@ -0,0 +1,169 @@
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from sensor_store import to_timestamp
+from stations import get_station, get_station_store
+
+# Detection settings per parameter. Windows are trailing (causal) so running
+# the detectors on newly ingested readings gives the same events as a full
+# pass over the history.
+DETECT_PARAMS = ['TDS', 'pH', 'Depth']
+VALID_RANGE = {'pH': (0.1, 14.0), 'TDS': (0.0, 3000.0), 'Depth': (0.0, 100.0)}
+MAX_RATE_PER_HOUR = {'pH': 3.0, 'TDS': 600.0, 'Depth': 400.0}
+MIN_MAD = {'pH': 0.02, 'TDS': 2.0, 'Depth': 1.0}
+STUCK_MIN_RUN = {'pH': 144, 'TDS': 36, 'Depth': 36}
+MAD_WINDOW = 25
+MAD_THRESHOLD = 6.0
+GAP_THRESHOLD = pd.Timedelta(hours=1)
+
+EVENT_KINDS = ['range', 'spike', 'rate', 'stuck', 'gap']
+EVENT_COLUMNS = ['kind', 'param', 'start', 'end', 'points', 'peak_time', 'peak_value', 'score']
+
+
+def _runs(mask):
+    # (start, end) index pairs of consecutive True values
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges[0::2], edges[1::2] - 1
+
+
+def _flag_events(kind, param, times, values, flags, score):
+    starts, ends = _runs(flags)
+    if not len(starts):
+        return []
+    # Peak = most severe point of each run
+    run_id = np.cumsum(np.concatenate(([0], np.diff(flags.astype(np.int8)) == 1)))[flags]
+    idx = np.flatnonzero(flags)
+    order = np.lexsort((-score[idx], run_id))
+    first = np.concatenate(([True], run_id[order][1:] != run_id[order][:-1]))
+    peaks = idx[order][first]
+    return [{'kind': kind, 'param': param, 'start': times[s], 'end': times[e], 'points': int(e - s + 1),
+             'peak_time': times[p], 'peak_value': float(values[p]), 'score': float(score[p])}
+            for s, e, p in zip(starts, ends, peaks)]
+
+
+def detect(df, params=DETECT_PARAMS):
+    # Single vectorised pass over a sorted slice of the sensor log
+    if df.empty:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+
+    times = df['Datetime'].array
+    hours = np.diff(df['Datetime'].values.view('int64')) / 3.6e12
+    events = []
+
+    for param in params:
+        series = df[param].astype(float)
+        values = series.to_numpy()
+        valid = ~np.isnan(values)
+
+        low, high = VALID_RANGE[param]
+        out_of_range = valid & ((values < low) | (values > high))
+        distance = np.where(values < low, low - values, values - high)
+        events += _flag_events('range', param, times, values, out_of_range, distance)
+
+        # Rolling median/MAD z-score over in-range readings only
+        clean = series.where(valid & ~out_of_range)
+        median = clean.rolling(MAD_WINDOW, min_periods=5).median()
+        mad = (clean - median).abs().rolling(MAD_WINDOW, min_periods=5).median()
+        robust_z = 0.6745 * (clean - median) / np.maximum(mad, MIN_MAD[param])
+        z = np.abs(robust_z.to_numpy())
+        spikes = np.nan_to_num(z) > MAD_THRESHOLD
+        events += _flag_events('spike', param, times, values, spikes, np.nan_to_num(z))
+
+        rate = np.zeros(len(values))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate[1:] = np.abs(np.diff(values)) / hours
+        rate = np.nan_to_num(rate, posinf=0.0)
+        events += _flag_events('rate', param, times, values, rate > MAX_RATE_PER_HOUR[param], rate)
+
+        # Stuck sensor: the same value repeated for too many readings
+        changes = np.flatnonzero(np.diff(values) != 0) + 1
+        starts = np.concatenate(([0], changes))
+        ends = np.concatenate((changes, [len(values)])) - 1
+        lengths = ends - starts + 1
+        for s, e in zip(starts[lengths >= STUCK_MIN_RUN[param]], ends[lengths >= STUCK_MIN_RUN[param]]):
+            if valid[s]:
+                events.append({'kind': 'stuck', 'param': param, 'start': times[s], 'end': times[e],
+                               'points': int(e - s + 1), 'peak_time': times[s],
+                               'peak_value': float(values[s]), 'score': float(e - s + 1)})
+
+    # Gaps in reporting affect every parameter
+    gap_at = np.flatnonzero(hours * 3.6e12 > GAP_THRESHOLD.value)
+    for i in gap_at:
+        events.append({'kind': 'gap', 'param': 'all', 'start': times[i], 'end': times[i + 1], 'points': 0,
+                       'peak_time': times[i], 'peak_value': np.nan, 'score': float(hours[i])})
+
+    table = pd.DataFrame(events, columns=EVENT_COLUMNS)
+    return table.sort_values(['start', 'kind', 'param'], kind='stable').reset_index(drop=True)
+
+
+class AnomalyIndex:
+    # Events detected over the sensor log, sorted by start time so range
+    # queries are a binary search. Appended readings re-run the detectors
+    # on a short trailing context only.
+
+    def __init__(self, store):
+        self.store = store
+        # Only parameters with detection settings are checked
+        self.params = [p for p in DETECT_PARAMS if p in store.parameters]
+        self._lock = threading.Lock()
+        self._events = detect(store.get(), self.params)
+        store.subscribe(self._on_change)
+
+    def _context_start(self, df, first_new):
+        # Far enough back for the rolling windows, any stuck run in progress
+        # and any event still open at that point
+        start = max(first_new - MAD_WINDOW - 1, 0)
+        for param in self.params:
+            values = df[param].to_numpy()
+            before = np.flatnonzero(values[:start] != values[start])
+            start = min(start, before[-1] + 1 if len(before) else 0)
+        boundary = df['Datetime'].iloc[start]
+        open_events = self._events[self._events['end'] >= boundary]
+        if not open_events.empty:
+            earliest = open_events['start'].min()
+            start = min(start, int(df['Datetime'].searchsorted(earliest)))
+        return start
+
+    def _on_change(self, df, new_rows, reloaded):
+        with self._lock:
+            if reloaded:
+                self._events = detect(df, self.params)
+                return
+            first_new = int(df['Datetime'].searchsorted(new_rows['Datetime'].iloc[0]))
+            start = self._context_start(df, first_new)
+            boundary = df['Datetime'].iloc[start]
+            # The MAD is a median of deviations from a median: two windows back
+            fresh = detect(df.iloc[max(start - 2 * MAD_WINDOW, 0):], self.params)
+            fresh = fresh[fresh['start'] >= boundary]
+            kept = self._events[self._events['start'] < boundary]
+            # Empty frames are left out: pandas warns about (and will change)
+            # how their dtypes combine
+            parts = [part for part in (kept, fresh) if not part.empty] or [kept]
+            self._events = pd.concat(parts, ignore_index=True)
+
+    def events(self, start=None, end=None, params=None, kinds=None):
+        self.store.refresh()
+        events = self._events
+        tz = self.store.get()['Datetime'].dt.tz
+        if end is not None:
+            events = events.iloc[:events['start'].searchsorted(to_timestamp(end, tz), side='right')]
+        if start is not None:
+            events = events[events['end'] >= to_timestamp(start, tz)]
+        if params:
+            events = events[events['param'].isin(list(params) + ['all'])]
+        if kinds:
+            events = events[events['kind'].isin(kinds)]
+        return events
+
+
+def get_anomaly_index(station=None):
+    return _station_anomaly_index(get_station(station)['id'])
+
+
+@lru_cache(maxsize=None)
+def _station_anomaly_index(station_id):
+    return AnomalyIndex(get_station_store(station_id))
@@ -1,3 +1,6 @@
+import time
+_import_started = time.perf_counter()
+
 from flask import Flask
 from home import home_bp
 from insights import insights_bp
@@ -5,6 +8,19 @@ from dashboard import dashboard_bp
 from contact import contact_bp
 from gallery import gallery_bp
 from iot import iot_bp
+from geomap import geomap_bp
+from compliance import compliance_bp
+from ingest import ingest_bp
+from live import live_bp
+from warmup import warmup_bp, start_warmup, WARMUP_ENABLED
+from aggregates import get_aggregates
+from anomalies import get_anomaly_index
+from datasets import PRELOAD, preload
+from figure_json import preload_plotly
+from geo import load_geodata
+from instrumentation import init_instrumentation
+from stations import get_station_store, station_ids
+from water_quality import load_surveys
 app = Flask(__name__)
 
 app.register_blueprint(home_bp)
@@ -13,10 +29,43 @@ app.register_blueprint(dashboard_bp)
 app.register_blueprint(contact_bp)
 app.register_blueprint(gallery_bp)
 app.register_blueprint(iot_bp)
+app.register_blueprint(geomap_bp)
+app.register_blueprint(compliance_bp)
+app.register_blueprint(ingest_bp)
+app.register_blueprint(live_bp)
+app.register_blueprint(warmup_bp)
+
+# Server-Timing headers and /metrics (NALLAMPATTI_INSTRUMENT=0 turns them
+# off); NALLAMPATTI_PROFILE=1 also samples the slowest requests' stacks
+init_instrumentation(app)
 
 port = 6060  # You can change this to any port number you want
 app.config['PORT'] = port
 
+# Optional: load the datasets, surveys, wards, sensor logs (with their
+# aggregates and anomaly index) and Plotly's figure classes now rather than
+# on first use (NALLAMPATTI_PRELOAD=1; gunicorn.conf.py sets it so that
+# forked workers share them)
+if PRELOAD:
+    preload_plotly()
+    preload()
+    load_surveys()
+    load_geodata()
+    for station in station_ids():
+        get_station_store(station).get()
+        get_aggregates(station)
+        get_anomaly_index(station)
+
+# Time from importing this module to a ready app, reported by /ready
+app.config['STARTUP_SECONDS'] = round(time.perf_counter() - _import_started, 4)
+app.logger.info('App ready in %.3fs', app.config['STARTUP_SECONDS'])
+
+# Optional: pre-render chart variants in the background (NALLAMPATTI_WARMUP=1).
+# A preloading master finishes first: workers forked from it inherit the
+# rendered charts, which a background thread in the master would never reach.
+if WARMUP_ENABLED:
+    start_warmup(app, wait=PRELOAD)
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=port)
     print(f"Application is running on port {port}")
\ No newline at end of file
@@ -0,0 +1,87 @@
+# Compare the old chart-endpoint serialisation paths against figure_json.
+# Run from the repository root: python benchmarks/figure_json.py
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plotly
+import plotly.express as px
+import plotly.graph_objects as go
+from flask import Flask, jsonify
+
+import figure_json
+from dashboard import load_data
+from sensor_store import get_sensor_store
+
+ROUNDS = 20
+
+
+def build_figures():
+    death_df, household_df, _ = load_data()
+    sensor_df = get_sensor_store().get()
+    counts = household_df['Source_of_drinking'].value_counts()
+    return {
+        'histogram': px.histogram(death_df, x='Age', color='Reason'),
+        'pie': px.pie(values=counts.values, names=counts.index, hole=0.3),
+        'sensor_72k': go.Figure(go.Scatter(x=sensor_df['Datetime'], y=sensor_df['TDS'])),
+    }
+
+
+def legacy_dashboard(fig):
+    # JSON string embedded in a jsonify payload (old dashboard.py)
+    return jsonify({'chart': json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)}).get_data()
+
+
+def legacy_insights(fig):
+    # to_json, parsed back and re-encoded by jsonify (old insights.py)
+    return jsonify({'chart': json.loads(fig.to_json())}).get_data()
+
+
+def single_pass(engine):
+    def encode(fig):
+        # Switched only for this call, so no engine outlives its benchmark
+        previous = figure_json.JSON_ENGINE
+        figure_json.JSON_ENGINE = engine
+        try:
+            return figure_json.figure_response({'chart': fig}).get_data()
+        finally:
+            figure_json.JSON_ENGINE = previous
+    return encode
+
+
+def measure(encode, fig):
+    timings = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        body = encode(fig)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return len(body), timings[len(timings) // 2] * 1000
+
+
+def main():
+    paths = {
+        'legacy dashboard (json in json)': legacy_dashboard,
+        'legacy insights (to_json+loads+jsonify)': legacy_insights,
+        'figure_json (json)': single_pass('json'),
+    }
+    try:
+        import orjson  # noqa: F401
+        paths['figure_json (orjson)'] = single_pass('orjson')
+    except ImportError:
+        print('orjson not installed; skipping the orjson engine\n')
+
+    app = Flask(__name__)
+    with app.app_context():
+        for name, fig in build_figures().items():
+            print(f'{name}:')
+            for label, encode in paths.items():
+                size, ms = measure(encode, fig)
+                print(f'  {label:42s} {size:>10,d} bytes {ms:9.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+# HTTP load driver: keeps --concurrency requests in flight against a running
+# server for --duration seconds, cycling through the routes of
+# benchmarks/routes.py, and reports latency percentiles, throughput and
+# payload size per route.
+#
+#   gunicorn -c gunicorn.conf.py app:app &
+#   python benchmarks/load.py --url http://localhost:6060 --concurrency 16 --duration 30
+#
+#   # or start a server on a data directory from benchmarks/synthetic.py
+#   python benchmarks/load.py --serve --data .cache/bench/x10 --filter /api/iot
+#
+# --serve runs gunicorn when it is installed and the Werkzeug development
+# server otherwise; the driver itself is threads, so give the server its own
+# cores when the numbers matter.
+import argparse
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from routes import ROOT, ROUTES, percentile, route_name
+
+SERVE_CHILD = '''
+import sys
+from werkzeug.serving import make_server
+from app import app
+make_server('127.0.0.1', int(sys.argv[1]), app, threaded=True).serve_forever()
+'''
+
+
+def request(base, method, path, body, timeout):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base + path, data=data, method=method,
+                                 headers={'Content-Type': 'application/json'} if data else {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, len(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, len(e.read())
+
+
+def drive(base, routes, concurrency, duration, timeout=60):
+    # Per route: a list of (latency, status, bytes)
+    samples = {route_name(*route): [] for route in routes}
+    cycle = itertools.cycle(routes)
+    cycle_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with cycle_lock:
+                method, path, body = next(cycle)
+            started = time.perf_counter()
+            try:
+                status, size = request(base, method, path, body, timeout)
+            except OSError:
+                status, size = None, 0
+            samples[route_name(method, path, body)].append((time.perf_counter() - started, status, size))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def report(samples, elapsed):
+    print(f'{"route":<56}{"requests":>9}{"errors":>7}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"req/s":>8}{"bytes":>11}')
+    total = errors = 0
+    for name, results in samples.items():
+        if not results:
+            continue
+        latencies = sorted(r[0] for r in results)
+        failed = sum(1 for r in results if r[1] != 200)
+        sizes = [r[2] for r in results if r[1] == 200]
+        total += len(results)
+        errors += failed
+        print(f'{name[:55]:<56}{len(results):>9}{failed:>7}'
+              f'{percentile(latencies, 50) * 1000:>9.1f}{percentile(latencies, 95) * 1000:>9.1f}'
+              f'{percentile(latencies, 99) * 1000:>9.1f}{len(results) / elapsed:>8.1f}'
+              f'{(sum(sizes) // len(sizes) if sizes else 0):>11,d}')
+    latencies = sorted(r[0] for results in samples.values() for r in results)
+    print(f'\n{total} requests in {elapsed:.1f}s: {total / elapsed:.1f} req/s, {errors} errors, '
+          f'p50 {percentile(latencies, 50) * 1000:.1f} ms, p95 {percentile(latencies, 95) * 1000:.1f} ms, '
+          f'p99 {percentile(latencies, 99) * 1000:.1f} ms')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve(data, workers):
+    # Starts a server on a free port in the data directory; returns the
+    # process and its base URL once it answers
+    port = free_port()
+    cwd = os.path.abspath(data or ROOT)
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    try:
+        import gunicorn  # noqa: F401
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                   '--bind', f'127.0.0.1:{port}', '--workers', str(workers), 'app:app']
+    except ImportError:
+        command = [sys.executable, '-c', SERVE_CHILD, str(port)]
+    process = subprocess.Popen(command, cwd=cwd, env=env)
+    base = f'http://127.0.0.1:{port}'
+    for _ in range(600):
+        if process.poll() is not None:
+            sys.exit(f'Server exited with {process.returncode}')
+        try:
+            request(base, 'GET', '/ready', None, 5)
+            return process, base
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    sys.exit('Server did not come up')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive HTTP load against the app and report latency per route')
+    parser.add_argument('--url', default='http://localhost:6060')
+    parser.add_argument('--serve', action='store_true', help='start a server instead of using --url')
+    parser.add_argument('--data', help='with --serve: data directory from benchmarks/synthetic.py')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='with --serve: gunicorn workers')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--filter', help='only routes whose name contains this')
+    args = parser.parse_args()
+
+    routes = [route for route in ROUTES if not args.filter or args.filter in route_name(*route)]
+    if not routes:
+        sys.exit('No routes match --filter')
+    process = None
+    base = args.url.rstrip('/')
+    if args.serve:
+        process, base = serve(args.data, args.workers)
+    try:
+        # One untimed pass so the first-use loads are not in the percentiles
+        for method, path, body in routes:
+            request(base, method, path, body, 300)
+        samples, elapsed = drive(base, routes, args.concurrency, args.duration)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    report(samples, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+# In-process benchmarks of every page and chart route through the Flask test
+# client, and of the hot functions behind them. Each route is timed with the
+# response cache cleared before every call (the full render; datasets and
+# indexes stay loaded) and again with it warm.
+#
+#   python benchmarks/routes.py
+#   python benchmarks/routes.py --data .cache/bench/x10 --json x10.json
+#   python benchmarks/routes.py --compare x10.json --filter iot
+#
+# --data runs against a directory made by benchmarks/synthetic.py.
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# (method, path, json body) of every route worth timing, with the arguments
+# the pages send
+ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/iot', None),
+    ('GET', '/dashboards', None),
+    ('GET', '/insights/', None),
+    ('GET', '/map', None),
+    ('GET', '/gallery', None),
+    ('GET', '/contact', None),
+    ('GET', '/mortality_charts?age_min=0&age_max=100', None),
+    ('GET', '/mortality_charts?age_min=40&age_max=80', None),
+    ('GET', '/infrastructure_charts?ward=All', None),
+    ('GET', '/infrastructure_charts?ward=3', None),
+    ('GET', '/agriculture_chart', None),
+    ('GET', '/health_water_charts', None),
+    ('POST', '/insights/update_household_chart', {'selected_category': 'Source_of_drinking'}),
+    ('POST', '/insights/update_general_chart', {'selected_column': 'Disease'}),
+    ('POST', '/insights/update_general_chart', {'selected_column': 'Occupation'}),
+    ('GET', '/insights/cohort?ward=1&by=sex', None),
+    ('GET', '/insights/cohort/facets', None),
+    ('GET', '/api/iot/window', None),
+    ('GET', '/api/iot/series?resample=1D', None),
+    ('GET', '/api/iot/series?start=2023-01-01&end=2023-03-01', None),
+    ('GET', '/api/iot/anomalies', None),
+    ('GET', '/api/iot/compare', None),
+    ('GET', '/api/compliance/surveys?param=Hardness', None),
+    ('GET', '/api/compliance/wqi', None),
+    ('GET', '/api/compliance/stream', None),
+    ('GET', '/api/map/wards', None),
+    ('GET', '/api/map/points?layer=households&zoom=14', None),
+    ('GET', '/api/map/surface?year=2023&base=2021&param=pH', None),
+    ('GET', '/api/map/wells', None),
+]
+
+
+def route_name(method, path, body=None):
+    name = f'{method} {path}'
+    return f'{name} {json.dumps(body, sort_keys=True)}' if body else name
+
+
+def use_data(path):
+    # The app reads its data relative to the working directory, so this must
+    # run before it is imported
+    os.chdir(os.path.abspath(path or ROOT))
+
+
+def percentile(sorted_values, q):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {'rounds': len(timings), 'min': timings[0], 'median': percentile(timings, 50),
+            'p95': percentile(timings, 95), 'mean': sum(timings) / len(timings)}
+
+
+def measure(fn, rounds, warmup=1, before=None):
+    # Times `rounds` calls of fn() after `warmup` untimed ones; `before` runs
+    # untimed ahead of every call
+    for _ in range(warmup):
+        if before:
+            before()
+        fn()
+    timings = []
+    for _ in range(rounds):
+        if before:
+            before()
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+
+def function_cases():
+    # name -> (zero-argument callable, untimed setup before each call or None)
+    import dashboard
+    import data_cache
+    import datasets
+    import insights
+    from cohorts import value_counts
+
+    def forget_datasets():
+        datasets.reset()
+        dashboard.clear_cache()
+
+    def forget_columnar():
+        # Also drop the columnar copies, so the CSVs are parsed again
+        forget_datasets()
+        for path in dashboard.DATA_FILES:
+            data_cache.clear_cache(path)
+
+    household, general = insights.load_data()
+    cases = {
+        'dashboard.load_data (columnar cache)': (dashboard.load_data, forget_datasets),
+        'dashboard.load_data (cold)': (dashboard.load_data, forget_columnar),
+        'dashboard.load_cubes (uncached)': (dashboard.load_cubes, dashboard.clear_cache),
+    }
+    for option in insights.household_options:
+        column = option['value']
+        counts = value_counts(household, column, 'Household_lifestyle.csv')
+        cases[f'generate_household_summary[{column}]'] = (
+            lambda column=column, counts=counts: insights.generate_household_summary(column, counts), None)
+    for column in ('Disease', 'Occupation', 'Age'):
+        counts = value_counts(general, column, '1500Data.csv')
+        cases[f'generate_general_summary[{column}]'] = (
+            lambda column=column, counts=counts: insights.generate_general_summary(column, counts), None)
+    return cases
+
+
+def route_cases(app, routes):
+    from response_cache import response_cache
+
+    client = app.test_client()
+    cases = {}
+    for method, path, body in routes:
+        def call(method=method, path=path, body=body):
+            response = client.open(path, method=method, json=body)
+            if response.status_code != 200:
+                raise RuntimeError(f'{method} {path} returned {response.status_code}')
+            return len(response.get_data())
+        cases[route_name(method, path, body)] = (call, response_cache.clear)
+    return cases
+
+
+def run(rounds, pattern=None):
+    started = time.perf_counter()
+    from app import app
+    results = {'import': {'seconds': time.perf_counter() - started}, 'functions': {}, 'routes': {}}
+
+    for name, (fn, before) in function_cases().items():
+        if pattern and pattern not in name:
+            continue
+        results['functions'][name] = measure(fn, rounds, before=before)
+
+    for name, (call, clear) in route_cases(app, ROUTES).items():
+        if pattern and pattern not in name:
+            continue
+        # The first call also loads whatever the route needs
+        started = time.perf_counter()
+        size = call()
+        first = time.perf_counter() - started
+        results['routes'][name] = {'first': first, 'bytes': size,
+                                   'uncached': measure(call, rounds, warmup=0, before=clear),
+                                   'cached': measure(call, rounds)}
+    return results
+
+
+def _ms(seconds):
+    return f'{seconds * 1000:10.2f}'
+
+
+def _change(value, baseline):
+    if baseline is None:
+        return ''
+    return f'{(value / baseline - 1) * 100:+8.1f}%'
+
+
+def report(results, baseline=None):
+    baseline = baseline or {}
+    print(f"import app: {results['import']['seconds']:.3f}s\n")
+    print(f'{"function":<56}{"median ms":>10}{"p95 ms":>10}{"min ms":>10}')
+    for name, stats in results['functions'].items():
+        old = baseline.get('functions', {}).get(name)
+        print(f"{name:<56}{_ms(stats['median'])}{_ms(stats['p95'])}{_ms(stats['min'])}"
+              f"{_change(stats['median'], old and old['median'])}")
+
+    print(f'\n{"route":<56}{"first ms":>10}{"render ms":>10}{"p95 ms":>10}{"cached ms":>10}{"bytes":>11}')
+    for name, stats in results['routes'].items():
+        old = baseline.get('routes', {}).get(name)
+        print(f"{name[:55]:<56}{_ms(stats['first'])}{_ms(stats['uncached']['median'])}"
+              f"{_ms(stats['uncached']['p95'])}{_ms(stats['cached']['median'])}{stats['bytes']:>11,d}"
+              f"{_change(stats['uncached']['median'], old and old['uncached']['median'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the app routes and hot functions in-process')
+    parser.add_argument('--data', help='data directory from benchmarks/synthetic.py (default: the repository)')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--filter', help='only cases whose name contains this')
+    parser.add_argument('--json', help='write the results here')
+    parser.add_argument('--compare', help='results of an earlier --json run to compare medians with')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    json_path = os.path.abspath(args.json) if args.json else None
+    use_data(args.data)
+    results = run(args.rounds, args.filter)
+    report(results, baseline)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from datasets import get_dataset
+from response_cache import file_signature
+
+# Columns that hold several answers joined by a separator, per source file
+MULTI_VALUED = {
+    '1500Data.csv': {'Disease': ',', 'Substance Abuse': ','},
+    'Household_lifestyle.csv': {'Crops_grown_in_Na': ',', 'Fuel_used_for_cook': ','},
+}
+
+GENERAL_DATA = '1500Data.csv'
+AGE_BANDS = [0, 18, 30, 45, 60, 75, 100]
+AGE_LABELS = ['0-18', '19-30', '31-45', '46-60', '61-75', '75+']
+# Cohort facets: query name -> source column (age is banded first). Multi-
+# valued columns get one bitmap per answer, so a person counts under each
+# disease they reported.
+FACETS = {
+    'ward': 'Ward',
+    'age': 'Age_Band',
+    'sex': 'Sex',
+    'occupation': 'Occupation',
+    'education': 'Education',
+    'residence': 'Regular_residence',
+    'pesticide': 'Exposure_to_pesticide',
+    'cancer': 'Cancer',
+    'disease': 'Disease',
+    'substance': 'Substance Abuse',
+}
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def label_indicators(values, sep=','):
+    # Sparse boolean matrix with one column per answer in a multi-valued
+    # column; labels are stripped so 'LPG, Firewood' and 'Firewood, LPG'
+    # share their columns
+    values = pd.Series(values)
+    exploded = values.dropna().astype(str).str.split(sep).explode().str.strip()
+    exploded = exploded[exploded != '']
+    codes, labels = pd.factorize(exploded, sort=True)
+    matrix = np.zeros((len(values), len(labels)), dtype=bool)
+    matrix[values.index.get_indexer(exploded.index), codes] = True
+    return pd.DataFrame(matrix, index=values.index, columns=labels).astype(pd.SparseDtype(bool, False))
+
+
+def label_counts(values, sep=','):
+    # How many rows mention each answer, most common first
+    counts = label_indicators(values, sep).sparse.to_dense().sum()
+    return counts.astype(int).sort_values(ascending=False, kind='stable')
+
+
+def value_counts(df, column, path):
+    # value_counts() that splits the multi-valued columns of `path`
+    sep = MULTI_VALUED.get(path, {}).get(column)
+    return df[column].value_counts() if sep is None else label_counts(df[column], sep)
+
+
+class CohortIndex:
+    # One packed bitmap (a bit per person) for every value of every facet.
+    # A query ORs the bitmaps of the values asked for within a facet and
+    # ANDs across facets, then counts bits: a few hundred bytes per bitmap
+    # for this survey, so multi-facet filters stay in the microseconds.
+
+    def __init__(self, df):
+        df = df.reset_index(drop=True)
+        df['Age_Band'] = pd.cut(df['Age'], bins=AGE_BANDS, labels=AGE_LABELS)
+        self.df = df
+        self.size = len(df)
+        self.bitmaps = {}
+        multi = MULTI_VALUED[GENERAL_DATA]
+        for facet, column in FACETS.items():
+            if column in multi:
+                indicators = label_indicators(df[column], multi[column])
+            else:
+                indicators = pd.get_dummies(df[column])
+            self.bitmaps[facet] = {str(value): np.packbits(indicators[value].to_numpy(dtype=bool))
+                                   for value in indicators.columns}
+        self.all = np.packbits(np.ones(self.size, dtype=bool))
+
+    def facets(self):
+        # Each facet's values and how many people have them
+        return {facet: {value: self.count(bits) for value, bits in values.items()}
+                for facet, values in self.bitmaps.items()}
+
+    def select(self, filters):
+        # Bitmap of people matching {facet: [value group, ...]}, where each
+        # group is a list of alternatives; groups of the same facet must all
+        # hold ('disease' with ['Diabetes'] and ['Hypertension'] is people
+        # with both)
+        bits = self.all.copy()
+        for facet, groups in filters.items():
+            if facet not in self.bitmaps:
+                raise KeyError(f"Unknown facet '{facet}'; expected one of {list(self.bitmaps)}")
+            values = self.bitmaps[facet]
+            for group in groups:
+                unknown = [v for v in group if v not in values]
+                if unknown:
+                    raise KeyError(f'Unknown {facet} values {unknown}')
+                bits &= np.bitwise_or.reduce([values[v] for v in group])
+        return bits
+
+    def count(self, bits):
+        return int(_POPCOUNT[bits].sum())
+
+    def breakdown(self, bits, facet):
+        # Cohort members under each value of one facet
+        return {value: self.count(bits & other) for value, other in self.bitmaps[facet].items()}
+
+    def rows(self, bits):
+        return self.df[np.unpackbits(bits, count=self.size).astype(bool)]
+
+
+def data_version():
+    return file_signature(GENERAL_DATA)
+
+
+def cohort_index():
+    return _cohort_index(data_version())
+
+
+@lru_cache(maxsize=1)
+def _cohort_index(version):
+    return CohortIndex(get_dataset(GENERAL_DATA))
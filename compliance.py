@@ -0,0 +1,452 @@
+import json
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from flask import Blueprint, jsonify, request
+
+import geo
+import water_quality
+from anomalies import GAP_THRESHOLD, VALID_RANGE
+from figure_json import figure_response
+from geo import load_geodata
+from response_cache import cached_response, file_signature
+from sensor_store import to_timestamp
+from stations import UnknownStation, get_station, get_station_store
+from water_quality import load_surveys
+
+compliance_bp = Blueprint('compliance', __name__)
+
+# Drinking-water limit tables as {standard: {parameter: {limit: (low, high)}}}
+# in the units of water_quality.PARAMETERS; None is an open bound. IS 10500
+# gives an acceptable limit and a permissible limit that applies only when
+# there is no alternative source; where it allows no relaxation the two are
+# the same. WHO guideline values have a single limit. Free chlorine is left
+# out: its limits are a minimum residual for treated supply, not for wells.
+# NALLAMPATTI_LIMITS names a JSON file in the same layout whose entries
+# replace or extend these tables.
+LIMITS = {
+    'IS10500': {
+        'pH': {'acceptable': (6.5, 8.5), 'permissible': (6.5, 8.5)},
+        'TDS': {'acceptable': (None, 500.0), 'permissible': (None, 2000.0)},
+        'Turbidity': {'acceptable': (None, 1.0), 'permissible': (None, 5.0)},
+        'Alkalinity': {'acceptable': (None, 200.0), 'permissible': (None, 600.0)},
+        'Hardness': {'acceptable': (None, 200.0), 'permissible': (None, 600.0)},
+        'Calcium': {'acceptable': (None, 75.0), 'permissible': (None, 200.0)},
+        'Magnesium': {'acceptable': (None, 30.0), 'permissible': (None, 100.0)},
+        'Chloride': {'acceptable': (None, 250.0), 'permissible': (None, 1000.0)},
+        'Fluoride': {'acceptable': (None, 1.0), 'permissible': (None, 1.5)},
+        'Nitrate': {'acceptable': (None, 45.0), 'permissible': (None, 45.0)},
+        'Ammonia': {'acceptable': (None, 0.5), 'permissible': (None, 0.5)},
+        'Iron': {'acceptable': (None, 0.3), 'permissible': (None, 0.3)},
+    },
+    'WHO': {
+        'pH': {'acceptable': (6.5, 8.5), 'permissible': (6.5, 8.5)},
+        'TDS': {'acceptable': (None, 600.0), 'permissible': (None, 1000.0)},
+        'Turbidity': {'acceptable': (None, 1.0), 'permissible': (None, 5.0)},
+        'Chloride': {'acceptable': (None, 250.0), 'permissible': (None, 250.0)},
+        'Fluoride': {'acceptable': (None, 1.5), 'permissible': (None, 1.5)},
+        'Nitrate': {'acceptable': (None, 50.0), 'permissible': (None, 50.0)},
+        'Nitrite': {'acceptable': (None, 3.0), 'permissible': (None, 3.0)},
+        'Ammonia': {'acceptable': (None, 1.5), 'permissible': (None, 1.5)},
+        'Iron': {'acceptable': (None, 0.3), 'permissible': (None, 0.3)},
+    },
+}
+LIMIT_LEVELS = ['acceptable', 'permissible']
+LIMITS_FILE = os.environ.get('NALLAMPATTI_LIMITS', 'limits.json')
+DEFAULT_STANDARD = os.environ.get('NALLAMPATTI_STANDARD', 'IS10500')
+
+# Weighted arithmetic WQI: each parameter's sub-index is its distance from
+# the ideal value as a percentage of the distance to the acceptable limit,
+# weighted by the inverse of that limit. Ideal values are 0 except pH.
+WQI_IDEAL = {'pH': 7.0}
+WQI_CLASSES = [(25, 'Excellent'), (50, 'Good'), (75, 'Poor'), (100, 'Very poor'), (np.inf, 'Unsuitable')]
+
+EXCEEDANCE_COLUMNS = ['parameter', 'year', 'ward', 'well', 'sample', 'name', 'value', 'qualifier', 'unit',
+                      'level', 'limit']
+INTERVAL_COLUMNS = ['start', 'end', 'points', 'peak_value', 'open']
+
+
+class UnknownStandard(LookupError):
+    pass
+
+
+def limits_version():
+    return file_signature(LIMITS_FILE) if os.path.exists(LIMITS_FILE) else ()
+
+
+def load_limits(standard=None):
+    tables = _load_limits(limits_version())
+    standard = standard or DEFAULT_STANDARD
+    try:
+        return tables[standard]
+    except KeyError:
+        raise UnknownStandard(f"Unknown standard '{standard}'; expected one of {list(tables)}") from None
+
+
+@lru_cache(maxsize=1)
+def _load_limits(version):
+    tables = {name: dict(table) for name, table in LIMITS.items()}
+    if version:
+        with open(LIMITS_FILE) as f:
+            for name, table in json.load(f).items():
+                for param, limits in table.items():
+                    tables.setdefault(name, {})[param] = {level: tuple(bounds) for level, bounds in limits.items()}
+    return tables
+
+
+def standards():
+    return list(_load_limits(limits_version()))
+
+
+def outside(values, bounds):
+    # Mask of values beyond (low, high) and how far beyond they are
+    low, high = bounds
+    values = np.asarray(values, dtype=float)
+    excess = np.zeros(len(values))
+    if low is not None:
+        excess = np.maximum(excess, low - values)
+    if high is not None:
+        excess = np.maximum(excess, values - high)
+    return excess > 0, excess
+
+
+def classify(param, values, limits):
+    # 0 within the acceptable limit, 1 beyond it but within the permissible
+    # limit, 2 beyond both; -1 where the standard has no limit
+    if param not in limits:
+        return np.full(len(values), -1, dtype=np.int8)
+    level = np.zeros(len(values), dtype=np.int8)
+    for i, name in enumerate(LIMIT_LEVELS):
+        level[outside(values, limits[param][name])[0]] = i + 1
+    return level
+
+
+def wqi_class(wqi):
+    for upper, label in WQI_CLASSES:
+        if wqi <= upper:
+            return label
+
+
+def sub_indices(params, values, limits):
+    # WQI sub-index and weight of each reading (NaN for parameters the
+    # standard has no upper limit for)
+    standard = pd.Series({p: limits[p]['acceptable'][1] for p in limits if limits[p]['acceptable'][1]})
+    ideal = pd.Series(params).map(WQI_IDEAL).fillna(0.0).to_numpy()
+    limit = pd.Series(params).map(standard).to_numpy(dtype=float)
+    q = 100.0 * np.abs(np.asarray(values, dtype=float) - ideal) / (limit - ideal)
+    return q, 1.0 / limit
+
+
+def wqi_table(readings, keys, limits):
+    # WQI over the readings of each `keys` group: sum(w q) / sum(w)
+    q, w = sub_indices(readings['parameter'].to_numpy(), readings['value'].to_numpy(), limits)
+    frame = readings[keys].assign(wq=q * w, w=w, scored=~np.isnan(q))[~np.isnan(q)]
+    grouped = frame.groupby(keys)
+    table = pd.DataFrame({'wqi': grouped['wq'].sum() / grouped['w'].sum(), 'parameters': grouped['scored'].sum()})
+    table['class'] = table['wqi'].map(wqi_class)
+    return table.reset_index()
+
+
+def data_version():
+    # Survey sources, ward geometry and the limit tables
+    return water_quality.data_version() + geo.data_version() + limits_version()
+
+
+class SurveyCompliance:
+    # Every survey reading classified against one standard. Exceedances are
+    # sorted by parameter, year and ward, with the row range of each prefix
+    # of that key kept in a dict, so "wells over the fluoride limit in 2023"
+    # or the same for one ward is a lookup and a slice.
+
+    def __init__(self, standard):
+        self.standard = standard
+        self.limits = load_limits(standard)
+        long, _ = load_surveys()
+        index, _ = load_geodata()
+
+        readings = long.copy()
+        readings['ward'] = index.locate(readings['lon'].fillna(0.0), readings['lat'].fillna(0.0))
+        level = np.full(len(readings), -1, dtype=np.int8)
+        for param, rows in readings.groupby('parameter', sort=False).indices.items():
+            level[rows] = classify(param, readings['value'].to_numpy()[rows], self.limits)
+        readings['level'] = level
+        self.readings = readings
+
+        exceeded = readings[readings['level'] > 0].copy()
+        exceeded['limit'] = [self.limits[p][LIMIT_LEVELS[lvl - 1]] for p, lvl in
+                             zip(exceeded['parameter'], exceeded['level'])]
+        self.exceedances = exceeded.sort_values(['parameter', 'year', 'ward', 'well'], kind='stable')[
+            EXCEEDANCE_COLUMNS].reset_index(drop=True)
+        self._bounds = {}
+        for depth in (1, 2, 3):
+            keys = ['parameter', 'year', 'ward'][:depth]
+            for key, rows in self.exceedances.groupby(keys, sort=False).indices.items():
+                key = key if isinstance(key, tuple) else (key,)
+                self._bounds[tuple(k.item() if hasattr(k, 'item') else k for k in key)] = (rows[0], rows[-1] + 1)
+
+        self.sample_wqi = wqi_table(readings, ['year', 'sample', 'well', 'ward'], self.limits)
+        # A well's index over its latest survey, and its history by year
+        latest = self.sample_wqi[self.sample_wqi['well'] >= 0].sort_values('year', kind='stable')
+        self.well_wqi = latest.groupby('well').last().reset_index()
+        self.well_wqi['history'] = self.well_wqi['well'].map(
+            latest.groupby('well').apply(lambda g: dict(zip(g['year'].tolist(), g['wqi'].round(2).tolist())),
+                                         include_groups=False))
+
+    def lookup(self, parameter, year=None, ward=None, level='acceptable'):
+        # Readings over `level` for a parameter, optionally one year and ward
+        key = (parameter,) + ((year,) if year is not None else ())
+        if ward is not None and year is not None:
+            key += (ward,)
+        start, end = self._bounds.get(key, (0, 0))
+        rows = self.exceedances.iloc[start:end]
+        if ward is not None and year is None:
+            rows = rows[rows['ward'] == ward]
+        if level == 'permissible':
+            rows = rows[rows['level'] == 2]
+        return rows
+
+
+def survey_compliance(standard=None):
+    standard = standard or DEFAULT_STANDARD
+    load_limits(standard)
+    return _survey_compliance(data_version(), standard)
+
+
+@lru_cache(maxsize=4)
+def _survey_compliance(version, standard):
+    return SurveyCompliance(standard)
+
+
+def exceedance_runs(times, values, bounds, gap=GAP_THRESHOLD.value):
+    # Intervals of consecutive readings beyond `bounds`, as arrays of start
+    # and end (int64 ns), reading count, peak value and open flag. A run
+    # ends at the first reading back within the limit, or at its last reading
+    # when reporting stops for longer than `gap` or the log ends (open).
+    out, excess = outside(values, bounds)
+    if not out.any():
+        return {column: np.empty(0) for column in INTERVAL_COLUMNS}
+    n = len(values)
+    breaks = np.concatenate(([True], np.diff(times) > gap))
+    first = out & (breaks | ~np.concatenate(([False], out[:-1])))
+    run = np.cumsum(first)[out] - 1
+    idx = np.flatnonzero(out)
+    last = idx[np.concatenate((run[1:] != run[:-1], [True]))]
+    starts = np.flatnonzero(first)
+
+    following = np.minimum(last + 1, n - 1)
+    has_next = last + 1 < n
+    closed = has_next & ~breaks[following]
+    order = np.lexsort((-excess[idx], run))
+    peaks = idx[order][np.concatenate(([True], run[order][1:] != run[order][:-1]))]
+    return {'start': times[starts], 'end': np.where(closed, times[following], times[last]),
+            'points': last - starts + 1, 'peak_value': values[peaks], 'open': ~has_next}
+
+
+class StreamCompliance:
+    # Intervals during which a station's readings were beyond each limit of
+    # one standard, per parameter and limit level. Intervals are disjoint and
+    # sorted, with cumulative durations alongside, so the hours out of range
+    # over any window are two binary searches. New readings only re-scan
+    # from the start of the last interval they can extend.
+
+    def __init__(self, store, station, standard):
+        self.store = store
+        self.station = station
+        self.standard = standard
+        self.limits = load_limits(standard)
+        self.params = [p for p in store.parameters if p in self.limits]
+        self._lock = threading.Lock()
+        self._intervals = {}
+        self._scan(store.get())
+        store.subscribe(self._on_change)
+
+    def _readings(self, df, param):
+        # Times (ns) and values of a parameter's valid readings; values outside
+        # the sensor's physical range are faults (see anomalies), not water
+        values = df[param].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        if param in VALID_RANGE:
+            low, high = VALID_RANGE[param]
+            valid &= (values >= low) & (values <= high)
+        return df['Datetime'].values.view('int64')[valid], values[valid]
+
+    def _set(self, key, intervals):
+        durations = intervals['end'] - intervals['start']
+        self._intervals[key] = (intervals, np.concatenate(([0], np.cumsum(durations))))
+
+    def _scan(self, df, since=None):
+        for param in self.params:
+            times, values = self._readings(df, param)
+            for level in LIMIT_LEVELS:
+                key = (param, level)
+                if since is None or key not in self._intervals:
+                    self._set(key, pd.DataFrame(exceedance_runs(times, values, self.limits[param][level])))
+                    continue
+                old, _ = self._intervals[key]
+                # Intervals touching the last old reading, or still open, may
+                # continue into the new readings
+                redo = (old['end'] >= since) | old['open'].astype(bool)
+                start = min([since] + old.loc[redo, 'start'].tolist())
+                rows = times >= start
+                fresh = pd.DataFrame(exceedance_runs(times[rows], values[rows], self.limits[param][level]))
+                self._set(key, pd.concat([old[~redo], fresh], ignore_index=True) if len(fresh) else old[~redo])
+
+    def _on_change(self, df, new_rows, reloaded):
+        with self._lock:
+            first_new = int(df['Datetime'].searchsorted(new_rows['Datetime'].min())) if len(new_rows) else len(df)
+            if reloaded or first_new == 0:
+                self._intervals = {}
+                self._scan(df)
+            else:
+                self._scan(df, since=int(df['Datetime'].values[first_new - 1].view('int64')))
+
+    def _window(self, start, end):
+        tz = self.store.get()['Datetime'].dt.tz
+        lo = to_timestamp(start, tz).value if start is not None else None
+        hi = to_timestamp(end, tz).value if end is not None else None
+        return lo, hi
+
+    def hours(self, param, level='acceptable', start=None, end=None):
+        # Time beyond the limit within [start, end]
+        intervals, cumulative = self._intervals[(param, level)]
+        starts, ends = intervals['start'].to_numpy(), intervals['end'].to_numpy()
+        lo, hi = self._window(start, end)
+        first = int(np.searchsorted(ends, lo, side='right')) if lo is not None else 0
+        last = int(np.searchsorted(starts, hi, side='left')) if hi is not None else len(starts)
+        if last <= first:
+            return 0.0
+        total = cumulative[last] - cumulative[first]
+        if lo is not None:
+            total -= max(0, lo - starts[first])
+        if hi is not None:
+            total -= max(0, ends[last - 1] - hi)
+        return total / 3.6e12
+
+    def intervals(self, param, level='acceptable', start=None, end=None):
+        self.store.refresh()
+        intervals, _ = self._intervals[(param, level)]
+        lo, hi = self._window(start, end)
+        if hi is not None:
+            intervals = intervals.iloc[:np.searchsorted(intervals['start'].to_numpy(), hi, side='right')]
+        if lo is not None:
+            intervals = intervals.iloc[np.searchsorted(intervals['end'].to_numpy(), lo, side='left'):]
+        tz = self.store.get()['Datetime'].dt.tz
+        table = intervals.copy()
+        for column in ('start', 'end'):
+            table[column] = pd.to_datetime(table[column].astype('int64'), utc=True).dt.tz_convert(tz)
+        table['hours'] = (intervals['end'] - intervals['start']).to_numpy() / 3.6e12
+        table['open'] = table['open'].astype(bool)
+        return table
+
+
+def get_stream_compliance(station=None, standard=None):
+    standard = standard or DEFAULT_STANDARD
+    load_limits(standard)
+    return _station_stream_compliance(get_station(station)['id'], standard)
+
+
+@lru_cache(maxsize=None)
+def _station_stream_compliance(station_id, standard):
+    return StreamCompliance(get_station_store(station_id), station_id, standard)
+
+
+def _records(table):
+    table = table.astype(object)
+    return table.where(table.notna(), None).to_dict('records')
+
+
+def _level():
+    level = request.args.get('limit', 'acceptable')
+    if level not in LIMIT_LEVELS:
+        raise ValueError(f'limit must be one of {LIMIT_LEVELS}')
+    return level
+
+
+@compliance_bp.route('/api/compliance/limits')
+def compliance_limits():
+    # The limit table of a standard (IS10500 by default)
+    try:
+        limits = load_limits(request.args.get('standard'))
+    except UnknownStandard as e:
+        return jsonify({'error': str(e)}), 404
+    units = {**water_quality.PARAMETERS, 'TDS': 'mg/L'}
+    return figure_response({'standards': standards(),
+                            'limits': {param: {**bounds, 'unit': units.get(param, '')}
+                                       for param, bounds in limits.items()}})
+
+
+@compliance_bp.route('/api/compliance/surveys')
+@cached_response(data_version)
+def compliance_surveys():
+    # Survey readings beyond a parameter's acceptable (or permissible) limit,
+    # optionally for one year and map ward (0 = outside the wards)
+    param = request.args.get('param', '')
+    try:
+        year = int(request.args['year']) if request.args.get('year') else None
+        ward = int(request.args['ward']) if request.args.get('ward') else None
+        level = _level()
+        index = survey_compliance(request.args.get('standard'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownStandard as e:
+        return jsonify({'error': str(e)}), 404
+    if param not in index.limits:
+        return jsonify({'error': f"No {index.standard} limit for '{param}'"}), 400
+
+    rows = index.lookup(param, year, ward, level)
+    return figure_response({'standard': index.standard, 'param': param, 'year': year, 'ward': ward,
+                            'limit': level, 'bounds': index.limits[param][level],
+                            'wells': sorted({int(w) for w in rows['well'] if w >= 0}),
+                            'count': len(rows), 'readings': _records(rows)})
+
+
+@compliance_bp.route('/api/compliance/wqi')
+@cached_response(data_version)
+def compliance_wqi():
+    # Water Quality Index of each survey sample (optionally one year) and of
+    # each well at its latest survey. Surveys measured different parameters,
+    # so `parameters` says how many went into each index.
+    try:
+        year = int(request.args['year']) if request.args.get('year') else None
+        index = survey_compliance(request.args.get('standard'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except UnknownStandard as e:
+        return jsonify({'error': str(e)}), 404
+    samples = index.sample_wqi if year is None else index.sample_wqi[index.sample_wqi['year'] == year]
+    return figure_response({'standard': index.standard, 'classes': WQI_CLASSES[:-1],
+                            'samples': _records(samples.round({'wqi': 2})),
+                            'wells': _records(index.well_wqi.round({'wqi': 2}))})
+
+
+@compliance_bp.route('/api/compliance/stream')
+def compliance_stream():
+    # Hours each sensor parameter spent beyond a limit within [start, end],
+    # and the intervals themselves
+    try:
+        index = get_stream_compliance(request.args.get('station'), request.args.get('standard'))
+    except (UnknownStation, UnknownStandard) as e:
+        return jsonify({'error': str(e)}), 404
+    params = [p for p in request.args.get('params', '').split(',') if p] or index.params
+    unknown = [p for p in params if p not in index.params]
+    if unknown:
+        return jsonify({'error': f'No {index.standard} limit or readings for {unknown}'}), 400
+    start, end = request.args.get('start'), request.args.get('end')
+    try:
+        level = _level()
+        result = {}
+        for param in params:
+            intervals = index.intervals(param, level, start, end)
+            for column in ('start', 'end'):
+                intervals[column] = intervals[column].map(lambda ts: ts.isoformat())
+            result[param] = {'bounds': index.limits[param][level],
+                             'hours': round(index.hours(param, level, start, end), 3),
+                             'count': len(intervals), 'intervals': _records(intervals)}
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    station = get_station(index.station)
+    return figure_response({'station': index.station, 'ward': station['ward'], 'standard': index.standard,
+                            'limit': level, 'start': start, 'end': end, 'params': result})
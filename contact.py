@@ -1,15 +1,309 @@
-from flask import Blueprint, render_template, request, flash
+from flask import Blueprint, render_template, request
+import json
+import os
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from email.errors import MessageError
+from email.headerregistry import Address
+from email.message import EmailMessage
+from functools import lru_cache
 
 contact_bp = Blueprint('contact', __name__)
 
+# Submissions are committed to a local SQLite queue (WAL mode) before the
+# page is returned; a background thread in each process delivers them to the
+# configured sink, so a slow or unreachable mail server never holds up a
+# request. Without a sink they are only kept in the queue.
+QUEUE_PATH = os.environ.get('NALLAMPATTI_CONTACT_DB', os.path.join('instance', 'contact.sqlite3'))
+MAX_ATTEMPTS = int(os.environ.get('NALLAMPATTI_CONTACT_MAX_ATTEMPTS', 8))
+RETRY_BASE = float(os.environ.get('NALLAMPATTI_CONTACT_RETRY_SECONDS', 30.0))
+RETRY_MAX = 6 * 3600.0
+# A message being delivered is leased to one process; if that process dies
+# the lease runs out and another delivers it. Messages are claimed one at a
+# time, so a lease only has to outlast a single send.
+LEASE_SECONDS = 300.0
+# Other processes' submissions are picked up at least this often
+POLL_SECONDS = 30.0
+
+FIELD_LIMITS = {'name': 200, 'email': 254, 'message': 10000}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    lease_until REAL,
+    last_error TEXT,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS messages_due ON messages (status, next_attempt_at);
+"""
+
+
+class DeliveryError(Exception):
+    # A failed delivery; permanent ones (a refused address, a 4xx from the
+    # webhook) are not retried
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class SMTPSink:
+    def __init__(self, host, port=587, username=None, password=None, starttls=True,
+                 sender=None, recipient=None, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.sender = sender
+        self.recipient = recipient
+        self.timeout = timeout
+
+    def build(self, message):
+        email = EmailMessage()
+        email['Subject'] = f"Contact form: {message['name']}"
+        email['From'] = self.sender
+        email['To'] = self.recipient
+        email['Reply-To'] = Address(display_name=message['name'], addr_spec=message['email'])
+        email.set_content(f"From: {message['name']} <{message['email']}>\n\n{message['message']}\n")
+        return email
+
+    def send(self, message):
+        try:
+            email = self.build(message)
+        except (ValueError, IndexError, MessageError) as e:
+            # No retry can make these headers valid
+            raise DeliveryError(f'Invalid message: {e}', permanent=True)
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+                if self.starttls:
+                    smtp.starttls()
+                if self.username:
+                    smtp.login(self.username, self.password)
+                smtp.send_message(email)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+            code = getattr(e, 'smtp_code', None) or min((c for c, _ in e.recipients.values()), default=None)
+            raise DeliveryError(f'SMTP refused: {e}', permanent=code is not None and code >= 500)
+        except smtplib.SMTPAuthenticationError as e:
+            raise DeliveryError(f'SMTP login failed: {e}')
+        except (smtplib.SMTPException, OSError) as e:
+            raise DeliveryError(f'SMTP error: {e!r}')
+
+
+class WebhookSink:
+    # POSTs each message as JSON; any 2xx is a delivery
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, message):
+        body = json.dumps({k: message[k] for k in ('id', 'name', 'email', 'message', 'created_at')}).encode()
+        req = urllib.request.Request(self.url, data=body, method='POST',
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout):
+                pass
+        except urllib.error.HTTPError as e:
+            raise DeliveryError(f'Webhook returned {e.code}',
+                                permanent=400 <= e.code < 500 and e.code not in (408, 429))
+        except OSError as e:
+            raise DeliveryError(f'Webhook error: {e!r}')
+
+
+def sink_from_env():
+    # NALLAMPATTI_CONTACT_WEBHOOK or NALLAMPATTI_SMTP_HOST (with the
+    # recipient in NALLAMPATTI_CONTACT_TO) picks the sink
+    webhook = os.environ.get('NALLAMPATTI_CONTACT_WEBHOOK')
+    if webhook:
+        return WebhookSink(webhook)
+    host = os.environ.get('NALLAMPATTI_SMTP_HOST')
+    if host:
+        recipient = os.environ.get('NALLAMPATTI_CONTACT_TO', 'info@iccwindia.org')
+        return SMTPSink(host, int(os.environ.get('NALLAMPATTI_SMTP_PORT', 587)),
+                        os.environ.get('NALLAMPATTI_SMTP_USER'), os.environ.get('NALLAMPATTI_SMTP_PASSWORD'),
+                        os.environ.get('NALLAMPATTI_SMTP_STARTTLS', '1') == '1',
+                        os.environ.get('NALLAMPATTI_CONTACT_FROM', recipient), recipient)
+    return None
+
+
+def retry_delay(attempts, base=RETRY_BASE):
+    # Exponential backoff with jitter, so retries from several processes
+    # spread out
+    return min(RETRY_MAX, base * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+
+
+class ContactQueue:
+    def __init__(self, path=QUEUE_PATH, sink=None, max_attempts=MAX_ATTEMPTS, retry_base=RETRY_BASE):
+        self.path = path
+        self.sink = sink
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        # One connection per thread; WAL lets the request threads append
+        # while the worker reads, and FULL sync makes every accepted
+        # submission survive a crash
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, name, email, message):
+        now = time.time()
+        cursor = self._connect().execute(
+            'INSERT INTO messages (name, email, message, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)',
+            (name, email, message, now, now))
+        # Wakes the delivery thread, if start() has started one
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def claim(self):
+        # The next due message, leased to this process in one write
+        # transaction; None when nothing is due
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                "SELECT * FROM messages WHERE (status = 'pending' AND next_attempt_at <= ?)"
+                " OR (status = 'sending' AND lease_until < ?) ORDER BY id LIMIT 1",
+                (now, now)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE messages SET status = 'sending', lease_until = ?, attempts = attempts + 1"
+                             " WHERE id = ?", (now + LEASE_SECONDS, row['id']))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return dict(row, attempts=row['attempts'] + 1, lease_until=now + LEASE_SECONDS)
+
+    def _settle(self, message, assignments, values):
+        # Records the outcome only while the lease is still ours: once it has
+        # run out the message may have been claimed again elsewhere
+        cursor = self._connect().execute(
+            f"UPDATE messages SET {assignments}, lease_until = NULL"
+            " WHERE id = ? AND status = 'sending' AND lease_until = ?",
+            (*values, message['id'], message['lease_until']))
+        return cursor.rowcount == 1
+
+    def deliver_due(self):
+        # Sends everything due; returns how many were delivered
+        delivered = 0
+        while True:
+            message = self.claim()
+            if message is None:
+                return delivered
+            try:
+                self.sink.send(message)
+            except Exception as e:
+                permanent = isinstance(e, DeliveryError) and e.permanent
+                if permanent or message['attempts'] >= self.max_attempts:
+                    self._settle(message, "status = 'failed', last_error = ?", (str(e),))
+                else:
+                    self._settle(message, "status = 'pending', last_error = ?, next_attempt_at = ?",
+                                 (str(e), time.time() + retry_delay(message['attempts'], self.retry_base)))
+                continue
+            if self._settle(message, "status = 'sent', sent_at = ?", (time.time(),)):
+                delivered += 1
+
+    def next_due(self):
+        row = self._connect().execute(
+            "SELECT MIN(CASE status WHEN 'pending' THEN next_attempt_at ELSE lease_until END) FROM messages"
+            " WHERE status IN ('pending', 'sending')").fetchone()
+        return row[0]
+
+    def stats(self):
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM messages GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def start(self):
+        if self.sink is not None:
+            self._ensure_thread()
+        return self
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='contact-delivery', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.deliver_due()
+                due = self.next_due()
+            except sqlite3.Error:
+                due = None
+            wait = POLL_SECONDS if due is None else min(POLL_SECONDS, max(0.0, due - time.time()))
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+
+@lru_cache(maxsize=None)
+def get_contact_queue():
+    return ContactQueue(sink=sink_from_env()).start()
+
+
+# Threads and SQLite connections do not survive fork: each worker process
+# opens its own queue (and delivers what the others left pending)
+os.register_at_fork(after_in_child=get_contact_queue.cache_clear)
+
+
+def validate(form):
+    values = {field: (form.get(field) or '').strip() for field in FIELD_LIMITS}
+    missing = [field for field, value in values.items() if not value]
+    if missing:
+        return None, f"Please fill in your {', '.join(missing)}."
+    too_long = [field for field, value in values.items() if len(value) > FIELD_LIMITS[field]]
+    if too_long:
+        return None, f"Your {', '.join(too_long)} is too long."
+    # Name and address go into mail headers
+    if any(c in values['name'] for c in '\r\n'):
+        return None, 'Please keep your name on one line.'
+    if '@' not in values['email'].strip('@'):
+        return None, 'Please enter a valid email address.'
+    try:
+        Address(addr_spec=values['email'])
+    except (ValueError, IndexError, MessageError):
+        return None, 'Please enter a valid email address.'
+    return values, None
+
+
 @contact_bp.route('/contact', methods=['GET', 'POST'])
 def contact():
+    status = None
     if request.method == 'POST':
-        name = request.form.get('name')
-        email = request.form.get('email')
-        message = request.form.get('message')
-        # Here you would typically process the form data, like sending an email or saving to a database
-        flash('Thank you for your message! We will get back to you soon.', 'success')
-
-    content = render_template('contact_content.html')
-    return render_template('base.html', title="Contact Us", content=content)
\ No newline at end of file
+        values, error = validate(request.form)
+        if error:
+            status = ('error', error)
+        else:
+            get_contact_queue().enqueue(values['name'], values['email'], values['message'])
+            status = ('success', 'Thank you for your message! We will get back to you soon.')
+
+    content = render_template('contact_content.html', status=status)
+    return render_template('base.html', title="Contact Us", content=content), 400 if status and status[0] == 'error' else 200
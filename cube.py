@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+
+class CountCube:
+    # Row counts for every combination of a few categorical columns, held as
+    # one dense integer array with an axis per column. Filters select
+    # positions along their axes and everything else is summed away, so a
+    # chart for any ward(s), age range or year is a slice and a sum instead
+    # of a scan of the rows. Missing values get a trailing position on their
+    # axis: they count towards other dimensions' totals but, as with
+    # value_counts(), are not reported as a category.
+
+    def __init__(self, df, dims):
+        self.dims = list(dims)
+        self.categories = {}
+        codes = []
+        for dim in self.dims:
+            code, categories = pd.factorize(df[dim], sort=True)
+            code = np.where(code < 0, len(categories), code)
+            self.categories[dim] = categories
+            codes.append(code)
+        shape = tuple(len(self.categories[dim]) + 1 for dim in self.dims)
+        flat = np.ravel_multi_index(codes, shape) if len(df) else np.empty(0, dtype=np.intp)
+        counts = np.bincount(flat, minlength=int(np.prod(shape)))
+        self.counts = counts.astype(np.min_scalar_type(max(len(df), 1))).reshape(shape)
+        self.total = len(df)
+
+    def _positions(self, dim, selector):
+        # Axis positions picked by a list of values, or an inclusive
+        # (low, high) range for ordered dimensions; None for low or high is
+        # unbounded
+        categories = self.categories[dim]
+        if isinstance(selector, tuple):
+            low, high = selector
+            keep = np.ones(len(categories), dtype=bool)
+            if low is not None:
+                keep &= categories >= low
+            if high is not None:
+                keep &= categories <= high
+        else:
+            keep = np.isin(categories, list(selector))
+        return np.flatnonzero(keep)
+
+    def sum(self, by=(), **filters):
+        # Counts by the `by` dimensions (a Series for one, a DataFrame for two
+        # with the second across the columns) over the rows matching every
+        # filter; with no `by`, the matching row count
+        by = [by] if isinstance(by, str) else list(by)
+        unknown = [dim for dim in list(by) + list(filters) if dim not in self.dims]
+        if unknown:
+            raise KeyError(f'Unknown cube dimensions {unknown}; expected {self.dims}')
+        counts = self.counts
+        for dim, selector in filters.items():
+            if selector is not None:
+                counts = np.take(counts, self._positions(dim, selector), axis=self.dims.index(dim))
+        for dim in by:
+            # Drop the missing-value slot from reported dimensions
+            if dim not in filters or filters[dim] is None:
+                counts = np.take(counts, np.arange(len(self.categories[dim])), axis=self.dims.index(dim))
+        # Sums come back as int64 whatever the storage type: unsigned counts
+        # would be read as categories by plotly's colour scales
+        summed = counts.sum(axis=tuple(i for i, dim in enumerate(self.dims) if dim not in by), dtype=np.int64)
+        if not by:
+            return int(summed)
+
+        # The remaining axes are in cube order; put them in the order asked for
+        kept = [dim for dim in self.dims if dim in by]
+        summed = np.transpose(summed, [kept.index(dim) for dim in by])
+        labels = [self._labels(dim, filters.get(dim)) for dim in by]
+        if len(by) == 1:
+            return pd.Series(summed, index=pd.Index(labels[0], name=by[0]), name='count')
+        return pd.DataFrame(summed, index=pd.Index(labels[0], name=by[0]),
+                            columns=pd.Index(labels[1], name=by[1]))
+
+    def _labels(self, dim, selector):
+        categories = self.categories[dim]
+        return categories if selector is None else categories[self._positions(dim, selector)]
+
+    def value_counts(self, dim, **filters):
+        # Like df[dim].value_counts() on the filtered rows, without empty
+        # categories
+        counts = self.sum(dim, **filters)
+        return counts[counts > 0].sort_values(ascending=False, kind='stable')
@@ -1,82 +1,179 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, jsonify, render_template, request
 import pandas as pd
-import json
-import plotly
-import plotly.express as px
 from functools import lru_cache
+from cube import CountCube
+from datasets import get_dataset
+from response_cache import cached_response, file_signature
+from figure_json import figure_response
+from instrumentation import lap
+import health_water
+from health_water import EXPOSURES, association, correlations, load_features
 
 dashboard_bp = Blueprint('dashboards', __name__)
 
+# plotly.express is imported in the chart views (here and in insights.py): it
+# adds about a tenth of a second to startup and only the chart requests need it
+
 # Professional color scheme
 professional_colors = ['#1f77b4','#ff7f0e', '#aec7e8',  '#ffbb78', '#2ca02c', '#98df8a', '#d62728', '#ff9896']
 blue_scale = ['#e6f2ff', '#bdd7e7', '#6baed6', '#3182bd', '#08519c']
 
-# Data loading and preprocessing
-@lru_cache(maxsize=None)
-def load_data():
-    death_df = pd.read_csv('Death person.csv')
-    household_df = pd.read_csv('Household Lifestyle .csv')
-    agriculture_df = pd.read_csv('Agricultural_practice.csv')
+DATA_FILES = ('Death person.csv', 'Household Lifestyle .csv', 'Agricultural_practice.csv')
+AGE_BINS = [0, 18, 30, 45, 60, 75, 100]
+AGE_LABELS = ['0-18', '19-30', '31-45', '46-60', '61-75', '75+']
+# Dimensions of the count cubes behind the mortality and infrastructure
+# charts; a new filter is one more entry here
+DEATH_DIMS = ['Ward', 'Age', 'Year', 'Reason']
+HOUSEHOLD_DIMS = ['Ward', 'Source_of_drinking', 'Presence of Toilet', 'Processed_for_Drinking']
 
-    death_df['Age_Group'] = pd.cut(death_df['Age'], bins=[0, 18, 30, 45, 60, 75, 100], 
-                                   labels=['0-18', '19-30', '31-45', '46-60', '61-75', '75+'])
+def data_version():
+    return file_signature(*DATA_FILES)
 
+def load_data():
+    return _load_data(data_version())
+
+# Data loading and preprocessing, redone when any source file changes
+@lru_cache(maxsize=1)
+def _load_data(version):
+    death_df = get_dataset('Death person.csv')
+    household_df = get_dataset('Household Lifestyle .csv')
+    agriculture_df = get_dataset('Agricultural_practice.csv')
     return death_df, household_df, agriculture_df
 
+def load_cubes():
+    return _load_cubes(data_version())
+
+def clear_cache():
+    # Rebuild the frames and cubes on next use, as a data change would
+    _load_data.cache_clear()
+    _load_cubes.cache_clear()
+
+# Counts of deaths and households over their chart dimensions, built once per
+# data version so the chart views never scan the rows
+@lru_cache(maxsize=1)
+def _load_cubes(version):
+    death_df, household_df, _ = _load_data(version)
+    return CountCube(death_df, DEATH_DIMS), CountCube(household_df, HOUSEHOLD_DIMS)
+
+# Filter arguments are integers; anything else is a 400 from the views
+def _wards(value):
+    # 'All' (or nothing) is every ward, otherwise a comma-separated list
+    if not value or value == 'All':
+        return None
+    return [int(ward) for ward in value.split(',')]
+
+def _range(low, high):
+    # Inclusive bounds from optional query arguments
+    low, high = request.args.get(low), request.args.get(high)
+    if low is None and high is None:
+        return None
+    return (int(low) if low is not None else None, int(high) if high is not None else None)
+
+NO_RECORDS = 'No records match the selected filters.'
+
+def _empty_figure(title):
+    # Axes-free chart with a note, for filters that select nothing
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    fig.update_layout(title=title, height=500, xaxis={'visible': False}, yaxis={'visible': False},
+                      annotations=[{'text': NO_RECORDS, 'showarrow': False, 'font': {'size': 16}}])
+    return fig
+
 @dashboard_bp.route('/dashboards')
 def dashboard():
     death_df, household_df, _ = load_data()
     wards = sorted(household_df['Ward'].unique())
     age_range = [int(death_df['Age'].min()), int(death_df['Age'].max())]
-    return render_template('dash.html', title="Community Dashboard", wards=wards, age_range=age_range)
+    return render_template('dash.html', title="Community Dashboard", wards=wards, age_range=age_range,
+                           exposures=EXPOSURES, diseases=load_features().diseases)
 
 @dashboard_bp.route('/mortality_charts')
+@cached_response(data_version)
 def mortality_charts():
-    death_df, _, _ = load_data()
-    age_min = int(request.args.get('age_min', 0))
-    age_max = int(request.args.get('age_max', 100))
-    
-    filtered_df = death_df[(death_df['Age'] >= age_min) & (death_df['Age'] <= age_max)]
-    
-    age_reason_fig = px.histogram(filtered_df, x='Age_Group', color='Reason',
-                                  title='Distribution of Mortality Causes by Age Group',
-                                  labels={'Age_Group': 'Age Group', 'count': 'Number of Cases'},
-                                  height=500,
-                                  color_discrete_sequence=professional_colors)
-    
-    ward_mortality = filtered_df['Ward'].value_counts().reset_index()
+    import plotly.express as px
+    deaths, _ = load_cubes()
+    try:
+        age_min = int(request.args.get('age_min', 0))
+        age_max = int(request.args.get('age_max', 100))
+        filters = {'Age': (age_min, age_max), 'Year': _range('year_min', 'year_max'),
+                   'Ward': _wards(request.args.get('ward'))}
+    except ValueError:
+        return jsonify({'error': 'age_min, age_max, year_min, year_max and ward must be integers'}), 400
+
+    if not deaths.sum(**filters):
+        return figure_response({
+            'age_reason_chart': _empty_figure('Distribution of Mortality Causes by Age Group'),
+            'ward_mortality_chart': _empty_figure('Mortality Cases by Ward'),
+            'analysis_text': NO_RECORDS
+        })
+
+    by_age = deaths.sum(['Age', 'Reason'], **filters)
+    by_group = by_age.groupby(pd.cut(by_age.index, bins=AGE_BINS, labels=AGE_LABELS), observed=False).sum()
+    age_reason = by_group.stack().rename('count').reset_index()
+    age_reason.columns = ['Age_Group', 'Reason', 'count']
+    age_reason = age_reason[age_reason['count'] > 0]
+    ward_mortality = deaths.value_counts('Ward', **filters).reset_index()
     ward_mortality.columns = ['Ward', 'Cases']
+    top_causes = deaths.value_counts('Reason', **filters).nlargest(3)
+    group_totals = by_group.sum(axis=1).sort_values(ascending=False, kind='stable')
+    lap('query')
+
+    age_reason_fig = px.bar(age_reason, x='Age_Group', y='count', color='Reason',
+                            title='Distribution of Mortality Causes by Age Group',
+                            labels={'Age_Group': 'Age Group', 'count': 'Number of Cases'},
+                            category_orders={'Age_Group': AGE_LABELS},
+                            height=500,
+                            color_discrete_sequence=professional_colors)
+    
     ward_mortality_fig = px.bar(ward_mortality, x='Ward', y='Cases',
                                 title='Mortality Cases by Ward',
                                 labels={'Ward': 'Ward Number', 'Cases': 'Number of Cases'},
                                 height=500,
                                 color='Cases',
                                 color_continuous_scale=blue_scale)
+    lap('figure')
     
-    top_causes = filtered_df['Reason'].value_counts().nlargest(3)
     analysis_text = f"""
     Key Observations:
     1. The top 3 causes of mortality in the selected age range are:
        {', '.join([f"{cause} ({count} cases)" for cause, count in top_causes.items()])}
     2. Ward {ward_mortality['Ward'].iloc[0]} has the highest number of cases with {ward_mortality['Cases'].iloc[0]} reported.
-    3. The {filtered_df['Age_Group'].value_counts().index[0]} age group shows the highest incidence of cases.
+    3. The {group_totals.index[0]} age group shows the highest incidence of cases.
     """
     
-    return jsonify({
-        'age_reason_chart': json.dumps(age_reason_fig, cls=plotly.utils.PlotlyJSONEncoder),
-        'ward_mortality_chart': json.dumps(ward_mortality_fig, cls=plotly.utils.PlotlyJSONEncoder),
+    return figure_response({
+        'age_reason_chart': age_reason_fig,
+        'ward_mortality_chart': ward_mortality_fig,
         'analysis_text': analysis_text
     })
 
 @dashboard_bp.route('/infrastructure_charts')
+@cached_response(data_version)
 def infrastructure_charts():
-    _, household_df, _ = load_data()
+    import plotly.express as px
+    _, households = load_cubes()
     selected_ward = request.args.get('ward', 'All')
-    
-    filtered_df = household_df if selected_ward == 'All' else household_df[household_df['Ward'] == int(selected_ward)]
-    
-    water_source_counts = filtered_df['Source_of_drinking'].value_counts()
+    try:
+        wards = _wards(selected_ward)
+    except ValueError:
+        return jsonify({'error': "ward must be 'All' or comma-separated ward numbers"}), 400
+
+    if not households.sum(Ward=wards):
+        return figure_response({
+            'water_source_chart': _empty_figure(f'Water Sources in Ward: {selected_ward}'),
+            'sanitation_chart': _empty_figure(f'Sanitation Facilities in Ward: {selected_ward}'),
+            'water_treatment_chart': _empty_figure(f'Water Treatment Methods in Ward: {selected_ward}'),
+            'analysis_text': NO_RECORDS
+        })
+
+    water_source_counts = households.value_counts('Source_of_drinking', Ward=wards)
     water_source_percentages = (water_source_counts / water_source_counts.sum() * 100).round(1)
+    sanitation_counts = households.value_counts('Presence of Toilet', Ward=wards)
+    sanitation_percentages = (sanitation_counts / sanitation_counts.sum() * 100).round(1)
+    treatment_counts = households.value_counts('Processed_for_Drinking', Ward=wards)
+    treatment_percentages = (treatment_counts / treatment_counts.sum() * 100).round(1)
+    lap('query')
+
     water_source_fig = px.pie(
         values=water_source_percentages,
         names=water_source_percentages.index,
@@ -87,8 +184,6 @@ def infrastructure_charts():
     )
     water_source_fig.update_traces(textposition='inside', textinfo='percent+label')
     
-    sanitation_counts = filtered_df['Presence of Toilet'].value_counts()
-    sanitation_percentages = (sanitation_counts / sanitation_counts.sum() * 100).round(1)
     sanitation_fig = px.pie(
         values=sanitation_percentages,
         names=sanitation_percentages.index,
@@ -99,8 +194,6 @@ def infrastructure_charts():
     )
     sanitation_fig.update_traces(textposition='inside', textinfo='percent+label')
     
-    treatment_counts = filtered_df['Processed_for_Drinking'].value_counts()
-    treatment_percentages = (treatment_counts / treatment_counts.sum() * 100).round(1)
     treatment_fig = px.bar(
         x=treatment_percentages.index,
         y=treatment_percentages.values,
@@ -112,8 +205,9 @@ def infrastructure_charts():
     )
     treatment_fig.update_traces(texttemplate='%{text:.1f}%', textposition='outside')
     treatment_fig.update_layout(uniformtext_minsize=8, uniformtext_mode='hide')
+    lap('figure')
     
-    total_households = len(filtered_df)
+    total_households = households.sum(Ward=wards)
     toilets_percentage = sanitation_percentages.get('Yes', 0)
     top_water_source = water_source_percentages.index[0]
     top_water_source_percentage = water_source_percentages.iloc[0]
@@ -132,15 +226,17 @@ def infrastructure_charts():
        - {'Encourage water treatment' if top_treatment == 'Nil' else 'Promote advanced water treatment methods'}
     """
     
-    return jsonify({
-        'water_source_chart': json.dumps(water_source_fig, cls=plotly.utils.PlotlyJSONEncoder),
-        'sanitation_chart': json.dumps(sanitation_fig, cls=plotly.utils.PlotlyJSONEncoder),
-        'water_treatment_chart': json.dumps(treatment_fig, cls=plotly.utils.PlotlyJSONEncoder),
+    return figure_response({
+        'water_source_chart': water_source_fig,
+        'sanitation_chart': sanitation_fig,
+        'water_treatment_chart': treatment_fig,
         'analysis_text': analysis_text
     })
 
 @dashboard_bp.route('/agriculture_chart')
+@cached_response(data_version)
 def agriculture_chart():
+    import plotly.express as px
     _, _, agriculture_df = load_data()
     farming_fig = px.scatter(agriculture_df, x='ACRES OF FARMING LAND', y='Crop-1',
                              size='ACRES OF FARMING LAND', color='ORGANIC FARMING',
@@ -149,6 +245,7 @@ def agriculture_chart():
                              labels={'ACRES OF FARMING LAND': 'Farm Size (Acres)', 'Crop-1': 'Primary Crop'},
                              height=600,
                              color_discrete_map={'Yes': '#2ca02c', 'No': '#d62728', 'Partially': '#ff7f0e'})
+    lap('figure')
     
     total_farms = len(agriculture_df)
     organic_percentage = (agriculture_df['ORGANIC FARMING'] == 'Yes').mean() * 100
@@ -165,7 +262,62 @@ def agriculture_chart():
     5. There appears to be a relationship between farm size and organic farming practices, which may impact resource use and overall agricultural health.
     """
     
-    return jsonify({
-        'farming_practices_chart': json.dumps(farming_fig, cls=plotly.utils.PlotlyJSONEncoder),
+    return figure_response({
+        'farming_practices_chart': farming_fig,
         'analysis_text': analysis_text
-    })
\ No newline at end of file
+    })
+
+@dashboard_bp.route('/health_water_charts')
+@cached_response(health_water.data_version)
+def health_water_charts():
+    import plotly.express as px
+    features = load_features()
+    exposure = request.args.get('exposure', 'Source_of_drinking')
+    disease = request.args.get('disease', health_water.ANY_DISEASE)
+    if exposure not in EXPOSURES or disease not in features.diseases:
+        return jsonify({'error': f'exposure must be one of {list(EXPOSURES)} and disease one of {features.diseases}'}), 400
+
+    result = association(exposure, disease)
+    tested = pd.DataFrame([c for c in result['categories'] if 'odds_ratio' in c])
+    tested['p'] = tested['test'].map(lambda t: t['p'])
+    lap('query')
+    odds_fig = px.scatter(tested, x='odds_ratio', y='category', log_x=True,
+                          error_x=tested['ci_high'] - tested['odds_ratio'],
+                          error_x_minus=tested['odds_ratio'] - tested['ci_low'],
+                          hover_data={'p': ':.3f'},
+                          title=f'Odds of {disease.replace("_", " ")}: Wards Above the Median Share vs the Rest',
+                          labels={'odds_ratio': 'Odds ratio (95% CI)', 'category': EXPOSURES[exposure]},
+                          height=500, color_discrete_sequence=professional_colors)
+    odds_fig.add_vline(x=1, line_dash='dash', line_color='grey')
+
+    prevalence = features.prevalence()[disease].rename('Prevalence').reset_index()
+    prevalence_fig = px.bar(prevalence, x='Ward', y='Prevalence',
+                            title=f'{disease.replace("_", " ")} per 100 People by Ward',
+                            labels={'Ward': 'Ward Number', 'Prevalence': 'Cases per 100 people'},
+                            height=500, color='Prevalence', color_continuous_scale=blue_scale)
+
+    corr = correlations()
+    correlation_fig = px.imshow(corr.round(2), text_auto=True, aspect='auto', zmin=-1, zmax=1,
+                                color_continuous_scale='RdBu_r',
+                                title='Correlation Across Wards: Household Water, Water Quality and Health',
+                                height=900)
+    correlation_fig.update_xaxes(tickangle=45)
+    lap('figure')
+
+    overall = result['majority']['test']
+    strongest = tested.sort_values('p').iloc[0] if len(tested) else None
+    analysis_text = f"""
+    Health and Water Analysis ({EXPOSURES[exposure]} vs {disease.replace("_", " ")}):
+    1. Grouping people by their ward's most common {EXPOSURES[exposure].lower()}:
+       {f"chi-square = {overall['chi2']:.2f} on {overall['dof']} df, p = {overall['p']:.3f}" if overall else 'every ward has the same most common category, so there is nothing to compare'}.
+    2. {f"The strongest single association is with '{strongest['category']}': odds ratio {strongest['odds_ratio']:.2f} (95% CI {strongest['ci_low']:.2f}-{strongest['ci_high']:.2f}, p = {strongest['p']:.3f})." if strongest is not None else 'No category splits the wards into two groups.'}
+    3. Exposures are ward-level shares of households, since the health survey is not linked to households: these are ecological associations across {len(features.wards)} wards, not individual risks.
+    """
+
+    return figure_response({
+        'odds_ratio_chart': odds_fig,
+        'ward_prevalence_chart': prevalence_fig,
+        'correlation_chart': correlation_fig,
+        'analysis_text': analysis_text,
+        'association': result
+    })
@@ -0,0 +1,176 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count_cache, phase
+
+# Parsed CSVs are kept as one .npy file per column plus a JSON manifest, under
+# a directory named after the source file and the checksum of its bytes. Text
+# columns are stored as categorical codes; numeric and datetime columns can be
+# memory-mapped so that several worker processes share the same pages.
+CACHE_DIR = os.environ.get('NALLAMPATTI_CACHE_DIR', os.path.join('.cache', 'columnar'))
+CACHE_FORMAT = 1
+
+
+def file_checksum(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _slug(path):
+    # Relative path, so monthly partitions of different stations don't collide
+    return re.sub(r'[^A-Za-z0-9]+', '_', os.path.relpath(path)).strip('_')
+
+
+def _encode_tz(tz):
+    if tz is None:
+        return None
+    if isinstance(tz, datetime.timezone):
+        return {'offset': tz.utcoffset(None).total_seconds()}
+    return {'name': str(tz)}
+
+
+def _decode_tz(tz):
+    if tz is None:
+        return None
+    if 'offset' in tz:
+        return datetime.timezone(datetime.timedelta(seconds=tz['offset']))
+    return tz['name']
+
+
+class UncacheableColumn(ValueError):
+    pass
+
+
+def _text_values(col):
+    # Categories are stored as strings, so only columns holding nothing but
+    # strings (and missing values) come back unchanged
+    values = col.cat.categories if isinstance(col.dtype, pd.CategoricalDtype) else col
+    return pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty')
+
+
+def _write_cache(df, target):
+    for name in df.columns:
+        col = df[name]
+        if not (pd.api.types.is_datetime64_any_dtype(col.dtype) or pd.api.types.is_numeric_dtype(col.dtype)
+                or pd.api.types.is_bool_dtype(col.dtype) or _text_values(col)):
+            raise UncacheableColumn(f'Column {name!r} mixes values that are not strings')
+    parent = os.path.dirname(target)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    columns = []
+    for i, name in enumerate(df.columns):
+        col = df[name]
+        entry = {'name': name, 'file': f'{i}.npy'}
+        if isinstance(col.dtype, pd.DatetimeTZDtype) or pd.api.types.is_datetime64_dtype(col.dtype):
+            entry['kind'] = 'datetime'
+            entry['tz'] = _encode_tz(col.dt.tz)
+            values = col.dt.tz_convert('UTC').dt.tz_localize(None) if col.dt.tz is not None else col
+            values = values.values.astype('datetime64[ns]').view('int64')
+        elif pd.api.types.is_numeric_dtype(col.dtype) or pd.api.types.is_bool_dtype(col.dtype):
+            entry['kind'] = 'numeric'
+            values = col.values
+        else:
+            cat = col.astype('category').cat
+            entry['kind'] = 'category'
+            entry['categories'] = [str(c) for c in cat.categories]
+            values = cat.codes.values
+        np.save(os.path.join(tmp, entry['file']), np.ascontiguousarray(values))
+        columns.append(entry)
+
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump({'format': CACHE_FORMAT, 'columns': columns}, f)
+
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        # Another worker finished the same cache first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _read_cache(target, mmap, as_category):
+    with open(os.path.join(target, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != CACHE_FORMAT:
+        return None
+
+    data = {}
+    for entry in manifest['columns']:
+        values = np.load(os.path.join(target, entry['file']), mmap_mode='r' if mmap else None)
+        values = values.view(np.ndarray)
+        if entry['kind'] == 'datetime':
+            tz = _decode_tz(entry['tz'])
+            if tz is None:
+                data[entry['name']] = pd.Series(values.view('M8[ns]'), copy=False)
+            else:
+                # _simple_new wraps the UTC values without copying them, which
+                # keeps memory-mapped pages shared (pandas is pinned to 2.2)
+                array = pd.arrays.DatetimeArray._simple_new(values.view('M8[ns]'),
+                                                            dtype=pd.DatetimeTZDtype('ns', tz))
+                data[entry['name']] = pd.Series(array, copy=False)
+        elif entry['kind'] == 'category':
+            cat = pd.Categorical.from_codes(values, entry['categories'])
+            data[entry['name']] = pd.Series(cat if as_category else cat.astype(object))
+        else:
+            data[entry['name']] = pd.Series(values, copy=False)
+    return pd.DataFrame(data, copy=False)
+
+
+def _remove_stale(slug, keep):
+    if not os.path.isdir(CACHE_DIR):
+        return
+    for name in os.listdir(CACHE_DIR):
+        if name.startswith(slug + '-') and name != os.path.basename(keep):
+            shutil.rmtree(os.path.join(CACHE_DIR, name), ignore_errors=True)
+
+
+def clear_cache(name):
+    # Drop every cached copy of `name` (a CSV path or derived table name)
+    _remove_stale(_slug(name), keep='')
+
+
+def cached_frame(name, key, build, mmap=False, as_category=False):
+    # Read a frame through the columnar cache, calling build() only when
+    # nothing is cached for `key`, bytes that identify the inputs (a file's
+    # contents, or checksums of several files for a derived table).
+    slug = _slug(name)
+    target = os.path.join(CACHE_DIR, f'{slug}-{file_checksum(key)[:20]}')
+
+    if os.path.isdir(target):
+        df = _read_cache(target, mmap, as_category)
+        if df is not None:
+            count_cache('columnar', True)
+            return df
+        shutil.rmtree(target, ignore_errors=True)
+
+    count_cache('columnar', False)
+    with phase('parse'):
+        df = build()
+    try:
+        _write_cache(df, target)
+        _remove_stale(slug, target)
+    except (OSError, UncacheableColumn):
+        # A read-only checkout still works, it just rebuilds every time; so
+        # does a frame with ints, bools or None among its text values
+        return df
+    return _read_cache(target, mmap, as_category)
+
+
+def load_csv(path, data=None, mmap=False, as_category=False, **read_csv_kwargs):
+    # Read a CSV through the columnar cache. `data` may be passed when the
+    # caller already holds the file bytes. Text columns come back as objects
+    # unless `as_category` is set, so value_counts() keeps its usual meaning.
+    if data is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+
+    options = json.dumps(read_csv_kwargs, sort_keys=True, default=str).encode()
+    return cached_frame(path, data + options, lambda: pd.read_csv(BytesIO(data), **read_csv_kwargs),
+                        mmap=mmap, as_category=as_category)
@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+
+from data_cache import load_csv
+from instrumentation import count_cache, count_rows, phase
+from response_cache import file_signature
+
+# Process-wide registry of the survey CSVs the blueprints share. Nothing is
+# read at import: each file is parsed (through the columnar cache) on first
+# use and kept for the life of the process, and re-read on the next access
+# after it changes. Frames are shared between blueprints, so callers must
+# not modify them in place.
+DATASETS = (
+    '1500Data.csv',
+    'Death person.csv',
+    'Household_lifestyle.csv',
+    'Household Lifestyle .csv',
+    'Agricultural_practice.csv',
+    'WQ2021.csv',
+    'WQ2022.csv',
+    'WQ2023.csv',
+)
+# Load everything at import of the app, e.g. in a gunicorn master with
+# preload_app so that workers inherit the frames (see gunicorn.conf.py)
+PRELOAD = os.environ.get('NALLAMPATTI_PRELOAD') == '1'
+
+_registry = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+def _lock(path):
+    with _registry_lock:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def get_dataset(path):
+    signature = file_signature(path)
+    entry = _registry.get(path)
+    count_cache('dataset', entry is not None and entry['signature'] == signature)
+    if entry is None or entry['signature'] != signature:
+        with _lock(path):
+            entry = _registry.get(path)
+            if entry is None or entry['signature'] != signature:
+                started = time.perf_counter()
+                with phase('load'):
+                    frame = load_csv(path)
+                count_rows(path, len(frame))
+                entry = {'signature': signature, 'frame': frame, 'rows': len(frame),
+                         'seconds': time.perf_counter() - started}
+                _registry[path] = entry
+    return entry['frame']
+
+
+def preload(paths=DATASETS):
+    for path in paths:
+        get_dataset(path)
+
+
+def reset():
+    # Forget every loaded frame; the next access reads the file again
+    with _registry_lock:
+        _registry.clear()
+
+
+def dataset_stats():
+    # Rows and load time of every dataset loaded so far
+    return {path: {'rows': entry['rows'], 'seconds': round(entry['seconds'], 4)}
+            for path, entry in _registry.items()}
@@ -0,0 +1,67 @@
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+
+def lttb_indices(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: keeps the first and last points and, for
+    # every bucket in between, the point forming the largest triangle with the
+    # previously selected point and the average of the next bucket.
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64) - float(x[0])
+    y = np.asarray(y, dtype=np.float64)
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = ends - starts
+    avg_x = (cx[ends] - cx[starts]) / sizes
+    avg_y = (cy[ends] - cy[starts]) / sizes
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(len(starts)):
+        s, e = starts[i], ends[i]
+        area = np.abs((x[a] - next_x[i]) * (y[s:e] - y[a]) -
+                      (x[a] - x[s:e]) * (next_y[i] - y[a]))
+        a = s + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def minmax_indices(y, threshold):
+    # Min/max bucketing: the lowest and highest point of every bucket, so no
+    # spike is ever dropped.
+    n = len(y)
+    buckets = threshold // 2
+    if threshold >= n or buckets < 1:
+        return np.arange(n)
+
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    bucket_id = np.repeat(np.arange(buckets), np.diff(edges))
+    order = np.lexsort((np.asarray(y), bucket_id))
+    mins = order[edges[:-1]]
+    maxs = order[edges[1:] - 1]
+    return np.unique(np.concatenate(([0, n - 1], mins, maxs)))
+
+
+def downsample_indices(x, y, threshold, method='lttb'):
+    if method == 'minmax':
+        return minmax_indices(y, threshold)
+    if method == 'lttb':
+        return lttb_indices(x, y, threshold)
+    raise ValueError(f"Unknown downsampling method '{method}', expected one of {METHODS}")
+
+
+def target_points(width, min_width=200, max_width=4000, points_per_pixel=2):
+    width = min(max(int(width), min_width), max_width)
+    return width * points_per_pixel
@@ -0,0 +1,46 @@
+from flask import Response
+from plotly.basedatatypes import BaseFigure
+
+from instrumentation import phase
+
+# Chart endpoints return their payload (figures plus analysis text) encoded
+# exactly once. Plotly picks orjson when it is installed, which serialises
+# NumPy arrays natively, and falls back to the standard json module.
+JSON_ENGINE = 'auto'
+
+
+def _plain(value):
+    if isinstance(value, BaseFigure):
+        return value.to_plotly_json()
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def encode_payload(payload):
+    # plotly.io.json is imported on first use: through plotly.offline it
+    # pulls in IPython when that is installed, a third of a second at startup
+    from plotly.io.json import to_json_plotly
+    with phase('json'):
+        return to_json_plotly(_plain(payload), engine=JSON_ENGINE).encode('utf-8')
+
+
+def figure_response(payload, status=200):
+    return Response(encode_payload(payload), status=status, mimetype='application/json')
+
+
+def preload_plotly():
+    # Plotly imports its figure classes and per-trace validators on first use,
+    # close to a second on the first chart. A preloading master takes that
+    # once for all of its workers.
+    import plotly.express  # noqa: F401
+    import plotly.graph_objects as go
+    import plotly.io as pio
+    from plotly.subplots import make_subplots
+    pio.templates['plotly_white']
+    fig = make_subplots(rows=2, cols=1)
+    for trace in (go.Scatter, go.Bar, go.Pie, go.Histogram, go.Heatmap):
+        fig.add_trace(trace())
+    encode_payload({'figure': fig})
@@ -1,10 +1,218 @@
-from flask import Blueprint, render_template, request, flash
+from flask import Blueprint, abort, render_template, send_from_directory, url_for
+import hashlib
 import os
+import tempfile
+import threading
+from functools import lru_cache
+
+from pools import fork_safe_pool
+from response_cache import cached_response
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # Without Pillow there are no thumbnails and the page links the originals
+    Image = ImageOps = None
 
 gallery_bp = Blueprint('gallery', __name__)
 
+IMAGE_FOLDER = os.path.join('static', 'images')
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+# Resized copies of every photo, named after the original's content hash so
+# they can be cached by browsers for good
+THUMB_DIR = os.environ.get('NALLAMPATTI_THUMB_DIR', os.path.join('.cache', 'thumbs'))
+THUMB_WIDTHS = (320, 640, 1280)
+THUMB_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 82, 'progressive': True, 'optimize': True},
+}
+# Grid cells are at least 250px wide and a row is 80% of the page (95% on
+# phones)
+THUMB_SIZES = '(max-width: 768px) 95vw, (max-width: 1200px) 40vw, 25vw'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def _digest(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()[:16]
+
+
+def _dimensions(path):
+    # Displayed width and height, read from the header only; EXIF rotations
+    # by 90 degrees swap them
+    if Image is None:
+        return None, None
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            if image.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+            return width, height
+    except OSError:
+        return None, None
+
+
+def thumb_name(digest, width, ext):
+    return f'{digest}-{width}.{ext}'
+
+
+def render_thumbs(path, digest, widths, thumb_dir=THUMB_DIR):
+    # Writes every variant of one photo; each file appears atomically, so a
+    # request never sees half of one
+    os.makedirs(thumb_dir, exist_ok=True)
+    written = []
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        for width in sorted(widths, reverse=True):
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+            for ext, options in THUMB_FORMATS.items():
+                name = thumb_name(digest, width, ext)
+                fd, tmp = tempfile.mkstemp(dir=thumb_dir, prefix=f'{digest}-', suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, **options)
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, os.path.join(thumb_dir, name))
+                written.append(name)
+    return written
+
+
+class GalleryIndex:
+    # The photo listing with each photo's content hash and size, re-read only
+    # when the folder's mtime changes (adding, removing or renaming a file,
+    # or replacing one by rename as editors and rsync do). Missing thumbnails
+    # are queued on a background thread; until they are written the page
+    # links the original.
+
+    def __init__(self, folder=IMAGE_FOLDER, thumb_dir=THUMB_DIR):
+        self.folder = folder
+        self.thumb_dir = thumb_dir
+        self.mtime = None
+        self.images = []
+        self.ready = set()
+        self.failed = {}
+        self._pending = set()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        mtime = os.stat(self.folder).st_mtime_ns
+        if mtime != self.mtime:
+            with self._lock:
+                if mtime != self.mtime:
+                    self._scan()
+                    self.mtime = mtime
+        return self.images
+
+    def version(self):
+        # Changes when the listing changes or another thumbnail is ready
+        self.refresh()
+        return self.mtime, len(self.ready)
+
+    def _scan(self):
+        entries = {}
+        for name in sorted(os.listdir(self.folder)):
+            if not name.lower().endswith(EXTENSIONS):
+                continue
+            path = os.path.join(self.folder, name)
+            stat = os.stat(path)
+            entry = self._entries.get(name)
+            # Unchanged files keep their hash
+            if entry is None or (entry['mtime'], entry['size']) != (stat.st_mtime_ns, stat.st_size):
+                width, height = _dimensions(path)
+                entry = {'name': name, 'path': path, 'digest': _digest(path),
+                         'mtime': stat.st_mtime_ns, 'size': stat.st_size,
+                         'width': width, 'height': height}
+                entry['widths'] = [w for w in THUMB_WIDTHS if width and w < width]
+            entries[name] = entry
+        self._entries = entries
+        self.images = list(entries.values())
+
+        # Thumbnails already on disk are reused; those of photos that have
+        # gone or changed are removed
+        digests = {entry['digest'] for entry in self.images}
+        existing = os.listdir(self.thumb_dir) if os.path.isdir(self.thumb_dir) else []
+        self.ready = {name for name in existing if name.split('-', 1)[0] in digests and not name.endswith('.tmp')}
+        for name in existing:
+            if name.split('-', 1)[0] not in digests:
+                try:
+                    os.remove(os.path.join(self.thumb_dir, name))
+                except OSError:
+                    pass
+
+        if Image is not None:
+            for entry in self.images:
+                if entry['widths'] and not self._complete(entry) and entry['digest'] not in self._pending:
+                    self._pending.add(entry['digest'])
+                    fork_safe_pool('gallery-thumbs', 1).submit(self._render, entry)
+
+    def _complete(self, entry):
+        return all(thumb_name(entry['digest'], w, ext) in self.ready
+                   for w in entry['widths'] for ext in THUMB_FORMATS)
+
+    def _render(self, entry):
+        written, error = [], None
+        try:
+            written = render_thumbs(entry['path'], entry['digest'], entry['widths'], self.thumb_dir)
+        except Exception as exc:
+            error = repr(exc)
+        # Request threads read these while the worker writes them
+        with self._lock:
+            self.ready.update(written)
+            if error is not None:
+                self.failed[entry['name']] = error
+            self._pending.discard(entry['digest'])
+
+    def srcset(self, entry, ext):
+        return ', '.join(f"{url_for('gallery.thumb', filename=thumb_name(entry['digest'], w, ext))} {w}w"
+                         for w in entry['widths'] if thumb_name(entry['digest'], w, ext) in self.ready)
+
+
+@lru_cache(maxsize=None)
+def gallery_index():
+    return GalleryIndex()
+
+
+def gallery_version():
+    return gallery_index().version()
+
+
+def _immutable(response):
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
 @gallery_bp.route('/gallery')
+@cached_response(gallery_version)
 def gallery():
-    image_folder = os.path.join('static', 'images')
-    images = [f for f in os.listdir(image_folder) if f.endswith(('.jpg', '.jpeg', '.png', '.gif'))]
-    return render_template('gallery.html', images=images)
\ No newline at end of file
+    index = gallery_index()
+    images = []
+    for entry in index.refresh():
+        original = url_for('gallery.original', digest=entry['digest'], filename=entry['name'])
+        webp, jpeg = index.srcset(entry, 'webp'), index.srcset(entry, 'jpg')
+        if jpeg and entry['width']:
+            jpeg = f"{jpeg}, {original} {entry['width']}w"
+        images.append({'name': entry['name'], 'src': original, 'webp_srcset': webp,
+                       'jpeg_srcset': jpeg, 'width': entry['width'], 'height': entry['height']})
+    return render_template('gallery.html', images=images, sizes=THUMB_SIZES)
+
+
+@gallery_bp.route('/gallery/images/<digest>/<path:filename>')
+def original(digest, filename):
+    # Originals under their content hash, so a replaced photo gets a new URL
+    entry = next((e for e in gallery_index().refresh() if e['name'] == filename), None)
+    if entry is None or entry['digest'] != digest:
+        abort(404)
+    return _immutable(send_from_directory(os.path.abspath(IMAGE_FOLDER), filename, max_age=IMMUTABLE_MAX_AGE))
+
+
+@gallery_bp.route('/gallery/thumbs/<filename>')
+def thumb(filename):
+    return _immutable(send_from_directory(os.path.abspath(THUMB_DIR), filename, max_age=IMMUTABLE_MAX_AGE))
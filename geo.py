@@ -0,0 +1,226 @@
+import json
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from datasets import get_dataset
+from response_cache import file_signature
+
+WARDS_GEOJSON = 'Nallampatti.geojson'
+# Point layers: source CSV, coordinate columns and the columns shown in the
+# map popups (None shows every column)
+POINT_LAYERS = {
+    'households': {'file': 'Household_lifestyle.csv', 'lon': 'Longitude', 'lat': 'Latitude',
+                   'label': 'Households', 'color': '#2c7fb8',
+                   'columns': ['Ward', 'Street Name', 'Type_of_House', 'Source_of_drinking',
+                               'Processed_for_Drinking']},
+    'wq2021': {'file': 'WQ2021.csv', 'lon': 'Longitude', 'lat': 'Latitude',
+               'label': 'Water quality 2021', 'color': '#d95f0e', 'columns': None},
+    'wq2022': {'file': 'WQ2022.csv', 'lon': 'Longitude', 'lat': 'Latitude',
+               'label': 'Water quality 2022', 'color': '#e6550d', 'columns': None},
+    'wq2023': {'file': 'WQ2023.csv', 'lon': 'longitude', 'lat': 'latitude',
+               'label': 'Water quality 2023', 'color': '#a63603', 'columns': None},
+}
+
+MIN_ZOOM = 10
+MAX_ZOOM = 19
+# Above this zoom points are sent individually instead of clustered
+CLUSTER_MAX_ZOOM = 17
+CLUSTER_RADIUS = 48
+TILE_SIZE = 256
+# Ward outlines keep every vertex that is more than this far off the
+# simplified line at the requested zoom
+SIMPLIFY_PIXELS = 1.0
+GRID_CELLS = 32
+
+
+def to_mercator(lon, lat):
+    # Web Mercator world coordinates in [0, 1), as used by map tiles
+    lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+    sin = np.sin(np.radians(lat))
+    return (lon + 180) / 360, 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)
+
+
+def pixel_size(zoom):
+    # One screen pixel in world coordinates at `zoom`
+    return 1.0 / (TILE_SIZE * 2 ** zoom)
+
+
+def simplify(x, y, tolerance):
+    # Douglas-Peucker: mask of the vertices to keep. Rings keep at least four
+    # vertices so they stay polygons.
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j <= i + 1:
+            continue
+        dx, dy = x[j] - x[i], y[j] - y[i]
+        px, py = x[i + 1:j] - x[i], y[i + 1:j] - y[i]
+        length = np.hypot(dx, dy)
+        dist = np.abs(dx * py - dy * px) / length if length else np.hypot(px, py)
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack += [(i, k), (k, j)]
+    if keep.sum() < 4 <= n:
+        keep[np.linspace(0, n - 1, 4).astype(int)] = True
+    return keep
+
+
+def points_in_ring(lon, lat, ring_lon, ring_lat):
+    # Even-odd ray casting of every point against every edge of the ring
+    x1, y1 = ring_lon[:-1], ring_lat[:-1]
+    x2, y2 = ring_lon[1:], ring_lat[1:]
+    px, py = lon[:, None], lat[:, None]
+    spans = (y1 > py) != (y2 > py)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing = px < (x2 - x1) * (py - y1) / (y2 - y1) + x1
+    return np.count_nonzero(spans & crossing, axis=1) % 2 == 1
+
+
+def load_wards(path=WARDS_GEOJSON):
+    # The ward boundaries are closed LineStrings; each becomes a polygon ring
+    with open(path) as f:
+        collection = json.load(f)
+    wards = []
+    for feature in collection['features']:
+        coords = np.asarray(feature['geometry']['coordinates'], dtype=float)
+        if not np.array_equal(coords[0], coords[-1]):
+            coords = np.vstack([coords, coords[:1]])
+        number = re.search(r'\d+', feature['properties'].get('description', ''))
+        wards.append({
+            'ward': int(number.group()) if number else len(wards) + 1,
+            'name': feature['properties'].get('Name'),
+            'lon': coords[:, 0],
+            'lat': coords[:, 1],
+        })
+    return sorted(wards, key=lambda w: w['ward'])
+
+
+class WardIndex:
+    # Ward polygons with a uniform grid over their bounding box. Each cell
+    # knows which wards' bounding boxes overlap it, so locating a point only
+    # runs the polygon test for the one or two wards that can contain it.
+
+    def __init__(self, wards, cells=GRID_CELLS):
+        self.wards = wards
+        self.cells = cells
+        lon = np.concatenate([w['lon'] for w in wards])
+        lat = np.concatenate([w['lat'] for w in wards])
+        self.bounds = (lon.min(), lat.min(), lon.max(), lat.max())
+        self._grid = np.zeros((len(wards), cells, cells), dtype=bool)
+        for i, ward in enumerate(wards):
+            x0, y0 = self._cell(ward['lon'].min(), ward['lat'].min())
+            x1, y1 = self._cell(ward['lon'].max(), ward['lat'].max())
+            self._grid[i, y0:y1 + 1, x0:x1 + 1] = True
+
+    def _cell(self, lon, lat):
+        west, south, east, north = self.bounds
+        cx = np.clip(((np.asarray(lon) - west) / (east - west) * self.cells).astype(int), 0, self.cells - 1)
+        cy = np.clip(((np.asarray(lat) - south) / (north - south) * self.cells).astype(int), 0, self.cells - 1)
+        return cx, cy
+
+    def locate(self, lon, lat):
+        # Ward number of each point; 0 outside every ward
+        lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+        west, south, east, north = self.bounds
+        inside = (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+        cx, cy = self._cell(np.where(inside, lon, west), np.where(inside, lat, south))
+        result = np.zeros(len(lon), dtype=np.int64)
+        for i, ward in enumerate(self.wards):
+            candidates = np.flatnonzero(inside & (result == 0) & self._grid[i, cy, cx])
+            if len(candidates):
+                hit = points_in_ring(lon[candidates], lat[candidates], ward['lon'], ward['lat'])
+                result[candidates[hit]] = ward['ward']
+        return result
+
+
+def load_layer(name, index):
+    # Points with coordinates, their map ward and Web Mercator position
+    layer = POINT_LAYERS[name]
+    df = get_dataset(layer['file'])
+    df = df.rename(columns={layer['lon']: 'lon', layer['lat']: 'lat'})
+    df['lon'] = pd.to_numeric(df['lon'], errors='coerce')
+    df['lat'] = pd.to_numeric(df['lat'], errors='coerce')
+    df = df.dropna(subset=['lon', 'lat']).reset_index(drop=True)
+    df['map_ward'] = index.locate(df['lon'], df['lat'])
+    df['x'], df['y'] = to_mercator(df['lon'], df['lat'])
+    return df
+
+
+def data_version():
+    return file_signature(WARDS_GEOJSON, *(layer['file'] for layer in POINT_LAYERS.values()))
+
+
+def load_geodata():
+    return _load_geodata(data_version())
+
+
+# Ward index and point layers, with every point assigned to its ward once,
+# rebuilt when any source file changes
+@lru_cache(maxsize=1)
+def _load_geodata(version):
+    index = WardIndex(load_wards())
+    layers = {name: load_layer(name, index) for name in POINT_LAYERS}
+    return index, layers
+
+
+def ward_features(zoom):
+    return _ward_features(data_version(), zoom)
+
+
+@lru_cache(maxsize=32)
+def _ward_features(version, zoom):
+    # Ward polygons simplified to about a pixel at `zoom`, with the number of
+    # points of each layer that fall inside them
+    index, layers = _load_geodata(version)
+    tolerance = SIMPLIFY_PIXELS * pixel_size(zoom)
+    counts = {name: df['map_ward'].value_counts() for name, df in layers.items()}
+    features = []
+    for ward in index.wards:
+        x, y = to_mercator(ward['lon'], ward['lat'])
+        keep = simplify(x, y, tolerance)
+        ring = np.column_stack([ward['lon'][keep], ward['lat'][keep]]).round(6)
+        properties = {'ward': ward['ward'], 'name': ward['name']}
+        properties.update({name: int(count.get(ward['ward'], 0)) for name, count in counts.items()})
+        features.append({'type': 'Feature', 'properties': properties,
+                         'geometry': {'type': 'Polygon', 'coordinates': [ring.tolist()]}})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def layer_clusters(name, zoom):
+    return _layer_clusters(data_version(), name, zoom)
+
+
+@lru_cache(maxsize=128)
+def _layer_clusters(version, name, zoom):
+    # Grid clustering in screen space: points sharing a CLUSTER_RADIUS pixel
+    # cell at this zoom become one cluster at their mean position. Columns:
+    # lon, lat, count and `first`, the row of a single-point cluster.
+    _, layers = _load_geodata(version)
+    df = layers[name]
+    scale = 1.0 / (CLUSTER_RADIUS * pixel_size(zoom))
+    keys = [np.floor(df['x'] * scale).rename('cx'), np.floor(df['y'] * scale).rename('cy')]
+    grouped = df.groupby(keys)
+    clusters = pd.DataFrame({
+        'lon': grouped['lon'].mean(),
+        'lat': grouped['lat'].mean(),
+        'count': grouped.size(),
+        'first': df.index.to_series().groupby(keys).first(),
+    })
+    return clusters.reset_index(drop=True)
+
+
+def point_properties(name, rows):
+    # Popup fields of single points, JSON-ready
+    columns = POINT_LAYERS[name]['columns']
+    if columns is None:
+        columns = [c for c in rows.columns if c not in ('lon', 'lat', 'x', 'y', 'map_ward')]
+    table = rows[columns].astype(object)
+    return table.where(table.notna(), None).to_dict('records')
@@ -0,0 +1,185 @@
+import numpy as np
+from flask import Blueprint, Response, jsonify, render_template, request
+
+from figure_json import figure_response
+import interpolation
+import water_quality
+from geo import (CLUSTER_MAX_ZOOM, MAX_ZOOM, MIN_ZOOM, POINT_LAYERS, data_version, layer_clusters,
+                 load_geodata, point_properties, ward_features)
+from interpolation import (DIVERGING_RAMP, METHODS, SEQUENTIAL_RAMP, SURVEY_YEARS, colorize, difference,
+                           encode_png, surface, surface_grid, survey_parameters)
+from response_cache import cached_response
+from water_quality import well_history, wells
+
+geomap_bp = Blueprint('geomap', __name__)
+
+
+def _zoom():
+    zoom = int(request.args.get('zoom', 14))
+    return min(max(zoom, MIN_ZOOM), MAX_ZOOM)
+
+
+def _bbox():
+    # west,south,east,north as sent by Leaflet's toBBoxString()
+    bbox = request.args.get('bbox')
+    if not bbox:
+        return None
+    west, south, east, north = (float(v) for v in bbox.split(','))
+    return west, south, east, north
+
+
+@geomap_bp.route('/map')
+def geomap():
+    index, _ = load_geodata()
+    west, south, east, north = index.bounds
+    layers = [{'id': name, 'label': layer['label'], 'color': layer['color']}
+              for name, layer in POINT_LAYERS.items()]
+    surfaces = {year: survey_parameters(year) for year in SURVEY_YEARS}
+    content = render_template('map_content.html', layers=layers, surfaces=surfaces, methods=METHODS,
+                              bounds=[[south, west], [north, east]],
+                              min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM)
+    return render_template('base.html', title="Village Map", content=content)
+
+
+@geomap_bp.route('/api/map/wards')
+@cached_response(data_version)
+def map_wards():
+    # Ward boundaries as GeoJSON polygons, simplified for the requested zoom
+    try:
+        zoom = _zoom()
+    except ValueError:
+        return jsonify({'error': 'zoom must be an integer'}), 400
+    return figure_response(ward_features(zoom))
+
+
+@geomap_bp.route('/api/map/points')
+def map_points():
+    # One point layer inside bbox: counted clusters up to CLUSTER_MAX_ZOOM,
+    # individual points (with their popup fields and ward) beyond it. Not
+    # response-cached: every pan is a new bbox, and the clusters themselves
+    # are memoised per zoom.
+    layer = request.args.get('layer')
+    if layer not in POINT_LAYERS:
+        return jsonify({'error': f'layer must be one of {list(POINT_LAYERS)}'}), 400
+    try:
+        zoom, bbox = _zoom(), _bbox()
+    except ValueError:
+        return jsonify({'error': 'zoom must be an integer and bbox west,south,east,north'}), 400
+
+    _, layers = load_geodata()
+    points = layers[layer]
+    if zoom <= CLUSTER_MAX_ZOOM:
+        clusters = layer_clusters(layer, zoom)
+    else:
+        clusters = points[['lon', 'lat']].assign(count=1, first=np.arange(len(points)))
+    if bbox is not None:
+        west, south, east, north = bbox
+        clusters = clusters[clusters['lon'].between(west, east) & clusters['lat'].between(south, north)]
+
+    single = clusters[clusters['count'] == 1]
+    rows = points.loc[single['first']]
+    properties = dict(zip(single.index, point_properties(layer, rows)))
+    wards = dict(zip(single.index, rows['map_ward'].tolist()))
+
+    features = []
+    for i, lon, lat, count in zip(clusters.index, clusters['lon'], clusters['lat'], clusters['count']):
+        if count == 1:
+            props = {'cluster': False, 'map_ward': wards[i], 'fields': properties[i]}
+        else:
+            props = {'cluster': True, 'count': int(count)}
+        features.append({'type': 'Feature', 'properties': props,
+                         'geometry': {'type': 'Point', 'coordinates': [round(lon, 6), round(lat, 6)]}})
+    return figure_response({'type': 'FeatureCollection', 'layer': layer, 'zoom': zoom,
+                            'total': len(points), 'features': features})
+
+
+def _surface_args():
+    # year, base year (for a difference surface), parameter and method
+    year = int(request.args.get('year', 0))
+    base = int(request.args['base']) if request.args.get('base') else None
+    param = request.args.get('param', '')
+    method = request.args.get('method', 'idw')
+    if year not in SURVEY_YEARS or (base is not None and base not in SURVEY_YEARS):
+        raise ValueError(f'year and base must be among {SURVEY_YEARS}')
+    if method not in METHODS:
+        raise ValueError(f'method must be one of {METHODS}')
+    return year, base, param, method
+
+
+def _surface_or_error():
+    try:
+        year, base, param, method = _surface_args()
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    result = surface(year, param, method) if base is None else difference(year, base, param, method)
+    if result is None:
+        return None, (jsonify({'error': f"Not enough '{param}' samples to interpolate"}), 404)
+    z, info = result
+    if base is None:
+        lo, hi = float(np.nanmin(z)), float(np.nanmax(z))
+    else:
+        # Difference surfaces are coloured symmetrically around no change
+        hi = float(np.nanmax(np.abs(z)))
+        lo = -hi
+    return (year, base, param, method, z, info, lo, hi), None
+
+
+@geomap_bp.route('/api/map/surface')
+@cached_response(interpolation.data_version)
+def map_surface():
+    # Interpolated grid of one survey parameter (or its change since `base`)
+    # for Plotly contour plots: x/y are cell-centre longitudes/latitudes and
+    # z rows run south to north, null outside the wards. summary=1 leaves
+    # the grid out.
+    result, error = _surface_or_error()
+    if error:
+        return error
+    year, base, param, method, z, info, lo, hi = result
+    grid = surface_grid()
+    west, south, east, north = grid['bounds']
+    payload = {'year': year, 'base': base, 'param': param, 'method': method, 'min': lo, 'max': hi,
+               'bounds': [[south, west], [north, east]], 'info': info}
+    if request.args.get('summary') != '1':
+        payload.update({'x': grid['lons'].round(6), 'y': grid['lats'].round(6),
+                        'z': np.where(np.isnan(z), None, z.round(4).astype(object)).tolist()})
+    return figure_response(payload)
+
+
+@geomap_bp.route('/api/map/surface.png')
+@cached_response(interpolation.data_version)
+def map_surface_png():
+    # The same surface as a transparent image overlay covering `bounds`
+    result, error = _surface_or_error()
+    if error:
+        return error
+    _, base, _, _, z, _, lo, hi = result
+    image = colorize(z, SEQUENTIAL_RAMP if base is None else DIVERGING_RAMP, lo, hi)
+    return Response(encode_png(image), mimetype='image/png')
+
+
+@geomap_bp.route('/api/map/wells')
+@cached_response(water_quality.data_version)
+def map_wells():
+    # Survey wells matched across years by location, with their map ward
+    table = wells()
+    index, _ = load_geodata()
+    table['map_ward'] = index.locate(table['lon'], table['lat'])
+    records = table.reset_index().astype(object)
+    records = records.where(records.notna(), None)
+    return figure_response({'count': len(table), 'wells': records.to_dict('records')})
+
+
+@geomap_bp.route('/api/map/wells/<int:well>')
+@cached_response(water_quality.data_version)
+def map_well(well):
+    # Readings at one well by parameter, oldest survey first
+    history = well_history(well)
+    if history.empty:
+        return jsonify({'error': f'Unknown well {well}'}), 404
+    parameters = {}
+    for parameter, rows in history.groupby('parameter', sort=False):
+        parameters[parameter] = {'unit': rows['unit'].iloc[0], 'year': rows['year'].tolist(),
+                                 'value': rows['value'].tolist(), 'qualifier': rows['qualifier'].tolist()}
+    samples = history.drop_duplicates('year')[['year', 'sample', 'name']].astype(object)
+    samples = samples.where(samples.notna(), None)
+    return figure_response({'well': well, 'samples': samples.to_dict('records'), 'parameters': parameters})
@@ -0,0 +1,29 @@
+# gunicorn -c gunicorn.conf.py app:app
+#
+# The app is imported once in the master with the datasets and sensor logs
+# loaded (NALLAMPATTI_PRELOAD), then forked: workers start without parsing
+# anything and share the frames' memory copy-on-write.
+import gc
+import os
+
+os.environ.setdefault('NALLAMPATTI_PRELOAD', '1')
+
+bind = os.environ.get('NALLAMPATTI_BIND', '0.0.0.0:6060')
+workers = int(os.environ.get('NALLAMPATTI_WORKERS', min(4, os.cpu_count() or 1)))
+# Threads per worker; the live stream holds a connection open per client
+threads = int(os.environ.get('NALLAMPATTI_THREADS', 8))
+preload_app = True
+timeout = 120
+
+
+def when_ready(server):
+    # Objects loaded so far are moved out of the collector's generations so
+    # that collections in the workers do not write to (and copy) their pages
+    gc.freeze()
+    server.log.info('Preloaded app; forking %d workers', server.num_workers)
+
+
+def post_fork(server, worker):
+    # Each worker delivers queued contact messages from its own thread
+    from contact import get_contact_queue
+    get_contact_queue()
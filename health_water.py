@@ -0,0 +1,216 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import compliance
+from cohorts import label_indicators
+from compliance import survey_compliance
+from datasets import get_dataset
+from response_cache import file_signature
+
+# Ward-level view of the water-health nexus. The surveys only share the ward
+# between them (people in 1500Data.csv are not linked to households), so
+# every exposure is a ward property: the share of a ward's households with a
+# water source or treatment, and its survey water quality. People inherit
+# their ward's exposure in the contingency tables, which makes these
+# ecological associations, not individual risks.
+DATA_FILES = ('1500Data.csv', 'Death person.csv', 'Household_lifestyle.csv')
+EXPOSURES = {
+    'Source_of_drinking': 'Source of drinking water',
+    'Processed_for_Drinking': 'Water processing',
+    'Presence_of_well_': 'Well at home',
+    'Presence of Toilet': 'Toilet',
+    'Grey Water Discharge': 'Grey water discharge',
+}
+NO_DISEASE = 'No Disease'
+ANY_DISEASE = 'Any disease'
+Z_95 = 1.959964
+
+
+def data_version():
+    return file_signature(*DATA_FILES) + compliance.data_version()
+
+
+def disease_indicators(general):
+    # One 0/1 column per disease; a person can report several, comma separated
+    indicators = label_indicators(general['Disease'].fillna(NO_DISEASE)).sparse.to_dense().astype(int)
+    indicators = indicators.drop(columns=NO_DISEASE, errors='ignore')
+    indicators[ANY_DISEASE] = indicators.max(axis=1)
+    indicators['Cancer'] = (general['Cancer'] == 'Yes').astype(int)
+    return indicators
+
+
+def water_features():
+    # Per map ward: mean sample WQI, the share of samples over any acceptable
+    # limit and the share over each parameter's limit
+    index = survey_compliance()
+    readings = index.readings[index.readings['level'] >= 0]
+    samples = readings.groupby(['year', 'sample', 'ward'])['level'].max().gt(0).rename('over')
+    samples = samples.reset_index()
+    by_param = readings.assign(over=readings['level'] > 0).groupby(['ward', 'parameter'])['over'].mean()
+    features = by_param.unstack('parameter').add_prefix('Samples over ').mul(100)
+    features.insert(0, 'Samples over any limit', samples.groupby('ward')['over'].mean() * 100)
+    features.insert(0, 'Mean WQI', index.sample_wqi.groupby('ward')['wqi'].mean())
+    features = features.drop(index=0, errors='ignore')
+    # Parameters no sample ever exceeded carry no signal
+    return features.loc[:, features.fillna(0).any()]
+
+
+class WardFeatures:
+    # Count tables by ward, built once per data version; every contingency
+    # table and rate is a sum over their rows
+
+    def __init__(self):
+        general = get_dataset('1500Data.csv')
+        deaths = get_dataset('Death person.csv')
+        households = get_dataset('Household_lifestyle.csv')
+
+        indicators = disease_indicators(general)
+        self.diseases = [ANY_DISEASE] + sorted(c for c in indicators.columns if c != ANY_DISEASE)
+        self.cases = indicators.groupby(general['Ward']).sum()[self.diseases]
+        self.population = general.groupby('Ward').size()
+        self.households = households.groupby('Ward').size()
+        self.exposures = {column: pd.crosstab(households['Ward'], households[column])
+                          for column in EXPOSURES}
+        self.deaths = pd.crosstab(deaths['Ward'], deaths['Reason'])
+        self.wards = sorted(set(self.population.index) | set(self.households.index))
+        self.water = water_features().reindex(self.wards)
+
+    def prevalence(self):
+        # Cases per 100 people surveyed in each ward
+        return self.cases.div(self.population, axis=0).mul(100).reindex(self.wards)
+
+    def shares(self, column):
+        # Percentage of each ward's households in each category of `column`
+        counts = self.exposures[column]
+        return counts.div(counts.sum(axis=1), axis=0).mul(100).reindex(self.wards)
+
+    def matrix(self):
+        # The ward feature matrix: exposures, water quality and outcomes
+        exposures = pd.concat([self.shares(column).add_prefix(f'{label}: ')
+                               for column, label in EXPOSURES.items()], axis=1)
+        deaths = self.deaths.div(self.households, axis=0).mul(100).add_prefix('Deaths per 100 households: ')
+        return pd.concat([exposures, self.water, self.prevalence(), deaths.reindex(self.wards)], axis=1)
+
+
+def load_features():
+    return _load_features(data_version())
+
+
+@lru_cache(maxsize=1)
+def _load_features(version):
+    return WardFeatures()
+
+
+def chi2_sf(x, dof):
+    # Upper tail of the chi-square distribution: the regularised upper
+    # incomplete gamma Q(dof/2, x/2), by its series below a + 1 and its
+    # continued fraction above (scipy is not a dependency)
+    a, x = dof / 2.0, x / 2.0
+    if x <= 0:
+        return 1.0
+    log_front = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        term = total = 1.0 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1.0 - total * math.exp(log_front))
+    # Lentz's method
+    tiny = 1e-300
+    b = x + 1 - a
+    c, d = 1.0 / tiny, 1.0 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return h * math.exp(log_front)
+
+
+def chi_square(table):
+    # Pearson's test of independence on a contingency table; rows or
+    # columns without any counts are dropped first
+    table = np.asarray(table, dtype=float)
+    table = table[table.sum(axis=1) > 0][:, table.sum(axis=0) > 0]
+    if min(table.shape) < 2:
+        return None
+    expected = np.outer(table.sum(axis=1), table.sum(axis=0)) / table.sum()
+    statistic = float(((table - expected) ** 2 / expected).sum())
+    dof = (table.shape[0] - 1) * (table.shape[1] - 1)
+    return {'chi2': statistic, 'dof': dof, 'p': chi2_sf(statistic, dof),
+            'min_expected': float(expected.min())}
+
+
+def odds_ratio(a, b, c, d):
+    # Exposed cases a, exposed non-cases b, unexposed cases c and unexposed
+    # non-cases d. Woolf's 95% interval; 0.5 is added to every cell when any
+    # is empty.
+    if 0 in (a, b, c, d):
+        a, b, c, d = a + 0.5, b + 0.5, c + 0.5, d + 0.5
+    ratio = (a * d) / (b * c)
+    se = math.sqrt(1 / a + 1 / b + 1 / c + 1 / d)
+    return {'odds_ratio': ratio, 'ci_low': math.exp(math.log(ratio) - Z_95 * se),
+            'ci_high': math.exp(math.log(ratio) + Z_95 * se)}
+
+
+def association(column, disease):
+    return _association(data_version(), column, disease)
+
+
+@lru_cache(maxsize=128)
+def _association(version, column, disease):
+    # How `disease` varies with a household attribute across wards. For each
+    # category, wards above the median share of households in it count as
+    # exposed (2x2 table, odds ratio, chi-square); the overall test groups
+    # people by their ward's most common category.
+    features = _load_features(version)
+    cases = features.cases[disease].reindex(features.wards, fill_value=0)
+    population = features.population.reindex(features.wards, fill_value=0)
+    shares = features.shares(column).fillna(0)
+
+    categories = []
+    for category in shares.columns:
+        exposed = (shares[category] > shares[category].median()).to_numpy()
+        a, c = int(cases[exposed].sum()), int(cases[~exposed].sum())
+        b, d = int(population[exposed].sum()) - a, int(population[~exposed].sum()) - c
+        result = {'category': category, 'exposed_wards': [int(w) for w in shares.index[exposed]],
+                  'table': [[a, b], [c, d]]}
+        if exposed.any() and not exposed.all():
+            result.update(odds_ratio(a, b, c, d))
+            result['test'] = chi_square([[a, b], [c, d]])
+        categories.append(result)
+
+    majority = shares.idxmax(axis=1)
+    grouped = pd.DataFrame({'cases': cases, 'population': population}).groupby(majority).sum()
+    table = np.column_stack([grouped['cases'], grouped['population'] - grouped['cases']])
+    return {'column': column, 'disease': disease, 'categories': categories,
+            'majority': {'wards': {str(k): [int(w) for w in v] for k, v in majority.groupby(majority).groups.items()},
+                         'table': table.tolist(), 'test': chi_square(table)}}
+
+
+def correlations():
+    return _correlations(data_version())
+
+
+@lru_cache(maxsize=1)
+def _correlations(version):
+    # Pearson correlation across wards between every exposure or water
+    # quality feature and every outcome (pairwise over wards with data)
+    features = _load_features(version)
+    matrix = features.matrix()
+    outcomes = [c for c in matrix.columns if c in features.diseases or c.startswith('Deaths per')]
+    exposures = [c for c in matrix.columns if c not in outcomes]
+    return matrix.corr()[outcomes].loc[exposures]
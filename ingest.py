@@ -0,0 +1,235 @@
+import atexit
+import fcntl
+import hmac
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+import pandas as pd
+from flask import Blueprint, jsonify, request
+
+from stations import UnknownStation, get_station, get_station_store
+
+ingest_bp = Blueprint('ingest', __name__)
+
+# ThingSpeak channel fields reported by the monitoring unit
+FIELD_MAP = {'field1': 'pH', 'field2': 'TDS', 'field3': 'Depth'}
+MAX_BATCH = 1000
+
+WRITE_API_KEY = os.environ.get('NALLAMPATTI_WRITE_API_KEY')
+FSYNC_INTERVAL = float(os.environ.get('NALLAMPATTI_INGEST_FSYNC_SECONDS', 30.0))
+
+
+class IngestError(ValueError):
+    def __init__(self, message, index=None):
+        super().__init__(message)
+        self.index = index
+
+
+def _number(value, name, index):
+    if value is None or value == '':
+        return math.nan
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise IngestError(f"'{name}' must be numeric, got {value!r}", index)
+    if math.isinf(number):
+        raise IngestError(f"'{name}' must be finite", index)
+    return number
+
+
+def parse_readings(payload, tz, field_map=FIELD_MAP):
+    # Accepts a single ThingSpeak-style reading, a bulk update
+    # ({"updates": [...]}) or a channel feed export ({"feeds": [...]}).
+    # Fields may be given as field1..fieldN or by parameter name.
+    if not isinstance(payload, dict):
+        raise IngestError('Expected a JSON object')
+    updates = payload.get('updates', payload.get('feeds'))
+    if updates is None:
+        updates = [payload]
+    if not isinstance(updates, list) or not updates:
+        raise IngestError("'updates' must be a non-empty list")
+    if len(updates) > MAX_BATCH:
+        raise IngestError(f'At most {MAX_BATCH} readings per request')
+
+    records = []
+    for index, update in enumerate(updates):
+        if not isinstance(update, dict):
+            raise IngestError('Each reading must be an object', index)
+        try:
+            created_at = pd.Timestamp(update.get('created_at'))
+        except (TypeError, ValueError):
+            raise IngestError(f"Invalid 'created_at' {update.get('created_at')!r}", index)
+        if created_at is pd.NaT:
+            raise IngestError("'created_at' is required", index)
+        created_at = created_at.tz_localize(tz) if created_at.tzinfo is None else created_at.tz_convert(tz)
+
+        record = {'Datetime': created_at}
+        for field, param in field_map.items():
+            record[param] = _number(update.get(field, update.get(param)), param, index)
+        if all(math.isnan(record[p]) for p in field_map.values()):
+            raise IngestError('Reading has no sensor values', index)
+        if update.get('entry_id') is not None:
+            try:
+                record['entry_id'] = int(update['entry_id'])
+            except (TypeError, ValueError):
+                raise IngestError(f"Invalid 'entry_id' {update['entry_id']!r}", index)
+        records.append(record)
+    return records
+
+
+def _format_value(value):
+    return '' if pd.isna(value) else repr(float(value)).removesuffix('.0')
+
+
+class SensorWriter:
+    # Appends accepted readings to the in-memory sensor store and the CSV log.
+    # Every gunicorn worker has its own writer, so each write holds an flock on
+    # the log: readings other processes appended are loaded first, entry_ids
+    # continue from the log's highest, and the lines reach the file before the
+    # lock is released. fsyncs are batched, at most one every FSYNC_INTERVAL.
+
+    def __init__(self, store, fsync_interval=FSYNC_INTERVAL):
+        self.store = store
+        self.fsync_interval = fsync_interval
+        self._unsynced = set()
+        self._last_fsync = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def write(self, records):
+        def build_rows(last_id):
+            next_id = (last_id or 0) + 1
+            for record in records:
+                if 'entry_id' not in record:
+                    record['entry_id'] = next_id
+                next_id = max(next_id, record['entry_id']) + 1
+            return pd.DataFrame.from_records(records)
+
+        with self._lock, _locked(self.store.lock_path):
+            accepted = self.store.append(build_rows)
+            by_file = {}
+            for target, line in self._lines(accepted):
+                by_file.setdefault(target, []).append(line)
+            for target, lines in by_file.items():
+                self._append_lines(target, lines)
+            self._unsynced.update(by_file)
+        self._ensure_thread()
+        return accepted
+
+    def _lines(self, rows):
+        # (file, line) pairs: a partitioned log gets each reading in the
+        # partition of its month
+        columns = self.store.columns
+        for row in rows[columns].itertuples(index=False):
+            values = []
+            for column, value in zip(columns, row):
+                if column == 'Datetime':
+                    target = self.store.partition_file(value)
+                    values.append(value.isoformat())
+                elif column == 'entry_id':
+                    values.append(str(int(value)))
+                else:
+                    values.append(_format_value(value))
+            yield target, (','.join(values) + '\r\n').encode()
+
+    def _append_lines(self, target, lines):
+        with open(target, 'a+b') as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                # First reading of a new partition
+                f.write((','.join(self.store.columns) + '\r\n').encode())
+            else:
+                # Never glue a reading onto an unterminated last line
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\r\n')
+            f.writelines(lines)
+
+    def sync(self):
+        # fsync every file written to since the last sync
+        with self._lock:
+            unsynced, self._unsynced = self._unsynced, set()
+            self._last_fsync = time.monotonic()
+        for target in unsynced:
+            with open(target, 'rb') as f:
+                os.fsync(f.fileno())
+        return len(unsynced)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sensor-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(max(0.0, self._last_fsync + self.fsync_interval - time.monotonic()))
+            if self._unsynced:
+                self.sync()
+            else:
+                self._last_fsync = time.monotonic()
+
+
+@contextmanager
+def _locked(path):
+    # Exclusive flock on path, shared by every process writing the same log
+    with open(path, 'ab') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def get_sensor_writer(station=None):
+    return _station_writer(get_station(station)['id'])
+
+
+@lru_cache(maxsize=None)
+def _station_writer(station_id):
+    writer = SensorWriter(get_station_store(station_id))
+    atexit.register(writer.sync)
+    return writer
+
+
+def _authorized(payload):
+    key = (request.headers.get('X-THINGSPEAKAPIKEY') or request.args.get('api_key')
+           or (payload.get('write_api_key') or payload.get('api_key') if isinstance(payload, dict) else None))
+    return isinstance(key, str) and hmac.compare_digest(key.encode(), WRITE_API_KEY.encode())
+
+
+@ingest_bp.route('/api/iot/ingest', methods=['POST'])
+def ingest():
+    # Writes are refused until a key is configured
+    if not WRITE_API_KEY:
+        return jsonify({'error': 'Ingestion is disabled: NALLAMPATTI_WRITE_API_KEY is not set'}), 403
+    payload = request.get_json(silent=True)
+    if not _authorized(payload):
+        return jsonify({'error': 'Invalid write API key'}), 401
+
+    # Readings go to ?station= (or "station" in the body), the first
+    # registered station by default
+    station = request.args.get('station') or (payload.get('station') if isinstance(payload, dict) else None)
+    try:
+        station = get_station(station)
+    except UnknownStation as e:
+        return jsonify({'error': str(e)}), 404
+
+    writer = get_sensor_writer(station['id'])
+    tz = writer.store.get()['Datetime'].dt.tz
+    try:
+        records = parse_readings(payload, tz, station['fields'] or FIELD_MAP)
+    except IngestError as e:
+        return jsonify({'error': str(e), 'index': e.index}), 400
+
+    accepted = writer.write(records)
+    return jsonify({
+        'received': len(records),
+        'accepted': len(accepted),
+        'station': station['id'],
+        'last_entry_id': writer.store.last_entry_id
+    })
@@ -1,17 +1,34 @@
-from flask import Blueprint, render_template_string, jsonify, request
+from flask import Blueprint, jsonify, render_template_string, request
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objs as go
-import json
+from plotly.colors import qualitative
+from datasets import get_dataset
+from response_cache import cached_response, file_signature
+from figure_json import figure_response
+from instrumentation import lap
+from cohorts import FACETS, cohort_index, value_counts
 
 insights_bp = Blueprint('insights', __name__, url_prefix='/insights')
 
-# Read the CSV data
-household_data = pd.read_csv(r'Household_lifestyle.csv')
-general_data = pd.read_csv('1500Data.csv')
+DATA_FILES = ('Household_lifestyle.csv', '1500Data.csv')
+
+def data_version():
+    return file_signature(*DATA_FILES)
+
+# Read on first use from the shared registry, again whenever a file changes
+def load_data():
+    return get_dataset('Household_lifestyle.csv'), get_dataset('1500Data.csv')
 
 exclude_columns = ['Ward', 'Age','Cancer','Disease','Substance Abuse','Exposure_to_pesticide']
-custom_colors = px.colors.qualitative.Set2
+household_options = [
+    {'label': 'Source of Drinking Water', 'value': 'Source_of_drinking'},
+    {'label': 'Water Processing Method', 'value': 'Processed_for_Drinking'},
+    {'label': 'Presence of Toilet', 'value': 'Presence of Toilet'},
+    {'label': 'Grey Water Discharge Method', 'value': 'Grey Water Discharge'},
+    {'label': 'Crops Grown', 'value': 'Crops_grown_in_Na'},
+    {'label': 'Cooking Fuel', 'value': 'Fuel_used_for_cook'}
+]
+custom_colors = qualitative.Set2
 
 # HTML template
 html_template = '''
@@ -144,23 +161,26 @@ html_template = '''
 </html>
 '''
 
+def general_options():
+    _, general_data = load_data()
+    return [{'label': col, 'value': col} for col in general_data.columns if col not in exclude_columns]
+
 @insights_bp.route('/')
 def dashboard():
-    household_options = [
-        {'label': 'Source of Drinking Water', 'value': 'Source_of_drinking'},
-        {'label': 'Water Processing Method', 'value': 'Processed_for_Drinking'},
-        {'label': 'Presence of Toilet', 'value': 'Presence of Toilet'},
-        {'label': 'Grey Water Discharge Method', 'value': 'Grey Water Discharge'}
-    ]
-    general_options = [{'label': col, 'value': col} for col in general_data.columns if col not in exclude_columns]
-    return render_template_string(html_template, household_options=household_options, general_options=general_options)
+    return render_template_string(html_template, household_options=household_options, general_options=general_options())
 
 @insights_bp.route('/update_household_chart', methods=['POST'])
+@cached_response(data_version)
 def update_household_chart():
+    import plotly.express as px
+    household_data, _ = load_data()
     selected_category = request.json['selected_category']
-    counts = household_data[selected_category].value_counts()
+    # Households listing several crops or fuels count under each
+    counts = value_counts(household_data, selected_category, 'Household_lifestyle.csv')
+    households = household_data[selected_category].notna().sum()
     labels = counts.index.tolist()
     values = counts.values.tolist()
+    lap('query')
 
     fig = px.pie(
         names=labels,
@@ -186,34 +206,40 @@ def update_household_chart():
         uniformtext_minsize=12,
         uniformtext_mode='hide'
     )
+    lap('figure')
 
-    summary = generate_household_summary(selected_category, counts)
+    summary = generate_household_summary(selected_category, counts, households)
 
-    return jsonify({
-        'chart': json.loads(fig.to_json()),
+    return figure_response({
+        'chart': fig,
         'summary': summary
     })
 
 @insights_bp.route('/update_general_chart', methods=['POST'])
+@cached_response(data_version)
 def update_general_chart():
+    _, general_data = load_data()
     selected_column = request.json['selected_column']
-    value_counts = general_data[selected_column].value_counts()
+    # Multi-valued answers such as 'Diabetes,Hypertension' count once
+    # under each of their parts
+    counts = value_counts(general_data, selected_column, '1500Data.csv')
     
-    if len(value_counts) > 10:
-        top_10 = value_counts.nlargest(10)
-        others = pd.Series({'Others': value_counts.sum() - top_10.sum()})
-        value_counts = pd.concat([top_10, others])
+    if len(counts) > 10:
+        top_10 = counts.nlargest(10)
+        others = pd.Series({'Others': counts.sum() - top_10.sum()})
+        counts = pd.concat([top_10, others])
+    lap('query')
     
     fig = go.Figure(data=[go.Pie(
-        labels=value_counts.index.tolist(),
-        values=value_counts.values.tolist(),
+        labels=counts.index.tolist(),
+        values=counts.values.tolist(),
         hole=.4,
         textposition='outside',
         textinfo='label+percent',
         insidetextorientation='radial',
         textfont=dict(size=12, color='#333333'),
         marker=dict(colors=custom_colors, line=dict(color='#FFFFFF', width=2)),
-        pull=[0.05] * len(value_counts)
+        pull=[0.05] * len(counts)
     )])
     
     fig.update_layout(
@@ -239,16 +265,51 @@ def update_general_chart():
         plot_bgcolor='rgba(0,0,0,0)',
         showlegend=True
     )
+    lap('figure')
     
-    summary = generate_general_summary(selected_column, value_counts)
+    summary = generate_general_summary(selected_column, counts)
 
-    return jsonify({
-        'chart': json.loads(fig.to_json()),
+    return figure_response({
+        'chart': fig,
         'summary': summary
     })
 
-def generate_household_summary(selected_category, counts):
-    total = counts.sum()
+@insights_bp.route('/cohort')
+def cohort():
+    # People in 1500Data.csv matching facet filters, e.g.
+    # ?ward=3,4&sex=Female&disease=Diabetes&disease=Hypertension: commas
+    # separate alternatives, repeating a facet requires every group. by=<facet>
+    # breaks the cohort down by that facet and rows=1 returns the records.
+    index = cohort_index()
+    filters = {}
+    for facet in FACETS:
+        groups = [[v.strip() for v in value.split(',') if v.strip()] for value in request.args.getlist(facet)]
+        if any(groups):
+            filters[facet] = [group for group in groups if group]
+    by = request.args.get('by')
+    if by is not None and by not in FACETS:
+        return jsonify({'error': f'by must be one of {list(FACETS)}'}), 400
+    try:
+        bits = index.select(filters)
+    except KeyError as e:
+        return jsonify({'error': e.args[0]}), 400
+
+    result = {'filters': filters, 'count': index.count(bits), 'total': index.size}
+    if by is not None:
+        result['by'] = {by: index.breakdown(bits, by)}
+    if request.args.get('rows') == '1':
+        rows = index.rows(bits).drop(columns='Age_Band').astype(object)
+        result['rows'] = rows.where(rows.notna(), None).to_dict('records')
+    return figure_response(result)
+
+@insights_bp.route('/cohort/facets')
+def cohort_facets():
+    return figure_response(cohort_index().facets())
+
+def generate_household_summary(selected_category, counts, households=None):
+    # Shares are of households answering; for multi-valued answers that is
+    # fewer than the sum of the counts
+    total = households or counts.sum()
     most_common = counts.index[0]
     least_common = counts.index[-1]
     most_common_percentage = (counts[most_common] / total) * 100
@@ -291,6 +352,25 @@ def generate_household_summary(selected_category, counts):
             f"The diversity in discharge methods ({len(counts)} types) reflects varying levels of water management infrastructure and awareness.",
             "Recommendation: Promote environmentally friendly grey water discharge methods and explore opportunities for grey water recycling in agriculture or landscaping."
         ]
+    elif selected_category == 'Crops_grown_in_Na':
+        crops = counts.drop('Nil', errors='ignore')
+        no_crops = counts.get('Nil', 0) / total * 100
+        summary = [
+            f"{crops.index[0]} is the most widely grown crop, grown by {crops.iloc[0] / total * 100:.1f}% of households, "
+            f"followed by {crops.index[1].lower()} ({crops.iloc[1] / total * 100:.1f}%).",
+            f"{no_crops:.1f}% of households grow no crops; the others grow {crops.sum() / max(total - counts.get('Nil', 0), 1):.1f} "
+            f"of the {len(crops)} reported crops on average.",
+            f"Only {crops.iloc[-1] / total * 100:.1f}% grow {crops.index[-1].lower()}, the least common crop.",
+            "Recommendation: Tailor pesticide-safety and water-use advice to the dominant crops, and support diversification where households depend on one or two."
+        ]
+    elif selected_category == 'Fuel_used_for_cook':
+        solid_fuel = counts[[fuel for fuel in counts.index if fuel in ('Firewood', 'Kerosene')]].sum() / total * 100
+        summary = [
+            f"{most_common} is the main cooking fuel, used by {most_common_percentage:.1f}% of households.",
+            f"{solid_fuel:.1f}% of households still cook with firewood or kerosene, a source of indoor air pollution.",
+            f"Households use {counts.sum() / total:.2f} fuels on average; {least_common} is the least common, at {least_common_percentage:.1f}%.",
+            "Recommendation: Extend clean-fuel schemes and biogas support to the households that still rely on firewood or kerosene."
+        ]
 
     return summary
 
@@ -0,0 +1,333 @@
+import bisect
+import heapq
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, before_render_template, g, has_request_context, request, template_rendered
+
+# Per-request timings by phase, sent back in a Server-Timing header and
+# summed into Prometheus metrics at /metrics. Phases nest: each records only
+# its own time, and whatever no phase claims is reported as 'handler'. Views
+# can also split their own time with lap(). Metrics are per process (one set
+# per gunicorn worker).
+INSTRUMENT = os.environ.get('NALLAMPATTI_INSTRUMENT', '1') == '1'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Opt-in sampling profiler: stacks of the threads serving requests are
+# sampled every PROFILE_INTERVAL, and the slowest PROFILE_KEEP requests are
+# written as folded stacks (flamegraph.pl, speedscope, inferno)
+PROFILE = os.environ.get('NALLAMPATTI_PROFILE') == '1'
+PROFILE_DIR = os.environ.get('NALLAMPATTI_PROFILE_DIR', os.path.join('.cache', 'profiles'))
+PROFILE_INTERVAL = float(os.environ.get('NALLAMPATTI_PROFILE_INTERVAL_MS', 5)) / 1000
+PROFILE_KEEP = int(os.environ.get('NALLAMPATTI_PROFILE_KEEP', 20))
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.requests = Counter()
+        self.latency = defaultdict(lambda: [0] * (len(buckets) + 1))
+        self.latency_sum = Counter()
+        self.phases = Counter()
+        self.rows = Counter()
+        self.cache = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, method, status, seconds, phases):
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            self.latency[endpoint][bisect.bisect_left(self.buckets, seconds)] += 1
+            self.latency_sum[endpoint] += seconds
+            for name, spent in phases.items():
+                self.phases[endpoint, name] += spent
+
+    def count_rows(self, source, rows):
+        with self._lock:
+            self.rows[source] += rows
+
+    def count_cache(self, cache, hit):
+        with self._lock:
+            self.cache[cache, 'hit' if hit else 'miss'] += 1
+
+    def render(self, extra_cache=()):
+        # Prometheus text exposition format
+        with self._lock:
+            requests = dict(self.requests)
+            latency = {k: list(v) for k, v in self.latency.items()}
+            latency_sum = dict(self.latency_sum)
+            phases = dict(self.phases)
+            rows = dict(self.rows)
+            cache = dict(self.cache)
+        cache.update(extra_cache)
+
+        lines = ['# HELP nallampatti_requests_total Requests handled, by endpoint, method and status.',
+                 '# TYPE nallampatti_requests_total counter']
+        for (endpoint, method, status), count in sorted(requests.items()):
+            lines.append(f'nallampatti_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {count}')
+
+        lines += ['# HELP nallampatti_request_seconds Request latency by endpoint.',
+                  '# TYPE nallampatti_request_seconds histogram']
+        for endpoint, counts in sorted(latency.items()):
+            total = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+                total += count
+                lines.append(f'nallampatti_request_seconds_bucket{_labels(endpoint=endpoint, le=bound)} {total}')
+            lines.append(f'nallampatti_request_seconds_sum{_labels(endpoint=endpoint)} {latency_sum[endpoint]:.6f}')
+            lines.append(f'nallampatti_request_seconds_count{_labels(endpoint=endpoint)} {total}')
+
+        lines += ['# HELP nallampatti_phase_seconds_total Time spent in each request phase, by endpoint.',
+                  '# TYPE nallampatti_phase_seconds_total counter']
+        for (endpoint, name), spent in sorted(phases.items()):
+            lines.append(f'nallampatti_phase_seconds_total{_labels(endpoint=endpoint, phase=name)} {spent:.6f}')
+
+        lines += ['# HELP nallampatti_rows_scanned_total Rows parsed from CSV or sliced from the sensor log.',
+                  '# TYPE nallampatti_rows_scanned_total counter']
+        for source, count in sorted(rows.items()):
+            lines.append(f'nallampatti_rows_scanned_total{_labels(source=source)} {count}')
+
+        lines += ['# HELP nallampatti_cache_requests_total Cache lookups by cache and result.',
+                  '# TYPE nallampatti_cache_requests_total counter']
+        for (name, result), count in sorted(cache.items()):
+            lines.append(f'nallampatti_cache_requests_total{_labels(cache=name, result=result)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+metrics = Metrics()
+
+
+class SamplingProfiler:
+    # One thread samples the stacks of the threads that are serving a
+    # request; it sleeps while there are none
+
+    def __init__(self, interval=PROFILE_INTERVAL, keep=PROFILE_KEEP, out_dir=PROFILE_DIR):
+        self.interval = interval
+        self.keep = keep
+        self.out_dir = out_dir
+        self.active = {}
+        self._slowest = []
+        self._labels = {}
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        # Guards `active`, which request threads change while the sampler
+        # reads it
+        self._active_lock = threading.Lock()
+        self._thread = None
+
+    def begin(self):
+        with self._active_lock:
+            self.active[threading.get_ident()] = Counter()
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def end(self, name, seconds):
+        with self._active_lock:
+            stacks = self.active.pop(threading.get_ident(), None)
+        if not stacks:
+            return None
+        with self._lock:
+            if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+                return None
+            path = self._write(name, seconds, stacks)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, (seconds, path))
+            else:
+                _, evicted = heapq.heapreplace(self._slowest, (seconds, path))
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+        return path
+
+    def _write(self, name, seconds, stacks):
+        os.makedirs(self.out_dir, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_')
+        path = os.path.join(self.out_dir, f'{time.time():.3f}-{slug}-{seconds * 1000:.0f}ms.folded')
+        with open(path, 'w') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in stacks.items())
+        return path
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+            self._labels[code] = label
+        return label
+
+    def _stack(self, frame):
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._active_lock:
+                active = list(self.active.items())
+            if not active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            frames = sys._current_frames()
+            samples = [(ident, stacks, self._stack(frames[ident])) for ident, stacks in active if ident in frames]
+            del frames
+            with self._active_lock:
+                for ident, stacks, stack in samples:
+                    # Skip requests that ended while their stack was read
+                    if self.active.get(ident) is stacks:
+                        stacks[stack] += 1
+            time.sleep(self.interval)
+
+    def reset_after_fork(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._active_lock = threading.Lock()
+        self.active = {}
+
+
+profiler = SamplingProfiler() if PROFILE else None
+if profiler is not None:
+    os.register_at_fork(after_in_child=profiler.reset_after_fork)
+
+
+def _state():
+    if not INSTRUMENT or not has_request_context():
+        return None
+    return g.get('_timing')
+
+
+@contextmanager
+def phase(name):
+    # Time the block as `name` in the current request (a no-op outside one)
+    state = _state()
+    if state is None:
+        yield
+        return
+    state['stack'].append(0.0)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        spent = time.perf_counter() - started
+        children = state['stack'].pop()
+        state['phases'][name] += spent - children
+        state['claimed'] += spent - children
+        if state['stack']:
+            state['stack'][-1] += spent
+
+
+def lap(name):
+    # Time since the handler started or the last lap, less what phases
+    # claimed in between, goes to `name`
+    state = _state()
+    if state is None:
+        return
+    now = time.perf_counter()
+    spent = now - state['lap'] - (state['claimed'] - state['lap_claimed'])
+    state['phases'][name] += spent
+    state['claimed'] += spent
+    state['lap'], state['lap_claimed'] = now, state['claimed']
+
+
+def note(name, description):
+    # A named mark without a duration, e.g. a cache hit
+    state = _state()
+    if state is not None:
+        state['notes'][name] = description
+
+
+def count_rows(source, rows):
+    if INSTRUMENT:
+        metrics.count_rows(source, int(rows))
+
+
+def count_cache(cache, hit):
+    if INSTRUMENT:
+        metrics.count_cache(cache, hit)
+
+
+def _begin_request():
+    now = time.perf_counter()
+    g._timing = {'started': now, 'phases': Counter(), 'notes': {}, 'stack': [], 'claimed': 0.0,
+                 'lap': now, 'lap_claimed': 0.0, 'templates': []}
+    if profiler is not None:
+        profiler.begin()
+
+
+def _template_started(sender, template, context, **extra):
+    state = _state()
+    if state is not None:
+        timer = phase('template')
+        timer.__enter__()
+        state['templates'].append(timer)
+
+
+def _template_finished(sender, template, context, **extra):
+    state = _state()
+    if state is not None and state['templates']:
+        state['templates'].pop().__exit__(None, None, None)
+
+
+def _finish_request(response):
+    state = _state()
+    if state is None:
+        return response
+    total = time.perf_counter() - state['started']
+    phases = dict(state['phases'])
+    phases['handler'] = max(0.0, total - state['claimed'])
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe(endpoint, request.method, response.status_code, total, phases)
+
+    timings = [f'{name};dur={spent * 1000:.2f}' for name, spent in phases.items()]
+    timings += [f'{name};desc="{description}"' for name, description in state['notes'].items()]
+    timings.append(f'total;dur={total * 1000:.2f}')
+    response.headers.add('Server-Timing', ', '.join(timings))
+    return response
+
+
+def _end_profile(exc):
+    if profiler is None:
+        return
+    state = g.get('_timing')
+    if state is not None:
+        profiler.end(f'{request.method} {request.endpoint or request.path}', time.perf_counter() - state['started'])
+
+
+@metrics_bp.route('/metrics')
+def metrics_view():
+    from response_cache import response_cache
+    extra = {('response', 'hit'): response_cache.hits, ('response', 'miss'): response_cache.misses}
+    return Response(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
+
+def init_instrumentation(app):
+    if not INSTRUMENT:
+        return
+    app.before_request(_begin_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_profile)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.register_blueprint(metrics_bp)
@@ -0,0 +1,225 @@
+import struct
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+import geo
+import water_quality
+from geo import load_geodata
+from water_quality import PARAMETERS, SURVEY_CSVS, load_surveys, survey_values
+
+SURVEY_YEARS = sorted(SURVEY_CSVS)
+METHODS = ['idw', 'kriging']
+MIN_SAMPLES = 5
+
+# Grid cells along the longer side of the village extent
+SURFACE_CELLS = 160
+IDW_POWER = 2.0
+IDW_NEIGHBOURS = 12
+VARIOGRAM_LAGS = 12
+CHUNK_CELLS = 8192
+
+# Colour ramps as (position, RGB) stops
+SEQUENTIAL_RAMP = [(0.0, (68, 1, 84)), (0.25, (59, 82, 139)), (0.5, (33, 145, 140)),
+                   (0.75, (94, 201, 98)), (1.0, (253, 231, 37))]
+DIVERGING_RAMP = [(0.0, (33, 102, 172)), (0.25, (103, 169, 207)), (0.5, (247, 247, 247)),
+                  (0.75, (239, 138, 98)), (1.0, (178, 24, 43))]
+OVERLAY_ALPHA = 170
+
+
+def _metres(lon, lat, origin):
+    # Local equirectangular projection; the village is a few km across
+    lon0, lat0 = origin
+    return np.column_stack([(np.asarray(lon) - lon0) * 111320.0 * np.cos(np.radians(lat0)),
+                            (np.asarray(lat) - lat0) * 110540.0])
+
+
+def data_version():
+    # Ward geometry and the water quality surveys
+    return geo.data_version() + water_quality.data_version()
+
+
+def survey_samples(year, param):
+    # Sample positions and values of one parameter; repeated visits to the
+    # same spot are averaged so that no two samples coincide. Censored
+    # readings ('>100') count at their bound.
+    samples = survey_values(year, param).dropna(subset=['lon', 'lat'])
+    if samples.empty:
+        return None
+    return samples.groupby(['lon', 'lat'], as_index=False)['value'].mean()
+
+
+def survey_parameters(year):
+    # Parameters with enough located measurements to interpolate
+    long, _ = load_surveys()
+    counts = long[(long['year'] == year) & long['lon'].notna()]['parameter'].value_counts()
+    return [param for param in PARAMETERS if counts.get(param, 0) >= MIN_SAMPLES]
+
+
+def surface_grid():
+    return _surface_grid(data_version())
+
+
+@lru_cache(maxsize=1)
+def _surface_grid(version):
+    # Cell centres over the ward extent and the mask of cells inside a ward
+    index, _ = load_geodata()
+    west, south, east, north = index.bounds
+    origin = ((west + east) / 2, (south + north) / 2)
+    width, height = np.diff(_metres([west, east], [south, north], origin), axis=0)[0]
+    step = max(width, height) / SURFACE_CELLS
+    nx, ny = int(np.ceil(width / step)), int(np.ceil(height / step))
+    lons = west + (np.arange(nx) + 0.5) * (east - west) / nx
+    lats = south + (np.arange(ny) + 0.5) * (north - south) / ny
+    grid_lon, grid_lat = np.meshgrid(lons, lats)
+    inside = index.locate(grid_lon.ravel(), grid_lat.ravel()).reshape(grid_lon.shape) > 0
+    return {'lons': lons, 'lats': lats, 'inside': inside, 'origin': origin,
+            'bounds': (west, south, east, north)}
+
+
+def _distances(cells, points):
+    return np.sqrt(((cells[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+
+
+def idw(points, values, cells, power=IDW_POWER, neighbours=IDW_NEIGHBOURS):
+    # Inverse distance weighting over the nearest samples of each cell. The
+    # k nearest come from argpartition on the cell-to-sample distances,
+    # computed a chunk of cells at a time.
+    k = min(neighbours, len(values))
+    result = np.empty(len(cells))
+    for start in range(0, len(cells), CHUNK_CELLS):
+        d = _distances(cells[start:start + CHUNK_CELLS], points)
+        nearest = np.argpartition(d, k - 1, axis=1)[:, :k] if k < len(values) else np.broadcast_to(np.arange(k), d.shape)
+        dist = np.take_along_axis(d, nearest, axis=1)
+        with np.errstate(divide='ignore'):
+            weights = 1.0 / dist ** power
+        # A cell on top of a sample takes its value
+        exact = dist == 0
+        weights = np.where(exact.any(axis=1, keepdims=True), exact.astype(float), weights)
+        result[start:start + CHUNK_CELLS] = (weights * values[nearest]).sum(axis=1) / weights.sum(axis=1)
+    return result
+
+
+def spherical(h, nugget, psill, rng):
+    r = np.minimum(h / rng, 1.0)
+    return nugget + psill * (1.5 * r - 0.5 * r ** 3)
+
+
+def fit_variogram(points, values, lags=VARIOGRAM_LAGS):
+    # Spherical model fitted to the binned empirical semivariogram: a scan
+    # over the range with nugget and partial sill from least squares
+    d = _distances(points, points)
+    upper = np.triu_indices(len(values), k=1)
+    h = d[upper]
+    gamma = 0.5 * (values[:, None] - values[None, :])[upper] ** 2
+    edges = np.linspace(0, h.max() / 2, lags + 1)
+    bins = np.digitize(h, edges) - 1
+    valid = (bins >= 0) & (bins < lags)
+    counts = np.bincount(bins[valid], minlength=lags)
+    used = counts > 0
+    lag_h = (np.bincount(bins[valid], h[valid], minlength=lags)[used] / counts[used])
+    lag_gamma = (np.bincount(bins[valid], gamma[valid], minlength=lags)[used] / counts[used])
+    weights = np.sqrt(counts[used])
+
+    best = None
+    for rng in np.linspace(edges[1], h.max(), 60):
+        basis = np.column_stack([np.ones_like(lag_h), spherical(lag_h, 0.0, 1.0, rng)])
+        coef, *_ = np.linalg.lstsq(basis * weights[:, None], lag_gamma * weights, rcond=None)
+        nugget, psill = np.maximum(coef, 0.0)
+        error = np.sum(weights ** 2 * (spherical(lag_h, nugget, psill, rng) - lag_gamma) ** 2)
+        if best is None or error < best[0]:
+            best = (error, nugget, psill, rng)
+    _, nugget, psill, rng = best
+    if nugget + psill == 0:
+        nugget = float(np.var(values)) or 1.0
+    return float(nugget), float(psill), float(rng)
+
+
+def ordinary_kriging(points, values, cells):
+    # Ordinary kriging with a fitted spherical variogram; the kriging matrix
+    # is solved once for all cells at a time
+    nugget, psill, rng = fit_variogram(points, values)
+    n = len(values)
+    system = np.ones((n + 1, n + 1))
+    system[:n, :n] = spherical(_distances(points, points), nugget, psill, rng)
+    np.fill_diagonal(system[:n, :n], 0.0)
+    system[n, n] = 0.0
+
+    result = np.empty(len(cells))
+    for start in range(0, len(cells), CHUNK_CELLS):
+        rhs = np.ones((n + 1, min(CHUNK_CELLS, len(cells) - start)))
+        rhs[:n] = spherical(_distances(cells[start:start + CHUNK_CELLS], points), nugget, psill, rng).T
+        try:
+            weights = np.linalg.solve(system, rhs)
+        except np.linalg.LinAlgError:
+            weights = np.linalg.lstsq(system, rhs, rcond=None)[0]
+        result[start:start + CHUNK_CELLS] = values @ weights[:n]
+    return result, {'nugget': nugget, 'partial_sill': psill, 'range_m': rng}
+
+
+def surface(year, param, method='idw'):
+    return _surface(data_version(), year, param, method)
+
+
+@lru_cache(maxsize=64)
+def _surface(version, year, param, method):
+    # float32 grid (rows south to north, NaN outside the wards) and details
+    # of the fit, or None when the parameter has too few samples that year
+    samples = survey_samples(year, param)
+    if samples is None or len(samples) < MIN_SAMPLES:
+        return None
+    grid = _surface_grid(version)
+    points = _metres(samples['lon'], samples['lat'], grid['origin'])
+    grid_lon, grid_lat = np.meshgrid(grid['lons'], grid['lats'])
+    inside = grid['inside'].ravel()
+    cells = _metres(grid_lon.ravel()[inside], grid_lat.ravel()[inside], grid['origin'])
+    values = samples['value'].to_numpy(dtype=float)
+
+    info = {'samples': len(samples)}
+    if method == 'kriging':
+        estimate, variogram = ordinary_kriging(points, values, cells)
+        info['variogram'] = variogram
+    else:
+        estimate = idw(points, values, cells)
+
+    z = np.full(inside.shape, np.nan, dtype=np.float32)
+    z[inside] = estimate
+    z = z.reshape(grid['inside'].shape)
+    z.setflags(write=False)
+    return z, info
+
+
+def difference(year, base, param, method='idw'):
+    # Change from `base` to `year`, where both surveys measured the parameter
+    later, earlier = surface(year, param, method), surface(base, param, method)
+    if later is None or earlier is None:
+        return None
+    z = later[0] - earlier[0]
+    return z, {'samples': later[1]['samples'], 'base_samples': earlier[1]['samples']}
+
+
+def colorize(z, ramp, lo, hi):
+    # RGBA image of a grid, north up, transparent where there is no value
+    t = np.clip(np.nan_to_num((z - lo) / (hi - lo) if hi > lo else np.zeros_like(z)), 0, 1)
+    stops = [s for s, _ in ramp]
+    rgba = np.zeros(z.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        rgba[..., channel] = np.interp(t, stops, [c[channel] for _, c in ramp]).round()
+    rgba[..., 3] = np.where(np.isnan(z), 0, OVERLAY_ALPHA)
+    return rgba[::-1]
+
+
+def encode_png(rgba):
+    # Minimal RGBA PNG encoder, so overlays need no imaging library (Pillow
+    # is optional)
+    height, width, _ = rgba.shape
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, -1)]).tobytes()
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6))
+            + chunk(b'IEND', b''))
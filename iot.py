@@ -1,32 +1,114 @@
 import pandas as pd
-import plotly 
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import plotly.io as pio
-from flask import Blueprint, render_template, request, flash
-import json
+from flask import Blueprint, Response, abort, render_template, request, flash, jsonify
+from sensor_store import to_timestamp
+from stations import UnknownStation, get_station, get_station_store, load_stations, map_stations, station_versions
+from downsample import downsample_indices, target_points, METHODS
+from aggregates import get_aggregates, GRANULARITIES, TIME_FREQ
+from figure_json import encode_payload, figure_response
+from instrumentation import lap, phase
+from anomalies import get_anomaly_index, EVENT_KINDS
+from seasonal_summary import seasonal_summary
 
 iot_bp = Blueprint('iot', __name__)
 
+DEFAULT_PLOT_WIDTH = 1200
+SERIES_AGGS = ['mean', 'min', 'max', 'count', 'sum', 'median']
+# How each aggregate is read from the precomputed rollup tables
+ROLLUP_STATS = {'min': 'min', 'max': 'max', 'count': 'count', 'sum': 'sum', 'median': 'p50'}
+
+
+# Station comparison lines, one colour per station
+STATION_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#9467bd', '#8c564b', '#e377c2', '#17becf', '#bcbd22']
+
+_comparison_cache = {}
+
+
+def unknown_params(store, params):
+    return [p for p in params if p not in store.parameters]
+
+
+def station_error(e):
+    return jsonify({'error': str(e)}), 404
+
+
+def downsample_series(df, param, threshold, method='lttb'):
+    # Reduce one parameter to about `threshold` points, returning wall-clock
+    # timestamps as Plotly displays them
+    with phase('downsample'):
+        series = df[['Datetime', param, 'Season']].dropna(subset=[param])
+        x = series['Datetime'].dt.tz_localize(None)
+        idx = downsample_indices(x.values.view('int64'), series[param].values, threshold, method)
+        return x.iloc[idx], series[param].iloc[idx], series['Season'].iloc[idx]
+
+def comparison_figure(station_ids, params):
+    # Daily means of each parameter at every station, one subplot per
+    # parameter. Each station's log and aggregates are loaded in parallel.
+    def daily_means(station):
+        available = [p for p in params if p in get_aggregates(station).params]
+        return rollup_series('day', None, None, available, 'mean', station)
+
+    frames = map_stations(daily_means, station_ids)
+    stations = load_stations()
+    fig = make_subplots(rows=len(params), cols=1, shared_xaxes=True, vertical_spacing=0.1,
+                        subplot_titles=[f"{param}: Daily Mean by Station" for param in params])
+    for i, param in enumerate(params, start=1):
+        for j, (station, frame) in enumerate(frames.items()):
+            if param not in frame:
+                continue
+            fig.add_trace(
+                go.Scatter(
+                    x=frame['Datetime'],
+                    y=frame[param],
+                    name=stations[station]['name'],
+                    legendgroup=station,
+                    showlegend=i == 1,
+                    line=dict(color=STATION_COLORS[j % len(STATION_COLORS)], width=1.5),
+                    hovertemplate=f'<b>%{{fullData.name}}</b> {param}: %{{y:.2f}}<br><b>Date</b>: %{{x|%Y-%m-%d}}<extra></extra>'
+                ),
+                row=i, col=1
+            )
+        fig.update_yaxes(title_text=param, row=i, col=1)
+
+    fig.update_layout(
+        title={'text': "Station Comparison", 'x': 0.5, 'xanchor': 'center', 'font': dict(size=20)},
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5),
+        hovermode="x unified",
+        height=300 * len(params),
+        margin=dict(l=60, r=60, t=80, b=60)
+    )
+    return fig
+
+
+def comparison_json(station_ids, params):
+    # Encoded comparison figure, rebuilt only when some station's log changed
+    key = (tuple(station_ids), tuple(params))
+    versions = station_versions(station_ids)
+    cached = _comparison_cache.get(key)
+    if cached is None or cached[0] != versions:
+        cached = (versions, encode_payload(comparison_figure(station_ids, params)).decode('utf-8'))
+        _comparison_cache[key] = cached
+    return cached[1]
+
+
 @iot_bp.route('/iot')
 def iot():
-    csv_file_path = 'n.csv'
-    parameters = ['TDS', 'pH']
+    # ?station= picks the station charted in detail; the default is the first
+    # one in the registry
+    try:
+        station = get_station(request.args.get('station'))
+    except UnknownStation as e:
+        abort(404, description=str(e))
+    store = get_station_store(station['id'])
+    parameters = [p for p in station['parameters'] if p in store.parameters]
 
     # Set the default template for a more professional look
     pio.templates.default = "plotly_white"
 
-    # Read the CSV data
-    df = pd.read_csv(csv_file_path, parse_dates=['Datetime'])
-
-    # Ensure the data is sorted by date
-    df = df.sort_values('Datetime')
-
-    # Add season column
-    df['Season'] = pd.cut(df['Datetime'].dt.month, 
-                          bins=[0, 3, 6, 9, 12],
-                          labels=['Winter', 'Spring', 'Summer', 'Fall'],
-                          include_lowest=True)
+    # Sorted sensor readings with the Season column, shared across requests
+    df = store.get()
 
     # Define colors for each parameter
     colors = {
@@ -40,16 +122,36 @@ def iot():
                         vertical_spacing=0.1,
                         subplot_titles=[f"{param} Over Time" for param in parameters])
 
-    # Add traces for each parameter
+    # Add traces for each parameter, downsampled to the default plot width;
+    # zooming fetches finer slices from /api/iot/window
+    threshold = target_points(DEFAULT_PLOT_WIDTH)
     for i, param in enumerate(parameters, start=1):
+        x, y, season = downsample_series(df, param, threshold)
         fig.add_trace(
             go.Scatter(
-                x=df['Datetime'], 
-                y=df[param], 
+                x=x, 
+                y=y, 
                 name=param,
                 line=dict(color=colors.get(param, '#000000'), width=2),
                 hovertemplate=f'<b>{param}</b>: %{{y:.2f}}<br><b>Date</b>: %{{x|%Y-%m-%d %H:%M:%S}}<br><b>Season</b>: %{{text}}<extra></extra>',
-                text=df['Season']
+                text=season
+            ),
+            row=i, col=1
+        )
+
+    # Overlay detected anomalies at their most severe reading
+    events = get_anomaly_index(station['id']).events(params=parameters)
+    for i, param in enumerate(parameters, start=1):
+        flagged = events[events['param'] == param]
+        fig.add_trace(
+            go.Scatter(
+                x=flagged['peak_time'].dt.tz_localize(None),
+                y=flagged['peak_value'],
+                mode='markers',
+                name=f'{param} anomalies',
+                marker=dict(color='#d62728', symbol='x', size=8),
+                text=flagged['kind'] + ' (' + flagged['points'].astype(str) + ' readings)',
+                hovertemplate=f'<b>{param} anomaly</b>: %{{text}}<br><b>Value</b>: %{{y:.2f}}<br><b>Date</b>: %{{x|%Y-%m-%d %H:%M:%S}}<extra></extra>'
             ),
             row=i, col=1
         )
@@ -57,7 +159,7 @@ def iot():
     # Customize the layout
     fig.update_layout(
         title={
-            'text': "Annual Water Quality Analysis",
+            'text': f"Annual Water Quality Analysis: {station['name']}",
             'y':0.95,
             'x':0.5,
             'xanchor': 'center',
@@ -88,43 +190,238 @@ def iot():
             type="date"
         )
     )
+    lap('figure')
 
-    # Generate seasonal statistics and analysis
-    seasons = ['Winter', 'Spring', 'Summer', 'Fall']
-    analysis = ["Seasonal Water Quality Summary:"]
-
-    for season in seasons:
-        season_data = df[df['Season'] == season]
-        analysis.append(f"\n{season} Insights:")
-        for param in parameters:
-            mean = season_data[param].mean()
-            min_val = season_data[param].min()
-            max_val = season_data[param].max()
-            analysis.append(f"  {param}: Mean {mean:.2f} (Range: {min_val:.2f} - {max_val:.2f})")
-            
-            if param == 'TDS':
-                if season == 'Fall':
-                    analysis.append(f"    Highest TDS average, potentially due to accumulated pollutants and reduced water levels.")
-                elif season == 'Spring':
-                    analysis.append(f"    Lowest TDS average, likely from increased precipitation and snowmelt dilution.")
-            elif param == 'pH':
-                if season == 'Summer':
-                    analysis.append(f"    Highest average pH, possibly due to increased biological activity.")
-                elif season == 'Spring':
-                    analysis.append(f"    Lowest average pH, may be influenced by spring runoff and acid rain.")
-
-    analysis.extend([
-        "\nKey Observations:",
-        "1. TDS shows significant seasonal fluctuations, peaking in Fall and lowest in Spring.",
-        "2. pH remains slightly alkaline year-round, with subtle seasonal variations.",
-        "3. Summer exhibits the widest TDS range, suggesting high variability in water quality.",
-        "4. Further investigation needed for extreme values, particularly in Summer TDS and pH."
-    ])
-
-    # Combine all analysis into a single string
-    analysis_text = '\n'.join(analysis)
+    # Seasonal statistics, trends and year-over-year changes computed from
+    # the aggregates, cached per version of the sensor log
+    analysis_text = seasonal_summary(parameters, station['id'])
+    lap('summary')
 
     # Convert the figure to JSON for rendering in the template
-    plot_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+    plot_json = encode_payload(fig).decode('utf-8')
+
+    # Every registered station side by side, when there is more than one
+    stations = list(load_stations().values())
+    comparison = None
+    if len(stations) > 1:
+        compare_params = list(dict.fromkeys(p for s in stations for p in s['parameters']))
+        comparison = comparison_json([s['id'] for s in stations], compare_params)
+
+    return render_template('iot.html', plot_json=plot_json, analysis=analysis_text, parameters=parameters,
+                           station=station, stations=stations, comparison_json=comparison,
+                           last_entry_id=store.last_entry_id)
+
+@iot_bp.route('/api/iot/window')
+def iot_window():
+    params = request.args.get('params', 'TDS,pH').split(',')
+    method = request.args.get('method', 'lttb')
+    try:
+        store = get_station_store(request.args.get('station'))
+    except UnknownStation as e:
+        return station_error(e)
+
+    unknown = unknown_params(store, params)
+    if unknown or method not in METHODS:
+        return jsonify({'error': f"Unknown parameter(s) {unknown} or method '{method}'"}), 400
+
+    try:
+        width = int(request.args.get('width', DEFAULT_PLOT_WIDTH))
+        window = store.window(request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    threshold = target_points(width)
+    series = {}
+    for param in params:
+        x, y, season = downsample_series(window, param, threshold, method)
+        series[param] = {
+            'x': x.dt.strftime('%Y-%m-%d %H:%M:%S').tolist(),
+            'y': y.tolist(),
+            'text': season.astype(str).tolist()
+        }
+
+    return jsonify({'total_points': len(window), 'series': series})
+
+
+def _local_bound(value, tz):
+    return None if value is None else to_timestamp(value, tz).tz_localize(None)
+
+
+def _resample(frame, rule, params, agg):
+    return frame.set_index('Datetime').resample(rule)[params].agg(agg).reset_index()
+
+
+def _local_window(store, start, end, params):
+    # Rows in [start, end] with sensor wall-clock timestamps
+    frame = store.window(start, end)[['Datetime'] + params].copy()
+    frame['Datetime'] = frame['Datetime'].dt.tz_localize(None)
+    return frame
+
+
+def rollup_series(granularity, start, end, params, agg, station=None):
+    # Hour/day/month buckets over [start, end]. Buckets wholly inside the
+    # window are read from the station's precomputed aggregate tables; the
+    # partial ones at either edge are resampled from the clipped rows, as any
+    # other resample rule is
+    store = get_station_store(station)
+    tz = store.get()['Datetime'].dt.tz
+    freq = TIME_FREQ[granularity]
+    step = pd.tseries.frequencies.to_offset(freq)
+    start, end = _local_bound(start, tz), _local_bound(end, tz)
+    # Full buckets start in [first, stop)
+    first = None if start is None else _bucket_start(start, granularity)
+    if first is not None and first < start:
+        first += step
+    stop = None if end is None else _bucket_start(end + pd.Timedelta(1, 'ns'), granularity)
+    if first is not None and stop is not None and first >= stop:
+        return _resample(_local_window(store, start, end, params), freq, params, agg)
+
+    table = get_aggregates(station).table(granularity)
+    index = table.index
+    lo = 0 if first is None else index.searchsorted(first, side='left')
+    hi = len(index) if stop is None else index.searchsorted(stop, side='left')
+    table = table.iloc[lo:hi]
+
+    frame = pd.DataFrame({'Datetime': table.index})
+    for param in params:
+        if agg == 'mean':
+            values = table[(param, 'sum')] / table[(param, 'count')]
+        else:
+            values = table[(param, ROLLUP_STATS[agg])]
+        frame[param] = values.to_numpy()
+
+    parts = [frame]
+    if first is not None and first > start:
+        head = _local_window(store, start, first - pd.Timedelta(1, 'ns'), params)
+        parts.insert(0, _resample(head, freq, params, agg))
+    if stop is not None and stop <= end:
+        parts.append(_resample(_local_window(store, stop, end, params), freq, params, agg))
+    parts = [part for part in parts if len(part)]
+    return pd.concat(parts, ignore_index=True) if parts else frame
+
+
+def _bucket_start(timestamp, granularity):
+    if granularity == 'month':
+        return timestamp.to_period('M').to_timestamp()
+    return timestamp.floor(TIME_FREQ[granularity])
+
+
+def series_frame(start, end, params, resample, agg, station=None):
+    store = get_station_store(station)
+    if resample in GRANULARITIES and resample != 'season' and set(params) <= set(get_aggregates(station).params):
+        return rollup_series(resample, start, end, params, agg, station)
+
+    frame = _local_window(store, start, end, params)
+    if resample in (None, '', 'raw'):
+        return frame.reset_index(drop=True)
+
+    rule = TIME_FREQ.get(resample, resample)
+    return _resample(frame, rule, params, agg)
+
+
+@iot_bp.route('/api/iot/series')
+def iot_series():
+    # Sensor readings between start and end (sensor wall-clock time unless an
+    # offset is given), raw or resampled: resample=raw|hour|day|month or any
+    # pandas offset alias such as 15min; agg picks the bucket statistic.
+    station = request.args.get('station')
+    try:
+        store = get_station_store(station)
+    except UnknownStation as e:
+        return station_error(e)
+    params = request.args.get('params', ','.join(store.parameters)).split(',')
+    resample = request.args.get('resample', 'raw')
+    agg = request.args.get('agg', 'mean')
+    output = request.args.get('format', 'json')
+
+    unknown = unknown_params(store, params)
+    if unknown:
+        return jsonify({'error': f'Unknown parameter(s) {unknown}'}), 400
+    if agg not in SERIES_AGGS or output not in ('json', 'csv'):
+        return jsonify({'error': f"agg must be one of {SERIES_AGGS} and format json or csv"}), 400
+
+    try:
+        frame = series_frame(request.args.get('start'), request.args.get('end'), params, resample, agg, station)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if output == 'csv':
+        return Response(frame.to_csv(index=False, date_format='%Y-%m-%dT%H:%M:%S'), mimetype='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=sensor_series.csv'})
+
+    columns = {'Datetime': frame['Datetime'].dt.strftime('%Y-%m-%dT%H:%M:%S').to_numpy()}
+    columns.update({param: frame[param].to_numpy() for param in params})
+    return figure_response({
+        'station': get_station(station)['id'],
+        'start': request.args.get('start'),
+        'end': request.args.get('end'),
+        'resample': resample,
+        'agg': agg if resample not in (None, '', 'raw') else None,
+        'count': len(frame),
+        'columns': columns
+    })
+
+
+@iot_bp.route('/api/iot/anomalies')
+def iot_anomalies():
+    # Detected sensor events overlapping [start, end], optionally filtered by
+    # parameter and kind (range, spike, rate, stuck, gap)
+    params = [p for p in request.args.get('params', '').split(',') if p]
+    kinds = [k for k in request.args.get('kinds', '').split(',') if k]
+    if [k for k in kinds if k not in EVENT_KINDS]:
+        return jsonify({'error': f'kinds must be among {EVENT_KINDS}'}), 400
+
+    try:
+        index = get_anomaly_index(request.args.get('station'))
+    except UnknownStation as e:
+        return station_error(e)
+    try:
+        events = index.events(request.args.get('start'), request.args.get('end'), params, kinds)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    records = events.copy()
+    for column in ('start', 'end', 'peak_time'):
+        records[column] = records[column].map(lambda ts: ts.isoformat())
+    return figure_response({'count': len(records), 'events': records.to_dict('records')})
+
+
+@iot_bp.route('/api/iot/compare')
+def iot_compare():
+    # The same series at several stations (all of them by default), with the
+    # same resample/agg options as /api/iot/series. Parameters a station does
+    # not measure are left out of its columns.
+    station_ids = [s for s in request.args.get('stations', '').split(',') if s] or list(load_stations())
+    params = [p for p in request.args.get('params', 'TDS,pH').split(',') if p]
+    resample = request.args.get('resample', 'day')
+    agg = request.args.get('agg', 'mean')
+    try:
+        for station in station_ids:
+            get_station(station)
+    except UnknownStation as e:
+        return station_error(e)
+    if agg not in SERIES_AGGS:
+        return jsonify({'error': f"agg must be one of {SERIES_AGGS}"}), 400
+
+    # Worker threads have no request context
+    start, end = request.args.get('start'), request.args.get('end')
+
+    def station_series(station):
+        available = [p for p in params if p in get_station_store(station).parameters]
+        frame = series_frame(start, end, available, resample, agg, station)
+        columns = {'Datetime': frame['Datetime'].dt.strftime('%Y-%m-%dT%H:%M:%S').to_numpy()}
+        columns.update({param: frame[param].to_numpy() for param in available})
+        return {'count': len(frame), 'columns': columns}
+
+    try:
+        series = map_stations(station_series, station_ids)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    return render_template('iot.html', plot_json=plot_json, analysis=analysis_text)
\ No newline at end of file
+    return figure_response({
+        'start': start,
+        'end': end,
+        'resample': resample,
+        'agg': agg if resample not in (None, '', 'raw') else None,
+        'stations': series
+    })
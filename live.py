@@ -0,0 +1,138 @@
+import json
+import queue
+import threading
+from functools import lru_cache
+
+from flask import Blueprint, Response, request
+
+from stations import UnknownStation, get_station, get_station_store
+
+live_bp = Blueprint('live', __name__)
+
+POLL_INTERVAL = 5.0
+HEARTBEAT_INTERVAL = 15.0
+SUBSCRIBER_QUEUE_SIZE = 100
+RESET_EVENT = 'event: reset\ndata: {}\n\n'
+
+
+def readings_event(rows, params):
+    # New readings in the shape Plotly.extendTraces wants: one array per
+    # parameter, timestamps as sensor wall-clock time
+    times = rows['Datetime'].dt.tz_localize(None).dt.strftime('%Y-%m-%d %H:%M:%S')
+    payload = {
+        'x': times.tolist(),
+        'text': rows['Season'].astype(str).tolist(),
+        'series': {p: rows[p].astype(object).where(rows[p].notna(), None).tolist() for p in params},
+        'last_entry_id': int(rows['entry_id'].iloc[-1]),
+    }
+    return f"id: {payload['last_entry_id']}\nevent: readings\ndata: {json.dumps(payload)}\n\n"
+
+
+def _drain(subscriber):
+    while True:
+        try:
+            subscriber.get_nowait()
+        except queue.Empty:
+            return
+
+
+class Broadcaster:
+    # One thread turns sensor store changes into SSE messages and fans them
+    # out to every subscriber's queue. It also polls the store so readings
+    # appended to the CSV by another process are pushed too.
+
+    def __init__(self, store, poll_interval=POLL_INTERVAL):
+        self.store = store
+        self.poll_interval = poll_interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._inbox = queue.Queue()
+        store.refresh()
+        store.subscribe(self._on_change)
+        self._thread = threading.Thread(target=self._run, name='sse-broadcast', daemon=True)
+        self._thread.start()
+
+    def _on_change(self, df, new_rows, reloaded):
+        self._inbox.put(RESET_EVENT if reloaded else readings_event(new_rows, self.store.parameters))
+
+    def _run(self):
+        while True:
+            try:
+                message = self._inbox.get(timeout=self.poll_interval)
+            except queue.Empty:
+                self.store.refresh()
+                continue
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    # A stalled client is told to resync from scratch instead
+                    # of holding back everyone else
+                    self.unsubscribe(subscriber)
+                    _drain(subscriber)
+                    subscriber.put_nowait(RESET_EVENT)
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+
+def get_broadcaster(station=None):
+    return _station_broadcaster(get_station(station)['id'])
+
+
+@lru_cache(maxsize=None)
+def _station_broadcaster(station_id):
+    return Broadcaster(get_station_store(station_id))
+
+
+def _catch_up(store, last_event_id):
+    # Readings a reconnecting client missed, from its Last-Event-ID
+    try:
+        last_id = int(last_event_id)
+    except (TypeError, ValueError):
+        return None
+    df = store.get()
+    missed = df[df['entry_id'] > last_id]
+    return readings_event(missed, store.parameters) if not missed.empty else None
+
+
+@live_bp.route('/api/iot/stream')
+def stream():
+    # Needs a threaded server (the Flask dev server, or gunicorn with gthread
+    # or gevent workers): every client holds a connection open
+    try:
+        broadcaster = get_broadcaster(request.args.get('station'))
+    except UnknownStation as e:
+        return Response(str(e), status=404, mimetype='text/plain')
+    subscriber = broadcaster.subscribe()
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    backlog = _catch_up(broadcaster.store, last_event_id)
+
+    def events():
+        try:
+            yield 'retry: 5000\n\n'
+            if backlog:
+                yield backlog
+            while True:
+                try:
+                    yield subscriber.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,28 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Named thread pools shared within a process. Threads do not survive fork: a
+# process forked after using a pool (a gunicorn worker of a preloading
+# master) starts a new one on first use.
+_pools = {}
+_lock = threading.Lock()
+
+
+def fork_safe_pool(name, workers):
+    pool = _pools.get(name)
+    if pool is None:
+        with _lock:
+            pool = _pools.get(name)
+            if pool is None:
+                pool = _pools[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+    return pool
+
+
+def _after_fork():
+    global _lock
+    _pools.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
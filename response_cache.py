@@ -0,0 +1,106 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+from instrumentation import note
+
+RESPONSE_CACHE_SIZE = int(os.environ.get('NALLAMPATTI_RESPONSE_CACHE_SIZE', 256))
+
+
+def file_signature(*paths):
+    # Cheap data version for a set of source files: changes whenever any of
+    # them is rewritten
+    signature = []
+    for path in paths:
+        stat = os.stat(path)
+        signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class ResponseCache:
+    # Bounded LRU of rendered response bodies keyed by route, parameters and
+    # source-data version
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype):
+        endpoint, version = key[0], key[-1]
+        entry = (body, mimetype, hashlib.sha1(body).hexdigest())
+        with self._lock:
+            # Entries rendered from an older version of the data are dead
+            if self._versions.get(endpoint, version) != version:
+                for stale in [k for k in self._entries if k[0] == endpoint and k[-1] != version]:
+                    del self._entries[stale]
+            self._versions[endpoint] = version
+
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+response_cache = ResponseCache()
+
+
+def request_cache_key(version):
+    # URL variables and query string both select what the view renders
+    args = tuple(sorted((request.view_args or {}).items())) + tuple(sorted(request.args.items(multi=True)))
+    body = request.get_data() if request.method == 'POST' else b''
+    return (request.endpoint, request.method, args, body, version)
+
+
+def _conditional(body, mimetype, etag):
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def cached_response(version):
+    # Cache a view's successful responses; `version` returns the current data
+    # version so that editing a source CSV invalidates its entries. Responses
+    # carry a strong ETag and repeat GETs with If-None-Match get a 304.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request_cache_key(version())
+            entry = response_cache.get(key)
+            note('cache', 'miss' if entry is None else 'hit')
+            if entry is None:
+                response = view(*args, **kwargs)
+                if not isinstance(response, Response) or response.status_code != 200:
+                    return response
+                entry = response_cache.put(key, response.get_data(), response.mimetype)
+            return _conditional(*entry)
+        wrapper.cache_version = version
+        return wrapper
+    return decorator
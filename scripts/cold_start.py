@@ -0,0 +1,57 @@
+# Measures cold start: each run is a fresh interpreter that imports the app
+# and then times the first request to each URL.
+#
+#   python scripts/cold_start.py --runs 5 / /iot /dashboards
+#   NALLAMPATTI_PRELOAD=1 python scripts/cold_start.py
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_URLS = ['/', '/iot', '/dashboards', '/insights/', '/map']
+
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+from app import app
+timings = {'import': time.perf_counter() - started}
+client = app.test_client()
+for url in sys.argv[1:]:
+    t = time.perf_counter()
+    status = client.get(url).status_code
+    timings[url] = time.perf_counter() - t
+    if status != 200:
+        timings[url + ' status'] = status
+timings['modules'] = len(sys.modules)
+print(json.dumps(timings))
+'''
+
+
+def run_once(urls):
+    result = subprocess.run([sys.executable, '-c', CHILD] + urls, cwd=ROOT, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time app import and the first request to each URL in fresh interpreters')
+    parser.add_argument('urls', nargs='*', default=DEFAULT_URLS)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    runs = [run_once(args.urls) for _ in range(args.runs)]
+    print(f'{"step":<24}{"median s":>10}{"min s":>10}{"max s":>10}')
+    for step in ['import'] + args.urls:
+        values = [r[step] for r in runs]
+        print(f'{step:<24}{statistics.median(values):>10.3f}{min(values):>10.3f}{max(values):>10.3f}')
+    print(f'modules loaded: {runs[-1]["modules"]}')
+    failed = {k: v for r in runs for k, v in r.items() if k.endswith(' status')}
+    if failed:
+        print(f'non-200 responses: {failed}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# Splits a station's sensor log into monthly partitions (YYYY-MM.csv, by the
+# sensor's wall-clock time) for a partitioned "source" in stations.json. The
+# lines are copied byte for byte, so values keep their original formatting.
+#
+#   python scripts/partition_sensor_log.py n.csv data/stations/nallampatti-well
+import argparse
+import os
+from io import BytesIO
+
+import pandas as pd
+
+
+def partition(source, target):
+    with open(source, 'rb') as f:
+        header = f.readline()
+        lines = f.read().splitlines(keepends=True)
+    lines = [line if line.endswith(b'\n') else line + b'\r\n' for line in lines if line.strip()]
+
+    # Only the Datetime column is parsed; its text keeps the sensor's offset
+    times = pd.read_csv(BytesIO(header + b''.join(lines)), usecols=['Datetime'])['Datetime']
+    months = times.str.slice(0, 7).to_numpy()
+
+    by_month = {}
+    for line, month in zip(lines, months):
+        by_month.setdefault(month, []).append(line)
+
+    os.makedirs(target, exist_ok=True)
+    written = {}
+    for month, chunk in sorted(by_month.items()):
+        path = os.path.join(target, f'{month}.csv')
+        if os.path.exists(path):
+            raise FileExistsError(f'{path} already exists')
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.writelines(chunk)
+        written[path] = len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Split a sensor log into monthly partitions')
+    parser.add_argument('source', help='sensor log CSV')
+    parser.add_argument('target', help='directory for the YYYY-MM.csv partitions')
+    args = parser.parse_args()
+
+    written = partition(args.source, args.target)
+    for path, count in written.items():
+        print(f'{path}: {count} readings')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Stand-in for the field unit: replays n.csv against /api/iot/ingest as
+# ThingSpeak bulk updates, with the gaps between readings divided by --speed.
+#
+#   python scripts/replay_feeder.py --url http://localhost:6060/api/iot/ingest \
+#       --source n.csv --start-entry 70000 --speed 3600
+import argparse
+import json
+import os
+import time
+import urllib.request
+
+import pandas as pd
+
+FIELDS = {'pH': 'field1', 'TDS': 'field2', 'Depth': 'field3'}
+
+
+def post(url, updates, api_key=None):
+    body = {'updates': updates}
+    if api_key:
+        body['write_api_key'] = api_key
+    req = urllib.request.Request(url, data=json.dumps(body).encode(),
+                                 headers={'Content-Type': 'application/json'}, method='POST')
+    with urllib.request.urlopen(req) as response:
+        return json.loads(response.read())
+
+
+def to_update(row, keep_entry_id):
+    update = {'created_at': row.Datetime.isoformat()}
+    if keep_entry_id:
+        update['entry_id'] = int(row.entry_id)
+    for param, field in FIELDS.items():
+        value = getattr(row, param)
+        update[field] = None if pd.isna(value) else float(value)
+    return update
+
+
+def replay(url, source, start_entry=None, limit=None, speed=60.0, batch=1,
+           api_key=None, keep_entry_id=True):
+    df = pd.read_csv(source, parse_dates=['Datetime']).sort_values('Datetime')
+    if start_entry is not None:
+        df = df[df['entry_id'] >= start_entry]
+    if limit is not None:
+        df = df.head(limit)
+
+    sent = 0
+    updates = []
+    previous = None
+    for row in df.itertuples(index=False):
+        if previous is not None and speed > 0:
+            time.sleep(max((row.Datetime - previous).total_seconds() / speed, 0))
+        previous = row.Datetime
+        updates.append(to_update(row, keep_entry_id))
+        if len(updates) >= batch:
+            result = post(url, updates, api_key)
+            sent += len(updates)
+            updates = []
+            print(f"sent {sent}, accepted {result['accepted']}, last entry {result['last_entry_id']}")
+    if updates:
+        result = post(url, updates, api_key)
+        sent += len(updates)
+        print(f"sent {sent}, accepted {result['accepted']}, last entry {result['last_entry_id']}")
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a sensor log against the ingestion API')
+    parser.add_argument('--url', default='http://localhost:6060/api/iot/ingest')
+    parser.add_argument('--source', default='n.csv')
+    parser.add_argument('--start-entry', type=int)
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--speed', type=float, default=60.0,
+                        help='replay speed-up factor; 0 sends as fast as possible')
+    parser.add_argument('--batch', type=int, default=1, help='readings per request')
+    parser.add_argument('--api-key', default=os.environ.get('NALLAMPATTI_WRITE_API_KEY'),
+                        help='write API key (default: $NALLAMPATTI_WRITE_API_KEY)')
+    parser.add_argument('--new-entry-ids', action='store_true',
+                        help='let the server assign entry_ids instead of replaying the originals')
+    args = parser.parse_args()
+    replay(args.url, args.source, args.start_entry, args.limit, args.speed, args.batch,
+           args.api_key, keep_entry_id=not args.new_entry_ids)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import calendar
+import math
+import threading
+
+import numpy as np
+import pandas as pd
+
+from aggregates import get_aggregates
+from anomalies import get_anomaly_index
+from sensor_store import SEASONS, season_of_months
+from stations import get_station, get_station_store
+
+UNITS = {'TDS': ' mg/L', 'pH': '', 'Depth': ' cm'}
+TREND_ALPHA = 0.05
+MAX_TREND_POINTS = 1000
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def mann_kendall(times, values):
+    # Mann-Kendall test with tie correction and Sen's slope (per unit of
+    # `times`). Returns (S, z, p, slope) or None for too few points.
+    valid = ~np.isnan(values)
+    t, x = times[valid], values[valid]
+    n = len(x)
+    if n < 10:
+        return None
+
+    s = 0
+    slopes = []
+    for i in range(n - 1):
+        dx = x[i + 1:] - x[i]
+        s += int(np.sign(dx).sum())
+        slopes.append(dx / (t[i + 1:] - t[i]))
+    slope = float(np.median(np.concatenate(slopes)))
+
+    _, ties = np.unique(x, return_counts=True)
+    variance = (n * (n - 1) * (2 * n + 5) - np.sum(ties * (ties - 1) * (2 * ties + 5))) / 18
+    z = 0.0 if s == 0 else (s - np.sign(s)) / math.sqrt(variance)
+    p = math.erfc(abs(z) / math.sqrt(2))
+    return s, z, p, slope
+
+
+def _season_months(months):
+    return '-'.join(calendar.month_abbr[m] for m in (months[0], months[-1]))
+
+
+def _daily_means(day_table, param):
+    means = day_table[(param, 'sum')] / day_table[(param, 'count')]
+    if len(means) > MAX_TREND_POINTS:
+        means = means.resample('W').mean()
+    days = (means.index - means.index[0]) / pd.Timedelta(days=1)
+    return np.asarray(days, dtype=float), means.to_numpy(dtype=float), means.index
+
+
+def _yearly_season_means(month_table, param):
+    frame = pd.DataFrame({
+        'Season': season_of_months(month_table.index.month),
+        'Year': month_table.index.year,
+        'sum': month_table[(param, 'sum')].to_numpy(),
+        'count': month_table[(param, 'count')].to_numpy(),
+    })
+    totals = frame.groupby(['Season', 'Year'], observed=True)[['sum', 'count']].sum()
+    return totals['sum'] / totals['count']
+
+
+def build_summary(params, station=None):
+    aggregates = get_aggregates(station)
+    season_table = aggregates.table('season')
+    means = {p: season_table[(p, 'sum')] / season_table[(p, 'count')] for p in params}
+
+    definitions = ', '.join(f'{name} {_season_months(months)}' for name, months in SEASONS)
+    analysis = [f"Seasonal Water Quality Summary ({definitions}):"]
+
+    for season in season_table.index:
+        analysis.append(f"\n{season} Insights:")
+        for param in params:
+            stats = aggregates.stats('season', season, param)
+            analysis.append(f"  {param}: Mean {stats['mean']:.2f} (Range: {stats['min']:.2f} - {stats['max']:.2f}, "
+                            f"median {stats['p50']:.2f}, n={int(stats['count'])})")
+
+    analysis.append("\nKey Observations:")
+    observations = []
+    for param in params:
+        ranked = means[param].dropna().sort_values(ascending=False)
+        if ranked.empty:
+            continue
+        spread = season_table[(param, 'p95')] - season_table[(param, 'p5')]
+        unit = UNITS.get(param, '')
+        observations.append(
+            f"{param} averages highest in {ranked.index[0]} ({ranked.iloc[0]:.2f}{unit}) and lowest in "
+            f"{ranked.index[-1]} ({ranked.iloc[-1]:.2f}{unit}); {spread.idxmax()} shows the widest spread "
+            f"(5th-95th percentile {spread.max():.2f}{unit})."
+        )
+
+    day_table = aggregates.table('day')
+    for param in params:
+        days, values, index = _daily_means(day_table, param)
+        result = mann_kendall(days, values)
+        if result is None:
+            continue
+        _, z, p, slope = result
+        period = f"{index[0]:%b %Y} to {index[-1]:%b %Y}"
+        if p < TREND_ALPHA:
+            direction = 'increasing' if z > 0 else 'decreasing'
+            observations.append(
+                f"{param} shows a statistically significant {direction} trend from {period} "
+                f"(Sen's slope {slope * 365.25:+.3f}{UNITS.get(param, '')} per year, Mann-Kendall p={p:.3g})."
+            )
+        else:
+            observations.append(f"{param} shows no significant monotonic trend from {period} (Mann-Kendall p={p:.2f}).")
+
+    month_table = aggregates.table('month')
+    for param in params:
+        yearly = _yearly_season_means(month_table, param)
+        changes = []
+        for season in yearly.index.get_level_values('Season').unique():
+            by_year = yearly.loc[season]
+            for (y0, v0), (y1, v1) in zip(by_year.items(), list(by_year.items())[1:]):
+                if y1 == y0 + 1 and v0:
+                    changes.append(f"{season} {y0}->{y1} {(v1 - v0) / v0 * 100:+.1f}%")
+        if changes:
+            observations.append(f"Year-over-year change in mean {param}: " + '; '.join(changes) + '.')
+
+    events = get_anomaly_index(station).events(params=params)
+    for param in params:
+        flagged = events[events['param'] == param]
+        if not flagged.empty:
+            counts = flagged['kind'].value_counts()
+            detail = ', '.join(f"{count} {kind}" for kind, count in counts.items())
+            observations.append(f"Anomaly detection flagged {len(flagged)} {param} events ({detail}); "
+                                f"see /api/iot/anomalies for details.")
+
+    analysis.extend(f"{i}. {text}" for i, text in enumerate(observations, start=1))
+    return '\n'.join(analysis)
+
+
+def seasonal_summary(params, station=None):
+    # Summary text for the current version of a station's sensor log, built
+    # once per version and parameter list
+    station = get_station(station)['id']
+    store = get_station_store(station)
+    store.refresh()
+    key = (station, tuple(params))
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == store.version:
+            return cached[1]
+    version = store.version
+    text = build_summary(params, station)
+    with _cache_lock:
+        _cache[key] = (version, text)
+    return text
@@ -0,0 +1,235 @@
+import os
+import re
+import threading
+from io import BytesIO
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from data_cache import load_csv
+from instrumentation import count_rows, phase
+from pools import fork_safe_pool
+
+SENSOR_CSV = os.environ.get('NALLAMPATTI_SENSOR_CSV', 'n.csv')
+META_COLUMNS = ('Datetime', 'entry_id', 'Season')
+# Monthly partitions of a station's log, named by sensor wall-clock month
+PARTITION_NAME = re.compile(r'\d{4}-\d{2}\.csv')
+LOAD_WORKERS = int(os.environ.get('NALLAMPATTI_LOAD_WORKERS', min(8, os.cpu_count() or 1)))
+
+# Season definitions as (name, months). 'monsoon' follows the Tamil Nadu
+# (IMD) seasons; 'quarters' is the old calendar-quarter split.
+SEASON_SCHEMES = {
+    'monsoon': [('Winter', (1, 2)), ('Summer', (3, 4, 5)),
+                ('SW Monsoon', (6, 7, 8, 9)), ('NE Monsoon', (10, 11, 12))],
+    'quarters': [('Winter', (1, 2, 3)), ('Spring', (4, 5, 6)),
+                 ('Summer', (7, 8, 9)), ('Fall', (10, 11, 12))],
+}
+SEASON_SCHEME = os.environ.get('NALLAMPATTI_SEASONS', 'monsoon')
+SEASONS = SEASON_SCHEMES[SEASON_SCHEME]
+SEASON_LABELS = [name for name, _ in SEASONS]
+MONTH_SEASON_CODES = np.empty(12, dtype=np.int8)
+for code, (_, months) in enumerate(SEASONS):
+    MONTH_SEASON_CODES[np.asarray(months) - 1] = code
+
+
+def season_of_months(months):
+    codes = MONTH_SEASON_CODES[np.asarray(months) - 1]
+    return pd.Categorical.from_codes(codes, SEASON_LABELS, ordered=True)
+
+
+def add_season(df):
+    df['Season'] = season_of_months(df['Datetime'].dt.month.to_numpy())
+    return df
+
+
+def to_timestamp(value, tz):
+    # Naive values are wall-clock times at the sensor, which is what Plotly
+    # shows on the axis
+    ts = pd.Timestamp(value)
+    if tz is None:
+        return ts.tz_localize(None) if ts.tzinfo is not None else ts
+    return ts.tz_localize(tz) if ts.tzinfo is None else ts.tz_convert(tz)
+
+
+class SensorStore:
+    # Keeps the sensor log in memory, sorted by Datetime with the Season column
+    # precomputed. The log is one CSV, or a directory of monthly YYYY-MM.csv
+    # partitions. Appended readings are picked up by parsing only the bytes past
+    # the last complete line we have seen in each file, so a change re-reads
+    # just the partitions it touched.
+
+    def __init__(self, path=SENSOR_CSV):
+        self.path = path
+        self.partitioned = os.path.isdir(path)
+        self.version = 0
+        self._df = None
+        self._last_id = None
+        self._columns = None
+        self._offsets = {}
+        self._stat = None
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    @property
+    def columns(self):
+        self.refresh()
+        return self._columns
+
+    @property
+    def parameters(self):
+        return [c for c in self.columns if c not in META_COLUMNS]
+
+    @property
+    def last_entry_id(self):
+        # Highest entry_id seen; readings sent late sort before newer ones
+        return self._last_id
+
+    @property
+    def lock_path(self):
+        # File writers flock so that processes appending to the same log
+        # allocate entry_ids one at a time
+        return os.path.join(self.path, '.lock') if self.partitioned else self.path
+
+    def get(self):
+        self.refresh()
+        return self._df
+
+    def subscribe(self, callback):
+        # callback(df, new_rows, reloaded) runs after every change; new_rows is
+        # the whole frame when it was (re)loaded from scratch
+        self._listeners.append(callback)
+
+    def _notify(self, new_rows, reloaded):
+        for callback in list(self._listeners):
+            callback(self._df, new_rows, reloaded)
+
+    def window(self, start=None, end=None):
+        # Rows with start <= Datetime <= end, located by binary search
+        df = self.get()
+        times = df['Datetime']
+        lo = 0 if start is None else times.searchsorted(to_timestamp(start, times.dt.tz), side='left')
+        hi = len(df) if end is None else times.searchsorted(to_timestamp(end, times.dt.tz), side='right')
+        count_rows('sensor_window', hi - lo)
+        return df.iloc[lo:hi]
+
+    def files(self):
+        if not self.partitioned:
+            return [self.path]
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path)
+                      if PARTITION_NAME.fullmatch(name))
+
+    def partition_file(self, timestamp):
+        # File a reading taken at `timestamp` (sensor time) is appended to
+        if not self.partitioned:
+            return self.path
+        return os.path.join(self.path, f'{timestamp:%Y-%m}.csv')
+
+    def _signature(self):
+        signature = []
+        for path in self.files():
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def refresh(self):
+        if self._stat == self._signature():
+            return False
+
+        with self._lock:
+            signature = self._signature()
+            if self._stat == signature:
+                return False
+
+            # A shrunk or missing file means the log was rewritten, not appended to
+            sizes = {path: size for path, _, size in signature}
+            with phase('load'):
+                if self._df is None or any(sizes.get(path, -1) < offset for path, offset in self._offsets.items()):
+                    self._load_full(list(sizes))
+                else:
+                    self._load_tail(list(sizes))
+            self._stat = signature
+            return True
+
+    def _read_complete_lines(self, path, start):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        return data[:end]
+
+    def _parse_tail(self, data, header):
+        # A partition we have not read before starts with its header line
+        if header:
+            return pd.read_csv(BytesIO(data), parse_dates=['Datetime']).reindex(columns=self._columns)
+        return pd.read_csv(BytesIO(data), header=None, names=self._columns,
+                           parse_dates=['Datetime'])
+
+    def _load_file(self, path):
+        data = self._read_complete_lines(path, 0)
+        return load_csv(path, data=data, mmap=True, parse_dates=['Datetime']), len(data)
+
+    def _load_full(self, files):
+        if not files:
+            raise FileNotFoundError(f'No sensor log partitions in {self.path}')
+        # Datetime and float columns are memory-mapped from the columnar cache
+        # (partitions are loaded in parallel and then concatenated); the log is
+        # normally already in order, so avoid copying it by sorting
+        loaded = list(fork_safe_pool('partition-load', LOAD_WORKERS).map(self._load_file, files))
+        frames = [df for df, _ in loaded if len(df)] or [loaded[0][0]]
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        self._columns = list(df.columns)
+        count_rows('sensor_log', len(df))
+        if not df['Datetime'].is_monotonic_increasing:
+            df = df.sort_values('Datetime', kind='stable').reset_index(drop=True)
+        self._df = add_season(df)
+        self._last_id = int(df['entry_id'].max()) if len(df) else None
+        self._offsets = {path: size for path, (_, size) in zip(files, loaded)}
+        self.version += 1
+        self._notify(self._df, reloaded=True)
+
+    def _load_tail(self, files):
+        parts = []
+        for path in files:
+            offset = self._offsets.get(path, 0)
+            data = self._read_complete_lines(path, offset)
+            self._offsets[path] = offset + len(data)
+            if data.strip():
+                parts.append(self._parse_tail(data, header=offset == 0))
+        parts = [part for part in parts if len(part)]
+        count_rows('sensor_log', sum(len(part) for part in parts))
+        if parts:
+            self._append_rows(pd.concat(parts, ignore_index=True))
+
+    def _append_rows(self, new_rows):
+        # Rows at or below the last known entry_id are already in memory
+        last_id = self.last_entry_id
+        if last_id is not None:
+            new_rows = new_rows[new_rows['entry_id'] > last_id]
+        if new_rows.empty:
+            return new_rows
+
+        new_rows = add_season(new_rows.sort_values('Datetime', kind='stable'))
+        df = pd.concat([self._df, new_rows], ignore_index=True)
+        if not new_rows['Datetime'].iloc[0] >= self._df['Datetime'].iloc[-1]:
+            df = df.sort_values('Datetime', kind='stable').reset_index(drop=True)
+        self._df = df
+        self._last_id = max(self._last_id or 0, int(new_rows['entry_id'].max()))
+        self.version += 1
+        self._notify(new_rows, reloaded=False)
+        return new_rows
+
+    def append(self, build_rows):
+        # Add readings that have not reached the CSV yet. build_rows(last_id)
+        # returns the frame to append, so entry_ids can be assigned under the
+        # store lock.
+        self.refresh()
+        with self._lock:
+            new_rows = build_rows(self.last_entry_id)
+            new_rows['Datetime'] = new_rows['Datetime'].dt.tz_convert(self._df['Datetime'].dt.tz)
+            return self._append_rows(new_rows.reindex(columns=self._columns))
+
+
+@lru_cache(maxsize=None)
+def get_sensor_store(path=SENSOR_CSV):
+    return SensorStore(path)
@@ -0,0 +1,75 @@
+import json
+import os
+from functools import lru_cache
+
+from pools import fork_safe_pool
+from sensor_store import LOAD_WORKERS, SENSOR_CSV, get_sensor_store
+
+# Monitoring stations, read from a JSON list. Each entry has an 'id', a display
+# 'name' and a 'source': the station's sensor log, either one CSV or a
+# directory of monthly YYYY-MM.csv partitions (see
+# scripts/partition_sensor_log.py). 'parameters' are the series charted on
+# /iot, 'fields' maps ThingSpeak fields to parameters when a unit reports
+# them differently from the first one and 'ward' is the map ward the station
+# sits in, if known. Without a registry file the single well logged to
+# NALLAMPATTI_SENSOR_CSV is the only station.
+STATIONS_FILE = os.environ.get('NALLAMPATTI_STATIONS', 'stations.json')
+DEFAULT_PARAMETERS = ['TDS', 'pH']
+
+
+class UnknownStation(LookupError):
+    pass
+
+
+@lru_cache(maxsize=None)
+def load_stations(path=STATIONS_FILE):
+    if os.path.exists(path):
+        with open(path) as f:
+            entries = json.load(f)
+    else:
+        entries = [{'id': 'nallampatti-well', 'name': 'Nallampatti well'}]
+
+    stations = {}
+    for entry in entries:
+        station = {'source': SENSOR_CSV, 'parameters': DEFAULT_PARAMETERS, 'fields': None,
+                   'ward': None, 'description': '', **entry}
+        station.setdefault('name', station['id'])
+        stations[station['id']] = station
+    return stations
+
+
+def station_ids():
+    return list(load_stations())
+
+
+def get_station(station=None):
+    # The registry entry for a station id; the first station by default
+    stations = load_stations()
+    if not station:
+        return next(iter(stations.values()))
+    try:
+        return stations[station]
+    except KeyError:
+        raise UnknownStation(f"Unknown station '{station}'") from None
+
+
+def get_station_store(station=None):
+    return get_sensor_store(get_station(station)['source'])
+
+
+def map_stations(func, stations):
+    # {station: func(station)}, with the stations loaded and aggregated in
+    # parallel so that a page over several stations costs about as much as
+    # the slowest one
+    return dict(zip(stations, fork_safe_pool('station', LOAD_WORKERS).map(func, stations)))
+
+
+def _refreshed_version(station):
+    store = get_station_store(station)
+    store.refresh()
+    return store.version
+
+
+def station_versions(stations):
+    # Data version of each station's log, refreshing them in parallel
+    return tuple(map_stations(_refreshed_version, stations).values())
@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session', autouse=True)
+def repository_cwd():
+    # The app reads its data relative to the working directory
+    previous = os.getcwd()
+    os.chdir(ROOT)
+    yield
+    os.chdir(previous)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    return app
+
+
+@pytest.fixture
+def sensor_log(tmp_path):
+    # The last 2000 readings of n.csv in a fresh file
+    with open(os.path.join(ROOT, 'n.csv'), 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    path = tmp_path / 'n.csv'
+    path.write_bytes(lines[0] + b''.join(lines[-2000:]))
+    return str(path)
@@ -0,0 +1,44 @@
+# The anomaly index kept up to date chunk by chunk must equal one full pass
+import os
+
+import pandas as pd
+import pytest
+
+from anomalies import AnomalyIndex, detect
+from sensor_store import SensorStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Readings appended after the first load, in order; single readings rarely
+# raise an event
+CHUNKS = [1, 1, 2, 500, 3, 1500, 1, 4000]
+
+
+def read_lines():
+    with open(os.path.join(ROOT, 'n.csv'), 'rb') as f:
+        return f.read().splitlines(keepends=True)
+
+
+@pytest.mark.filterwarnings('error::FutureWarning')
+def test_incremental_matches_full_pass(tmp_path):
+    header, *rows = read_lines()
+    initial = len(rows) - sum(CHUNKS)
+    path = tmp_path / 'n.csv'
+    path.write_bytes(header + b''.join(rows[:initial]))
+
+    store = SensorStore(str(path))
+    index = AnomalyIndex(store)
+    quiet = 0
+    offset = initial
+    for size in CHUNKS:
+        before = len(index.events())
+        with open(path, 'ab') as f:
+            f.write(b''.join(rows[offset:offset + size]))
+        offset += size
+        assert store.refresh()
+        quiet += len(index.events()) == before
+
+    # Some appends found nothing new: the empty-frame path ran
+    assert quiet
+    assert len(store.get()) == len(rows)
+    expected = detect(store.get(), index.params)
+    pd.testing.assert_frame_equal(index.events().reset_index(drop=True), expected, check_dtype=False)
@@ -0,0 +1,189 @@
+# Delivery of queued contact messages against a local SMTP server (aiosmtpd)
+# and a local webhook
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from contact import ContactQueue, DeliveryError, SMTPSink, WebhookSink, validate
+
+aiosmtpd_controller = pytest.importorskip('aiosmtpd.controller')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Mailbox:
+    # aiosmtpd handler: recipients named temp-... get a 451, reject-... a
+    # 550, and everyone else's mail is kept
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('temp-'):
+            return '451 4.3.0 Try again later'
+        if address.startswith('reject-'):
+            return '550 5.1.1 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope.content.decode())
+        return '250 Message accepted'
+
+
+@pytest.fixture
+def smtp_server():
+    mailbox = Mailbox()
+    controller = aiosmtpd_controller.Controller(mailbox, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield mailbox, controller.port
+    controller.stop()
+
+
+def smtp_queue(tmp_path, port, recipient, max_attempts=8):
+    sink = SMTPSink('127.0.0.1', port, starttls=False, sender='site@nallampatti.test',
+                    recipient=recipient, timeout=5)
+    return ContactQueue(str(tmp_path / 'contact.sqlite3'), sink, max_attempts=max_attempts)
+
+
+def status(queue, message_id):
+    return dict(queue._connect().execute('SELECT * FROM messages WHERE id = ?', (message_id,)).fetchone())
+
+
+def make_due(queue, message_id):
+    queue._connect().execute('UPDATE messages SET next_attempt_at = 0 WHERE id = ?', (message_id,))
+
+
+def test_smtp_delivers(tmp_path, smtp_server):
+    mailbox, port = smtp_server
+    queue = smtp_queue(tmp_path, port, 'office@nallampatti.test')
+    message_id = queue.enqueue('Bob, "the builder"', 'bob@example.com', 'The well in ward 3 is dry.')
+    # Only start() runs the delivery thread; these tests deliver by hand
+    assert queue._thread is None
+
+    assert queue.deliver_due() == 1
+    assert status(queue, message_id)['status'] == 'sent'
+    assert len(mailbox.messages) == 1
+    assert 'Reply-To: "Bob, \\"the builder\\"" <bob@example.com>' in mailbox.messages[0]
+    assert 'The well in ward 3 is dry.' in mailbox.messages[0]
+    assert queue.deliver_due() == 0
+
+
+def test_smtp_4xx_is_retried(tmp_path, smtp_server):
+    mailbox, port = smtp_server
+    queue = smtp_queue(tmp_path, port, 'temp-office@nallampatti.test', max_attempts=2)
+    message_id = queue.enqueue('Asha', 'asha@example.com', 'Hello')
+
+    assert queue.deliver_due() == 0
+    row = status(queue, message_id)
+    assert (row['status'], row['attempts']) == ('pending', 1)
+    assert '451' in row['last_error']
+    assert row['next_attempt_at'] > time.time()
+    # Not due again until the backoff has passed
+    assert queue.deliver_due() == 0
+    assert status(queue, message_id)['attempts'] == 1
+
+    # The last allowed attempt gives up
+    make_due(queue, message_id)
+    queue.deliver_due()
+    row = status(queue, message_id)
+    assert (row['status'], row['attempts']) == ('failed', 2)
+    assert not mailbox.messages
+
+
+def test_smtp_5xx_fails(tmp_path, smtp_server):
+    mailbox, port = smtp_server
+    queue = smtp_queue(tmp_path, port, 'reject-office@nallampatti.test')
+    message_id = queue.enqueue('Asha', 'asha@example.com', 'Hello')
+
+    assert queue.deliver_due() == 0
+    row = status(queue, message_id)
+    assert (row['status'], row['attempts']) == ('failed', 1)
+    assert '550' in row['last_error']
+
+
+def test_smtp_unreachable_is_retried(tmp_path):
+    queue = smtp_queue(tmp_path, free_port(), 'office@nallampatti.test')
+    message_id = queue.enqueue('Asha', 'asha@example.com', 'Hello')
+
+    assert queue.deliver_due() == 0
+    assert status(queue, message_id)['status'] == 'pending'
+
+
+def test_invalid_headers_fail_permanently(tmp_path, smtp_server):
+    _, port = smtp_server
+    queue = smtp_queue(tmp_path, port, 'office@nallampatti.test')
+    message_id = queue.enqueue('Asha\r\nBcc: everyone@example.com', 'asha@example.com', 'Hello')
+
+    queue.deliver_due()
+    assert status(queue, message_id)['status'] == 'failed'
+    with pytest.raises(DeliveryError) as error:
+        queue.sink.send(status(queue, message_id))
+    assert error.value.permanent
+
+
+def test_validate_rejects_header_injection():
+    form = {'name': 'Asha\nBcc: everyone@example.com', 'email': 'asha@example.com', 'message': 'Hi\nthere'}
+    assert validate(form)[0] is None
+    assert validate(dict(form, name='Asha', email='asha@'))[0] is None
+    assert validate(dict(form, name='Asha'))[0] == {'name': 'Asha', 'email': 'asha@example.com',
+                                                    'message': 'Hi\nthere'}
+
+
+def test_expired_lease_is_not_settled(tmp_path, smtp_server):
+    # A send that outlives its lease must not overwrite the outcome of the
+    # process that claimed the message after it
+    _, port = smtp_server
+    queue = smtp_queue(tmp_path, port, 'office@nallampatti.test')
+    message_id = queue.enqueue('Asha', 'asha@example.com', 'Hello')
+    first = queue.claim()
+    queue._connect().execute('UPDATE messages SET lease_until = 0 WHERE id = ?', (message_id,))
+    second = queue.claim()
+    assert second['id'] == message_id and second['attempts'] == 2
+
+    assert not queue._settle(first, "status = 'sent', sent_at = ?", (time.time(),))
+    assert queue._settle(second, "status = 'sent', sent_at = ?", (time.time(),))
+    assert status(queue, message_id)['attempts'] == 2
+
+
+class Webhook(BaseHTTPRequestHandler):
+    # Answers with the status code in the path, e.g. POST /503
+    received = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        Webhook.received.append(json.loads(body))
+        self.send_response(int(self.path.strip('/')))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def webhook_url():
+    server = HTTPServer(('127.0.0.1', 0), Webhook)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    Webhook.received = []
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('code, outcome', [(204, 'sent'), (503, 'pending'), (429, 'pending'), (400, 'failed')])
+def test_webhook(tmp_path, webhook_url, code, outcome):
+    queue = ContactQueue(str(tmp_path / 'contact.sqlite3'), WebhookSink(f'{webhook_url}/{code}', timeout=5))
+    message_id = queue.enqueue('Asha', 'asha@example.com', 'Hello')
+
+    assert queue.deliver_due() == (1 if outcome == 'sent' else 0)
+    assert status(queue, message_id)['status'] == outcome
+    assert Webhook.received[0]['id'] == message_id
+    assert Webhook.received[0]['message'] == 'Hello'
@@ -0,0 +1,100 @@
+# The columnar cache: round trips, invalidation by checksum, and frames it
+# must not cache
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_cache
+from data_cache import cached_frame, load_csv
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    path = tmp_path / 'columnar'
+    monkeypatch.setattr(data_cache, 'CACHE_DIR', str(path))
+    return path
+
+
+def cached_only(name, key, **kwargs):
+    # Read back from the cache; building again would be a miss
+    def build():
+        raise AssertionError('expected a cache hit')
+    return cached_frame(name, key, build, **kwargs)
+
+
+def sample_frame():
+    return pd.DataFrame({
+        'int': np.array([1, -2, 3], dtype=np.int64),
+        'small': np.array([1, 2, 3], dtype=np.int8),
+        'float': [1.5, np.nan, -0.25],
+        'bool': [True, False, True],
+        'text': ['a', None, 'c'],
+        'naive': pd.to_datetime(['2023-01-01 10:00', '2023-06-01 00:00', None]),
+        'offset': pd.to_datetime(['2023-01-01T10:00:00+05:30', '2023-06-01T00:00:00+05:30',
+                                  '2024-02-29T23:59:59+05:30']),
+        'zone': pd.to_datetime(['2023-01-01', '2023-07-01', '2023-12-31']).tz_localize('Europe/Berlin'),
+    })
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_round_trip(mmap):
+    df = sample_frame()
+    built = cached_frame('sample', b'v1', lambda: df, mmap=mmap)
+    again = cached_only('sample', b'v1', mmap=mmap)
+    for result in (built, again):
+        assert list(result.columns) == list(df.columns)
+        expected = df.copy()
+        # Missing text comes back as NaN
+        expected['text'] = ['a', np.nan, 'c']
+        pd.testing.assert_frame_equal(result, expected)
+        assert str(result['offset'].dt.tz) == 'UTC+05:30'
+        assert str(result['zone'].dt.tz) == 'Europe/Berlin'
+
+
+def test_text_as_category():
+    df = pd.DataFrame({'ward': ['1', '2', '1', None]})
+    cached_frame('wards', b'v1', lambda: df)
+    result = cached_only('wards', b'v1', as_category=True)
+    assert isinstance(result['ward'].dtype, pd.CategoricalDtype)
+    assert result['ward'].tolist()[:3] == ['1', '2', '1'] and pd.isna(result['ward'].iloc[3])
+    assert cached_only('wards', b'v1')['ward'].dtype == object
+
+
+def test_new_checksum_rebuilds_and_drops_the_old_copy(tmp_path, cache_dir):
+    path = tmp_path / 'readings.csv'
+    path.write_text('a,b\n1,x\n2,y\n')
+    assert load_csv(str(path))['a'].tolist() == [1, 2]
+    assert len(os.listdir(cache_dir)) == 1
+
+    # Same size, new contents: the checksum, not the mtime, tells them apart
+    path.write_text('a,b\n3,x\n4,z\n')
+    result = load_csv(str(path))
+    assert result['a'].tolist() == [3, 4]
+    assert result['b'].tolist() == ['x', 'z']
+    assert len(os.listdir(cache_dir)) == 1
+
+    # read_csv options are part of the key
+    assert load_csv(str(path), usecols=['b']).columns.tolist() == ['b']
+
+
+def test_unreadable_entry_is_rebuilt(cache_dir):
+    cached_frame('sample', b'v1', lambda: pd.DataFrame({'a': [1]}))
+    (entry,) = os.listdir(cache_dir)
+    with open(os.path.join(cache_dir, entry, 'manifest.json'), 'w') as f:
+        f.write('{"format": 0, "columns": []}')
+    assert cached_frame('sample', b'v1', lambda: pd.DataFrame({'a': [2]}))['a'].tolist() == [2]
+
+
+@pytest.mark.parametrize('values', [
+    [1, 'x', None],
+    [True, 'yes', 'no'],
+    ['a', 2.5, 'b'],
+    pd.Categorical([1, 2, 1]),
+])
+def test_mixed_text_columns_are_not_cached(cache_dir, values):
+    df = pd.DataFrame({'mixed': values, 'ok': ['p', 'q', 'r']})
+    result = cached_frame('mixed', b'v1', lambda: df)
+    assert result is df
+    assert not os.path.isdir(cache_dir) or not os.listdir(cache_dir)
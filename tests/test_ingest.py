@@ -0,0 +1,173 @@
+# The ingestion API on a station logging to a temporary copy of the sensor
+# log, fed by the test client and by scripts/replay_feeder.py
+import importlib.util
+import os
+import threading
+
+import pandas as pd
+import pytest
+from werkzeug.serving import make_server
+
+import ingest
+import iot
+import stations
+from ingest import SensorWriter
+from sensor_store import SensorStore
+
+KEY = 'test-write-key'
+
+
+def load_replay_feeder():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts', 'replay_feeder.py')
+    spec = importlib.util.spec_from_file_location('replay_feeder', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+replay_feeder = load_replay_feeder()
+
+
+@pytest.fixture
+def station(monkeypatch, tmp_path, sensor_log):
+    # A registry of one station per test, so the per-station caches
+    # (writer, aggregates, broadcaster) start empty
+    station_id = f'test-{tmp_path.name}'
+    registry = {station_id: {'id': station_id, 'name': 'Test well', 'source': sensor_log,
+                             'parameters': ['TDS', 'pH'], 'fields': None, 'ward': None, 'description': ''}}
+    monkeypatch.setattr(stations, 'load_stations', lambda path=None: registry)
+    monkeypatch.setattr(iot, 'load_stations', lambda path=None: registry)
+    monkeypatch.setattr(ingest, 'WRITE_API_KEY', KEY)
+    return station_id
+
+
+def post(client, station, payload, key=KEY):
+    return client.post(f'/api/iot/ingest?station={station}', json=payload,
+                       headers={'X-THINGSPEAKAPIKEY': key} if key else {})
+
+
+def reading(minutes=0, **fields):
+    created_at = pd.Timestamp('2024-03-01T10:00:00+05:30') + pd.Timedelta(minutes=minutes)
+    return {'created_at': created_at.isoformat(), 'field1': 7.1, 'field2': 410.5, 'field3': 30.0, **fields}
+
+
+def log_rows(path):
+    return pd.read_csv(path)
+
+
+def test_writes_refused_without_a_key(app, station, monkeypatch):
+    monkeypatch.setattr(ingest, 'WRITE_API_KEY', None)
+    response = post(app.test_client(), station, reading(), key=KEY)
+    assert response.status_code == 403
+
+
+def test_wrong_key_is_unauthorized(app, station, sensor_log):
+    client = app.test_client()
+    before = len(log_rows(sensor_log))
+    assert post(client, station, reading(), key='wrong').status_code == 401
+    assert post(client, station, reading(), key=None).status_code == 401
+    assert len(log_rows(sensor_log)) == before
+
+
+def test_single_reading_is_appended(app, station, sensor_log):
+    last_id = int(log_rows(sensor_log)['entry_id'].iloc[-1])
+    response = post(app.test_client(), station, reading())
+    assert response.status_code == 200
+    assert response.get_json() == {'received': 1, 'accepted': 1, 'station': station,
+                                   'last_entry_id': last_id + 1}
+    row = log_rows(sensor_log).iloc[-1]
+    assert (row['entry_id'], row['pH'], row['TDS'], row['Depth']) == (last_id + 1, 7.1, 410.5, 30.0)
+    assert row['Datetime'] == '2024-03-01T10:00:00+05:30'
+
+
+@pytest.mark.parametrize('payload, index', [
+    ({'field1': 7.0}, 0),
+    ({'created_at': 'yesterday-ish', 'field1': 7.0}, 0),
+    ({'created_at': '2024-03-01T10:00:00+05:30'}, 0),
+    ({'created_at': '2024-03-01T10:00:00+05:30', 'field1': 'acidic'}, 0),
+    ({'updates': []}, None),
+    ({'updates': [reading(0), reading(1), reading(2, field2='high')]}, 2),
+    ({'updates': [reading(0), 'not a reading']}, 1),
+    ({'feeds': [reading(0), reading(1, field3=float('inf'))]}, 1),
+    ({'updates': [reading(i) for i in range(ingest.MAX_BATCH + 1)]}, None),
+])
+def test_invalid_payloads_are_rejected(app, station, sensor_log, payload, index):
+    before = len(log_rows(sensor_log))
+    response = post(app.test_client(), station, payload)
+    assert response.status_code == 400
+    assert response.get_json()['index'] == index
+    # Nothing of a rejected batch is written
+    assert len(log_rows(sensor_log)) == before
+
+
+def test_batch_and_named_fields(app, station, sensor_log):
+    updates = [reading(0), {'created_at': reading(1)['created_at'], 'pH': 6.9, 'TDS': 400}]
+    response = post(app.test_client(), station, {'updates': updates})
+    assert response.get_json()['accepted'] == 2
+    rows = log_rows(sensor_log).tail(2)
+    assert rows['pH'].tolist() == [7.1, 6.9]
+    assert pd.isna(rows['Depth'].iloc[1])
+
+
+def test_entry_ids_stay_unique_across_processes(sensor_log):
+    # Two stores and writers on one log stand in for two gunicorn workers:
+    # each must number from the log, not from its own last id
+    first, second = SensorStore(sensor_log), SensorStore(sensor_log)
+    writers = [SensorWriter(first), SensorWriter(second)]
+    tz = first.get()['Datetime'].dt.tz
+    second.get()
+    for i in range(20):
+        record = {'Datetime': pd.Timestamp('2024-03-01', tz=tz) + pd.Timedelta(minutes=i),
+                  'pH': 7.0, 'TDS': 400.0, 'Depth': 30.0}
+        writers[i % 2].write([record])
+
+    ids = log_rows(sensor_log)['entry_id']
+    assert ids.is_unique and ids.is_monotonic_increasing
+    for store in (first, second):
+        store.refresh()
+        assert len(store.get()) == len(ids)
+        assert store.last_entry_id == ids.iloc[-1]
+
+
+def test_iot_and_stream_see_new_readings(app, station):
+    client = app.test_client()
+    store = stations.get_station_store(station)
+    last_id = store.last_entry_id if store.last_entry_id is not None else int(store.get()['entry_id'].max())
+
+    stream = client.get(f'/api/iot/stream?station={station}', buffered=False)
+    chunks = iter(stream.response)
+    assert next(chunks).startswith(b'retry:')
+
+    assert post(client, station, reading()).status_code == 200
+    event = next(chunks).decode()
+    assert event.startswith(f'id: {last_id + 1}\nevent: readings')
+    stream.close()
+
+    page = client.get(f'/iot?station={station}').get_data(as_text=True)
+    assert f'last_event_id={last_id + 1}' in page
+    series = client.get(f'/api/iot/series?station={station}&start=2024-03-01T09:59:00&params=pH').get_json()
+    assert series['count'] == 1 and series['columns']['pH'] == [7.1]
+
+
+def test_replay_feeder(app, station, sensor_log):
+    # scripts/replay_feeder.py against a real server, with server-side ids
+    source = os.path.join(os.path.dirname(sensor_log), 'replay.csv')
+    replay = log_rows(sensor_log).tail(30).copy()
+    replay['Datetime'] = (pd.to_datetime(replay['Datetime']) + pd.Timedelta(days=30)).map(pd.Timestamp.isoformat)
+    replay.to_csv(source, index=False)
+    last_id = int(log_rows(sensor_log)['entry_id'].iloc[-1])
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f'http://127.0.0.1:{server.server_port}/api/iot/ingest?station={station}'
+        sent = replay_feeder.replay(url, source, speed=0, batch=8, api_key=KEY, keep_entry_id=False)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert sent == 30
+    rows = log_rows(sensor_log).tail(30)
+    assert rows['entry_id'].tolist() == list(range(last_id + 1, last_id + 31))
+    assert rows['TDS'].tolist() == replay['TDS'].tolist()
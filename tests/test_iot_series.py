@@ -0,0 +1,116 @@
+# /api/iot/series: window bounds, rollup buckets clipped to the window, and
+# CSV and JSON output of the same frame
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import TIME_FREQ
+from stations import get_station_store
+
+PARAMS = ['pH', 'TDS', 'Depth']
+
+
+def series(client, **args):
+    response = client.get('/api/iot/series', query_string=args)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response
+
+
+def frame(client, **args):
+    body = series(client, **args).get_json()
+    df = pd.DataFrame(body['columns'])
+    df['Datetime'] = pd.to_datetime(df['Datetime'])
+    return df
+
+
+def clipped_resample(start, end, rule, agg):
+    # What any resample rule returns: the rows in [start, end], bucketed
+    df = get_station_store().window(start, end)[['Datetime'] + PARAMS].copy()
+    df['Datetime'] = df['Datetime'].dt.tz_localize(None)
+    return df.set_index('Datetime').resample(rule)[PARAMS].agg(agg).dropna(how='all').reset_index()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def test_window_bounds(client):
+    df = get_station_store().get()
+    first = df['Datetime'].iloc[0].tz_localize(None)
+    last = df['Datetime'].iloc[-1].tz_localize(None)
+
+    everything = series(client, params='pH').get_json()
+    assert everything['count'] == len(df)
+    # Bounds are inclusive
+    exact = series(client, params='pH', start=first.isoformat(), end=first.isoformat()).get_json()
+    assert exact['count'] == 1
+    assert series(client, params='pH', start='2023-06-02', end='2023-06-01').get_json()['count'] == 0
+    assert series(client, params='pH', end='1999-01-01').get_json()['count'] == 0
+    assert series(client, params='pH', start='2099-01-01').get_json()['count'] == 0
+    assert series(client, params='pH', start='1999-01-01', end='2099-01-01').get_json()['count'] == len(df)
+    # An explicit offset is converted to sensor time
+    shifted = series(client, params='pH', start=(last - pd.Timedelta(hours=1)).isoformat() + 'Z').get_json()
+    assert shifted['count'] == 0
+
+
+def test_bad_arguments(client):
+    assert client.get('/api/iot/series?start=not-a-date').status_code == 400
+    assert client.get('/api/iot/series?params=Lead').status_code == 400
+    assert client.get('/api/iot/series?agg=mode').status_code == 400
+    assert client.get('/api/iot/series?format=xml').status_code == 400
+
+
+@pytest.mark.parametrize('start, end', [
+    ('2023-06-01', '2023-06-02'),
+    ('2023-06-01T05:30:00', '2023-08-15T13:10:00'),
+    ('2023-05-31T23:59:59', '2023-07-01T00:00:00'),
+    ('2023-06-01T00:00:00', '2023-06-30T23:59:59'),
+    (None, '2023-03-10T10:00:00'),
+    ('2023-11-20T08:15:00', None),
+])
+@pytest.mark.parametrize('resample', ['hour', 'day', 'month'])
+@pytest.mark.parametrize('agg', ['mean', 'min', 'max', 'median'])
+def test_rollups_are_clipped_to_the_window(client, start, end, resample, agg):
+    args = {k: v for k, v in {'start': start, 'end': end}.items() if v is not None}
+    got = frame(client, resample=resample, agg=agg, **args).dropna(how='all', subset=PARAMS)
+    expected = clipped_resample(start, end, TIME_FREQ[resample], agg)
+    assert got['Datetime'].tolist() == expected['Datetime'].tolist()
+    np.testing.assert_allclose(got[PARAMS].to_numpy(float), expected[PARAMS].to_numpy(float), equal_nan=True)
+
+
+def test_month_rollup_of_one_day_is_that_day(client):
+    day = frame(client, start='2023-06-01', end='2023-06-02', resample='month')
+    assert len(day) == 1
+    raw = frame(client, start='2023-06-01', end='2023-06-02')
+    assert day['pH'].iloc[0] == pytest.approx(raw['pH'].mean())
+    month = frame(client, start='2023-06-01', end='2023-06-30T23:59:59', resample='month')
+    assert month['pH'].iloc[0] != pytest.approx(day['pH'].iloc[0])
+
+
+def test_count_and_sum_add_up_across_edges(client):
+    args = {'start': '2023-06-01T05:30:00', 'end': '2023-08-15T13:10:00'}
+    raw = frame(client, **args)
+    counts = frame(client, resample='month', agg='count', **args)
+    sums = frame(client, resample='day', agg='sum', **args)
+    assert counts['TDS'].sum() == raw['TDS'].notna().sum()
+    assert sums['TDS'].sum() == pytest.approx(raw['TDS'].sum())
+
+
+@pytest.mark.parametrize('resample', ['raw', 'day', '6h'])
+def test_csv_matches_json(client, resample):
+    args = {'start': '2023-06-01', 'end': '2023-06-10', 'resample': resample, 'params': 'pH,TDS'}
+    body = series(client, **args).get_json()
+    response = series(client, format='csv', **args)
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+
+    csv = pd.read_csv(io.StringIO(response.get_data(as_text=True)))
+    assert list(csv.columns) == ['Datetime', 'pH', 'TDS']
+    assert len(csv) == body['count']
+    assert csv['Datetime'].tolist() == body['columns']['Datetime']
+    for param in ('pH', 'TDS'):
+        np.testing.assert_allclose(csv[param].to_numpy(float), np.array(body['columns'][param], dtype=float),
+                                   equal_nan=True)
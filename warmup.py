@@ -0,0 +1,107 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from flask import Blueprint, current_app, jsonify, request
+
+from datasets import dataset_stats
+from response_cache import request_cache_key, response_cache
+
+# Opt-in: build every ward/category chart variant in a process pool at
+# startup so the first visitor to each view hits the response cache. The
+# cache and the progress below are per process: a preloading gunicorn master
+# warms up before it forks, so every worker starts with both.
+WARMUP_ENABLED = os.environ.get('NALLAMPATTI_WARMUP') == '1'
+WARMUP_WORKERS = int(os.environ.get('NALLAMPATTI_WARMUP_WORKERS', min(4, os.cpu_count() or 1)))
+
+warmup_bp = Blueprint('warmup', __name__)
+
+_state = {'enabled': False, 'total': 0, 'done': 0, 'failed': 0, 'finished': False}
+_state_lock = threading.Lock()
+_in_worker = False
+
+
+def warmup_requests():
+    # (method, path, json body) for every cacheable dashboard view
+    from dashboard import load_data
+    from insights import household_options, general_options
+
+    _, household_df, _ = load_data()
+    requests = [('GET', '/infrastructure_charts?ward=All', None)]
+    requests += [('GET', f'/infrastructure_charts?ward={ward}', None)
+                 for ward in sorted(household_df['Ward'].unique())]
+    requests.append(('GET', '/agriculture_chart', None))
+    requests += [('POST', '/insights/update_household_chart', {'selected_category': option['value']})
+                 for option in household_options]
+    requests += [('POST', '/insights/update_general_chart', {'selected_column': option['value']})
+                 for option in general_options()]
+    return requests
+
+
+def _init_worker():
+    global _in_worker
+    _in_worker = True
+
+
+def _render(method, path, payload):
+    from app import app
+    response = app.test_client().open(path, method=method, json=payload)
+    return response.status_code, response.get_data(), response.mimetype
+
+
+def _cache_key(app, method, path, payload):
+    with app.test_request_context(path, method=method, json=payload):
+        view = app.view_functions[request.endpoint]
+        return request_cache_key(view.cache_version())
+
+
+def _run(app):
+    try:
+        jobs = warmup_requests()
+        with _state_lock:
+            _state['total'] = len(jobs)
+
+        with ProcessPoolExecutor(max_workers=WARMUP_WORKERS, initializer=_init_worker) as pool:
+            futures = {pool.submit(_render, *job): _cache_key(app, *job) for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    status, body, mimetype = future.result()
+                    ok = status == 200
+                    if ok:
+                        response_cache.put(futures[future], body, mimetype)
+                except Exception:
+                    app.logger.exception('Chart warm-up job failed')
+                    ok = False
+                with _state_lock:
+                    _state['done' if ok else 'failed'] += 1
+    except Exception:
+        app.logger.exception('Chart warm-up aborted')
+    finally:
+        with _state_lock:
+            _state['finished'] = True
+    app.logger.info('Chart warm-up finished: %(done)d built, %(failed)d failed', _state)
+
+
+def start_warmup(app, wait=False):
+    # wait=True warms up in the calling thread and returns when done
+    if _in_worker:
+        return None
+    with _state_lock:
+        _state['enabled'] = True
+    if wait:
+        _run(app)
+        return None
+    thread = threading.Thread(target=_run, args=(app,), name='chart-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+@warmup_bp.route('/ready')
+def ready():
+    with _state_lock:
+        state = dict(_state)
+    state['ready'] = not state['enabled'] or state['finished']
+    state['pid'] = os.getpid()
+    state['startup_seconds'] = current_app.config.get('STARTUP_SECONDS')
+    state['datasets'] = dataset_stats()
+    return jsonify(state), 200 if state['ready'] else 503
@@ -0,0 +1,240 @@
+import re
+import zipfile
+from functools import lru_cache
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+
+from data_cache import cached_frame, file_checksum
+from response_cache import file_signature
+
+# Water quality surveys. Sources are listed in order of precedence: the
+# workbook keeps censored readings such as '>100' that the CSV exports
+# flattened to plain numbers, and the CSVs fill in anything it lacks.
+WORKBOOK = 'WQ  2021-23.xlsx'
+SURVEY_CSVS = {2021: 'WQ2021.csv', 2022: 'WQ2022.csv', 2023: 'WQ2023.csv'}
+SOURCE_FILES = (WORKBOOK,) + tuple(SURVEY_CSVS.values())
+
+# Source column names (compared case-insensitively) of the sample fields
+SAMPLE_COLUMNS = {'sample id': 'sample', 's.no': 'sample', 'name': 'name',
+                  'longitude': 'lon', 'latitude': 'lat'}
+# Canonical parameter names and units; sources are matched case-insensitively
+PARAMETERS = {
+    'Turbidity': 'NTU',
+    'pH': '',
+    'Conductivity': 'µS/cm',
+    'DO': '% saturation',
+    'Alkalinity': 'mg/L as CaCO3',
+    'Hardness': 'mg/L as CaCO3',
+    'Calcium': 'mg/L',
+    'Magnesium': 'mg/L',
+    'Chloride': 'mg/L',
+    'Fluoride': 'mg/L',
+    'Nitrate': 'mg/L',
+    'Nitrite': 'mg/L',
+    'Ammonia': 'mg/L',
+    'Phosphate': 'mg/L',
+    'Iron': 'mg/L',
+    'Total Chlorine': 'mg/L',
+    'Free Chlorine': 'mg/L',
+}
+PARAMETER_ALIASES = {name.lower(): name for name in PARAMETERS}
+# Source columns whose values need scaling into the canonical unit, as
+# {(year, source column): factor}; all current surveys report canonical units
+UNIT_FACTORS = {}
+
+# Samples from different years within this distance are the same well
+WELL_MATCH_METRES = 25.0
+LONG_COLUMNS = ['year', 'sample', 'well', 'name', 'lon', 'lat', 'parameter', 'value', 'qualifier',
+                'unit', 'source']
+
+_VALUE = re.compile(r'^\s*([<>]=?)?\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*$')
+_XLSX = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_RELS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+def _column_index(ref):
+    index = 0
+    for letter in re.match(r'[A-Z]+', ref).group():
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def read_xlsx(path):
+    # {sheet name: DataFrame of cell text, first row as header}. Reads the
+    # sheet XML directly: the workbooks are plain value tables, and this
+    # avoids an Excel engine dependency.
+    with zipfile.ZipFile(path) as book:
+        names = set(book.namelist())
+        strings = []
+        if 'xl/sharedStrings.xml' in names:
+            for item in ElementTree.fromstring(book.read('xl/sharedStrings.xml')):
+                strings.append(''.join(t.text or '' for t in item.iter(_XLSX + 't')))
+        rels = ElementTree.fromstring(book.read('xl/_rels/workbook.xml.rels'))
+        targets = {rel.get('Id'): rel.get('Target') for rel in rels}
+        workbook = ElementTree.fromstring(book.read('xl/workbook.xml'))
+
+        sheets = {}
+        for sheet in workbook.iter(_XLSX + 'sheet'):
+            target = targets[sheet.get(_RELS + 'id')].lstrip('/')
+            target = target if target.startswith('xl/') else 'xl/' + target
+            rows = []
+            for row in ElementTree.fromstring(book.read(target)).iter(_XLSX + 'row'):
+                cells = {}
+                for cell in row.iter(_XLSX + 'c'):
+                    kind = cell.get('t')
+                    if kind == 'inlineStr':
+                        value = ''.join(t.text or '' for t in cell.iter(_XLSX + 't'))
+                    else:
+                        node = cell.find(_XLSX + 'v')
+                        value = None if node is None else node.text
+                        if kind == 's' and value is not None:
+                            value = strings[int(value)]
+                    cells[_column_index(cell.get('r'))] = value
+                rows.append(cells)
+            if not rows:
+                continue
+            width = max(max(r, default=-1) for r in rows) + 1
+            table = [[r.get(i) for i in range(width)] for r in rows]
+            header = [str(h).strip() if h is not None else f'column{i}' for i, h in enumerate(table[0])]
+            sheets[sheet.get('name')] = pd.DataFrame(table[1:], columns=header)
+    return sheets
+
+
+def parse_values(values):
+    # Numeric value and censoring qualifier ('', '<', '>', ...) of raw cells
+    text = pd.Series(values, dtype=object).astype(str)
+    parts = text.str.extract(_VALUE)
+    return pd.to_numeric(parts[1], errors='coerce').to_numpy(), parts[0].fillna('').to_numpy()
+
+
+def to_long(df, year, source):
+    # One survey table in the canonical long format (without wells)
+    renamed, params = {}, {}
+    for column in df.columns:
+        key = str(column).strip().lower()
+        if key in SAMPLE_COLUMNS:
+            renamed[column] = SAMPLE_COLUMNS[key]
+        elif key in PARAMETER_ALIASES:
+            params[column] = PARAMETER_ALIASES[key]
+    df = df.rename(columns=renamed)
+    if 'name' not in df:
+        df['name'] = None
+
+    base = pd.DataFrame({
+        'sample': df['sample'].astype(str).str.strip().str.removesuffix('.0'),
+        'name': df['name'].where(df['name'].notna(), None),
+        'lon': pd.to_numeric(df['lon'], errors='coerce'),
+        'lat': pd.to_numeric(df['lat'], errors='coerce'),
+    })
+    frames = []
+    for column, param in params.items():
+        value, qualifier = parse_values(df[column].to_numpy())
+        frame = base.assign(parameter=param, value=value * UNIT_FACTORS.get((year, column), 1.0),
+                            qualifier=qualifier, unit=PARAMETERS[param])
+        frames.append(frame[frame['value'].notna()])
+    long = pd.concat(frames, ignore_index=True)
+    long.insert(0, 'year', year)
+    long['source'] = source
+    return long
+
+
+def _survey_tables():
+    # (year, table, source label) from every source, in order of precedence
+    tables = []
+    for name, sheet in read_xlsx(WORKBOOK).items():
+        if name.strip().isdigit():
+            tables.append((int(name.strip()), sheet, f'{WORKBOOK}:{name.strip()}'))
+    for year, path in SURVEY_CSVS.items():
+        tables.append((year, pd.read_csv(path, dtype=str), path))
+    return tables
+
+
+def match_wells(samples, radius=WELL_MATCH_METRES):
+    # Well id for each (year, sample) location: samples are matched to the
+    # nearest well seen in earlier years within `radius`, closest pairs
+    # first and at most one sample per well and year
+    lat0 = np.radians(samples['lat'].mean())
+    xy = np.column_stack([samples['lon'] * 111320.0 * np.cos(lat0), samples['lat'] * 110540.0])
+    wells = np.full(len(samples), -1)
+    positions = np.empty((0, 2))
+    for year in sorted(samples['year'].unique()):
+        rows = np.flatnonzero(samples['year'].to_numpy() == year)
+        if len(positions):
+            d = np.sqrt(((xy[rows, None, :] - positions[None, :, :]) ** 2).sum(axis=2))
+            pairs = np.argwhere(d <= radius)
+            taken = set()
+            for r, w in pairs[np.argsort(d[pairs[:, 0], pairs[:, 1]], kind='stable')]:
+                if wells[rows[r]] < 0 and w not in taken:
+                    wells[rows[r]] = w
+                    taken.add(w)
+        new = rows[wells[rows] < 0]
+        wells[new] = len(positions) + np.arange(len(new))
+        positions = np.vstack([positions, xy[new]])
+    return wells
+
+
+def build_long_table():
+    frames = [to_long(table, year, source) for year, table, source in _survey_tables()]
+    long = pd.concat(frames, ignore_index=True)
+    # The first source to report a sample's parameter wins
+    long = long.drop_duplicates(['year', 'sample', 'parameter'], keep='first')
+
+    samples = long.drop_duplicates(['year', 'sample'])[['year', 'sample', 'lon', 'lat']].dropna()
+    samples = samples.reset_index(drop=True).assign(well=lambda s: match_wells(s))
+    long = long.merge(samples[['year', 'sample', 'well']], on=['year', 'sample'], how='left')
+    long['well'] = long['well'].fillna(-1).astype(np.int32)
+    long['year'] = long['year'].astype(np.int16)
+    # Sorted by well so per-well trends are one contiguous slice
+    long = long.sort_values(['well', 'parameter', 'year'], kind='stable').reset_index(drop=True)
+    return long[LONG_COLUMNS]
+
+
+def data_version():
+    return file_signature(*SOURCE_FILES)
+
+
+def load_surveys():
+    return _load_surveys(data_version())
+
+
+# The canonical table, rebuilt (and the workbook parsed) only when a
+# source file changes; otherwise read back from the columnar cache
+@lru_cache(maxsize=1)
+def _load_surveys(version):
+    checksums = []
+    for path in SOURCE_FILES:
+        with open(path, 'rb') as f:
+            checksums.append(file_checksum(f.read()))
+    key = ' '.join(checksums).encode()
+    long = cached_frame('water_quality_surveys', key, build_long_table)
+    starts = np.flatnonzero(np.r_[True, long['well'].to_numpy()[1:] != long['well'].to_numpy()[:-1]])
+    bounds = dict(zip(long['well'].to_numpy()[starts], zip(starts, np.r_[starts[1:], len(long)])))
+    return long, bounds
+
+
+def survey_values(year, parameter):
+    # Samples of one parameter in one survey year
+    long, _ = load_surveys()
+    return long[(long['year'] == year) & (long['parameter'] == parameter)]
+
+
+def well_history(well):
+    # Every reading at one well across the surveys, by parameter and year
+    long, bounds = load_surveys()
+    start, end = bounds.get(well, (0, 0))
+    return long.iloc[start:end]
+
+
+def wells():
+    # One row per matched well: position (latest survey), name and years
+    long, _ = load_surveys()
+    located = long[long['well'] >= 0].sort_values('year', kind='stable')
+    grouped = located.groupby('well')
+    return pd.DataFrame({
+        'lon': grouped['lon'].last(),
+        'lat': grouped['lat'].last(),
+        'name': grouped['name'].last(),
+        'years': grouped['year'].unique().map(lambda years: sorted(int(y) for y in years)),
+    })